@@ -1,33 +1,235 @@
-import bisect
+import hashlib
 import logging
 import logging.config
+import math
+import os
+import tempfile
+import time
 from calendar import monthrange
 from datetime import date, datetime, timedelta
 
+import click
+import numpy as np
 import requests
-from flask import json, request, Flask
-from werkzeug.exceptions import HTTPException
+from flask import g, json, request, Flask, Response
+from werkzeug.exceptions import BadGateway, BadRequest, HTTPException, NotFound
+from werkzeug.http import quote_etag
 
+import metrics
+from cache import (
+    DailyCache,
+    FileBackend,
+    MemoryBackend,
+    RedisBackend,
+    utc_today,
+)
+from dumps import DumpStore
+from pageviews import Freshness, PageviewsService, response_freshness
 from schemas import (
+    GetArticleRangeRequest,
+    GetArticlesBatchRangeRequest,
     GetArticleTopDayRequest,
+    GetMostViewedArticlesRangeRequest,
     GetMostViewedArticlesRequest,
-    GetTotalArticleViewsRequest
+    GetTotalArticleViewsBatchRequest,
+    GetTotalArticleViewsRequest,
+    GetTrendingArticlesRangeRequest,
+    GetTrendingArticlesRequest,
+    validate_percentiles
+)
+from store import (
+    align,
+    rank,
+    split_article_key,
+    TitleTable,
+    TopArticlesStore,
+)
+from upstream import (
+    deadline_after,
+    request_deadline,
+    UpstreamScheduler,
+    WIKIMEDIA_ACCESS_PARAM,
+    WIKIMEDIA_AGENT_PARAM,
+    WIKIMEDIA_BASE_URL,
+    WIKIMEDIA_PROJECT_PARAM,
+    WikimediaClient,
 )
+from warmup import Warmer
 
 
 logging.config.fileConfig("logging.conf")
 LOGGER = logging.getLogger("pageviewsApi")
-USER_AGENT_HEADER = {'User-Agent': 'pageviewsAPI/0.0 (ka.cox@outlook.com)'}
 V1_BASE_URL = "/api/v1"
-WIKIMEDIA_BASE_URL = "https://wikimedia.org/api/rest_v1"
-WIKIMEDIA_TOP_PATH = "/metrics/pageviews/top"
-WIKIMEDIA_ACCESS_PARAM = "all-access"
-WIKIMEDIA_AGENT_PARAM = "all-agents"
-WIKIMEDIA_GRANULARITY_PARAM = "daily"
-WIKIMEDIA_PROJECT_PARAM = "en.wikipedia"
-WIKIMEDIA_TIME_FORMAT = "%Y%m%d"
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Number of articles per chunk of a streamed /articles/top response.
+NDJSON_CHUNK_SIZE = 100
+# Seconds clients and proxies may keep responses whose data is final.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
 
 app = Flask(__name__)
+app.config.from_mapping(
+    # Upper bound on concurrent requests made to Wikimedia while serving a
+    # single API request.
+    WIKIMEDIA_MAX_IN_FLIGHT=10,
+    WIKIMEDIA_BASE_URL=WIKIMEDIA_BASE_URL,
+    # Connection pooling and timeouts (in seconds) for the shared Wikimedia
+    # client.
+    WIKIMEDIA_POOL_CONNECTIONS=10,
+    WIKIMEDIA_POOL_MAXSIZE=10,
+    WIKIMEDIA_CONNECT_TIMEOUT=3.05,
+    WIKIMEDIA_READ_TIMEOUT=10,
+    # Pacing of the requests made to Wikimedia (requests per second, in
+    # bursts of up to WIKIMEDIA_RATE_BURST) and retries of the failed ones
+    # after a jittered exponential backoff (in seconds).
+    WIKIMEDIA_RATE_LIMIT=100,
+    WIKIMEDIA_RATE_BURST=20,
+    WIKIMEDIA_MAX_RETRIES=3,
+    WIKIMEDIA_BACKOFF_BASE=0.25,
+    WIKIMEDIA_BACKOFF_MAX=8,
+    # Seconds an API request may spend waiting on Wikimedia, retries
+    # included (None for no limit).
+    REQUEST_TIME_BUDGET=30,
+    # Size of the in-memory cache of daily Wikimedia results (roughly the
+    # number of articles held), optional directory for the on-disk tier and
+    # lifetime in seconds of entries for days that may still change.
+    CACHE_MAX_SIZE=500_000,
+    CACHE_DIR=None,
+    CACHE_RECENT_TTL=300,
+    # Seconds past their expiry during which cached entries are served as
+    # is while they are refreshed in the background, and during which they
+    # are still served when refreshing them fails.
+    CACHE_STALE_WHILE_REVALIDATE=60,
+    CACHE_STALE_IF_ERROR=86400,
+    # Size of the in-memory cache of whole-month top articles aggregates.
+    MONTH_CACHE_MAX_SIZE=200_000,
+    # Number of elapsed days of article views kept indexed in memory, from
+    # which totals and top days over any of their ranges are answered.
+    ARTICLE_INDEX_MAX_SIZE=1_000_000,
+    # Where both caches keep their entries: "memory" (in each process),
+    # "file" (under CACHE_SHARED_DIR, shared by the processes of a host) or
+    # "redis" (on the server at CACHE_REDIS_URL), and bytes the files of
+    # each cache may take up before the least recently used are removed.
+    CACHE_BACKEND="memory",
+    CACHE_SHARED_DIR=os.path.join(tempfile.gettempdir(), "pageviews_cache"),
+    CACHE_SHARED_MAX_BYTES=1 << 30,
+    CACHE_REDIS_URL="redis://localhost:6379/0",
+    # SQLite database of the views ingested from Wikimedia's dump files with
+    # `flask ingest`, served for the days it covers (None to disable), and
+    # number of each day's most viewed articles ranked on ingestion.
+    DUMPS_DB=None,
+    DUMPS_TOP_ARTICLES=10_000,
+    # Background warm-up of closed days and months: whether it runs, how
+    # often (in seconds) and for how many of a month's top articles the
+    # daily views are fetched as well, for which project, access method and
+    # agent type.
+    WARMUP_ENABLED=False,
+    WARMUP_INTERVAL=3600,
+    WARMUP_TOP_ARTICLES=100,
+    WARMUP_PROJECT=WIKIMEDIA_PROJECT_PARAM,
+    WARMUP_ACCESS=WIKIMEDIA_ACCESS_PARAM,
+    WARMUP_AGENT=WIKIMEDIA_AGENT_PARAM,
+    # Seconds clients and proxies may reuse responses covering days that
+    # may still change, and number of days after which Wikimedia's data for
+    # a day is taken as final, making responses that only cover such days
+    # cacheable for good.
+    HTTP_CACHE_MAX_AGE=300,
+    HTTP_CACHE_SETTLE_DAYS=2,
+    # Whether to record metrics and serve them on /metrics.
+    METRICS_ENABLED=False,
+)
+app.config.from_prefixed_env()
+metrics.REGISTRY.enabled = app.config["METRICS_ENABLED"]
+
+upstream_scheduler = UpstreamScheduler(
+    rate=app.config["WIKIMEDIA_RATE_LIMIT"],
+    burst=app.config["WIKIMEDIA_RATE_BURST"],
+    max_retries=app.config["WIKIMEDIA_MAX_RETRIES"],
+    backoff_base=app.config["WIKIMEDIA_BACKOFF_BASE"],
+    backoff_max=app.config["WIKIMEDIA_BACKOFF_MAX"],
+)
+wikimedia = WikimediaClient(
+    base_url=app.config["WIKIMEDIA_BASE_URL"],
+    pool_connections=app.config["WIKIMEDIA_POOL_CONNECTIONS"],
+    pool_maxsize=app.config["WIKIMEDIA_POOL_MAXSIZE"],
+    connect_timeout=app.config["WIKIMEDIA_CONNECT_TIMEOUT"],
+    read_timeout=app.config["WIKIMEDIA_READ_TIMEOUT"],
+    scheduler=upstream_scheduler,
+)
+top_articles_store = (
+    TopArticlesStore(os.path.join(app.config["CACHE_DIR"], "top"))
+    if app.config["CACHE_DIR"] else None
+)
+# One title table for the whole process: every snapshot, cached or stored,
+# and every service refers to titles by their ID in it. Snapshots cached in
+# shared files keep these IDs, so the table is then shared through a file.
+if top_articles_store:
+    titles = top_articles_store.titles
+elif app.config["CACHE_BACKEND"] == "file":
+    os.makedirs(app.config["CACHE_SHARED_DIR"], exist_ok=True)
+    titles = TitleTable(
+        os.path.join(app.config["CACHE_SHARED_DIR"], "titles.txt")
+    )
+else:
+    titles = TitleTable()
+
+
+def cache_backend(name, max_size):
+    """The backend named by CACHE_BACKEND for the cache called name."""
+    backend = app.config["CACHE_BACKEND"]
+    if backend == "memory":
+        return MemoryBackend(max_size)
+    if backend == "file":
+        return FileBackend(
+            os.path.join(app.config["CACHE_SHARED_DIR"], name),
+            max_bytes=app.config["CACHE_SHARED_MAX_BYTES"],
+        )
+    if backend == "redis":
+        return RedisBackend(
+            app.config["CACHE_REDIS_URL"], titles, prefix=f"pageviews:{name}"
+        )
+    raise ValueError("CACHE_BACKEND must be 'memory', 'file' or 'redis'")
+
+
+daily_cache = DailyCache(
+    directory=app.config["CACHE_DIR"],
+    recent_ttl=app.config["CACHE_RECENT_TTL"],
+    stale_while_revalidate=app.config["CACHE_STALE_WHILE_REVALIDATE"],
+    stale_if_error=app.config["CACHE_STALE_IF_ERROR"],
+    backend=cache_backend("daily", app.config["CACHE_MAX_SIZE"]),
+)
+month_cache = DailyCache(
+    recent_ttl=app.config["CACHE_RECENT_TTL"],
+    stale_while_revalidate=app.config["CACHE_STALE_WHILE_REVALIDATE"],
+    stale_if_error=app.config["CACHE_STALE_IF_ERROR"],
+    name="month",
+    backend=cache_backend("month", app.config["MONTH_CACHE_MAX_SIZE"]),
+)
+dump_store = (
+    DumpStore(
+        app.config["DUMPS_DB"], max_ranked=app.config["DUMPS_TOP_ARTICLES"]
+    )
+    if app.config["DUMPS_DB"] else None
+)
+pageviews = PageviewsService(
+    wikimedia,
+    daily_cache,
+    month_cache,
+    store=top_articles_store,
+    max_in_flight=app.config["WIKIMEDIA_MAX_IN_FLIGHT"],
+    titles=titles,
+    dumps=dump_store,
+    index_max_size=app.config["ARTICLE_INDEX_MAX_SIZE"],
+)
+warmer = Warmer(
+    pageviews,
+    project=app.config["WARMUP_PROJECT"],
+    access=app.config["WARMUP_ACCESS"],
+    agent=app.config["WARMUP_AGENT"],
+    top_articles=app.config["WARMUP_TOP_ARTICLES"],
+    interval=app.config["WARMUP_INTERVAL"],
+)
+if app.config["WARMUP_ENABLED"]:
+    warmer.start()
 
 
 def calculate_days(time_period, year, month, day):
@@ -66,191 +268,817 @@ def calculate_start_and_end_date(time_period, year, month, day):
         raise ValueError("time_period must be 'month' or 'week'")
 
 
-@app.errorhandler(HTTPException)
-def handle_exception(e):
-    """Return JSON instead of HTML for HTTP errors."""
-    # start with the correct headers and status code from the error
-    response = e.get_response()
-    # replace the body with JSON
-    response.data = json.dumps({
-        "code": e.code,
-        "name": e.name,
-        "description": e.description,
-    })
-    response.content_type = "application/json"
-    return response
+def uses_date_range(args):
+    """Whether the request asks for an arbitrary range of dates."""
+    return "start_date" in args or "end_date" in args
 
 
-@app.get(f"{V1_BASE_URL}/articles/top")
-def most_viewed_articles():
+def parse_most_viewed_articles_request(args):
     """
-    Retrieve a list of the most viewed articles for a given week or
-    month.
+    Validate the query of a /articles/top request. Returns the request
+    schema along with the start and end dates it covers.
     """
+    if uses_date_range(args):
+        request_schema = GetMostViewedArticlesRangeRequest(
+            start_date=args.get("start_date"),
+            end_date=args.get("end_date"),
+            limit=args.get("limit"),
+            offset=args.get("offset"),
+            project=args.get("project"),
+            access=args.get("access"),
+            deadline_ms=args.get("deadline_ms"),
+        )
+        return (request_schema, request_schema.start_date,
+                request_schema.end_date)
+
     request_schema = GetMostViewedArticlesRequest(
-        day=request.args.get("day"),
-        month=request.args.get("month"),
-        year=request.args.get("year"),
-        time_period=request.args.get("time_period"),
+        day=args.get("day"),
+        month=args.get("month"),
+        year=args.get("year"),
+        time_period=args.get("time_period"),
+        limit=args.get("limit"),
+        offset=args.get("offset"),
+        project=args.get("project"),
+        access=args.get("access"),
+        deadline_ms=args.get("deadline_ms"),
     )
-
-    days = calculate_days(
+    start_date, end_date = calculate_start_and_end_date(
         request_schema.time_period,
         request_schema.year,
         request_schema.month,
-        request_schema.day
+        request_schema.day,
     )
+    return request_schema, start_date, end_date
+
+
+def ranked_article(request_schema, key):
+    """
+    The title of a ranked article, by its title ID, along with its project
+    when the request spans several, by its article key (see
+    store.article_keys).
+    """
+    if len(request_schema.project) == 1:
+        return {"title": titles.title(key)}
+    position, title_id = split_article_key(key)
+    return {
+        "project": request_schema.project[position],
+        "title": titles.title(title_id),
+    }
+
+
+def ranked_articles(request_schema, title_ids, totals):
+    """
+    Yield the requested page of most viewed articles, most viewed first.
+    Each article's dict is only built when it is reached.
+    """
+    offset = request_schema.offset
+    limit = request_schema.limit
+    with metrics.AGGREGATION_DURATION.time("rank"):
+        ranked = rank(
+            totals, None if limit is None else offset + limit
+        )[offset:]
+    for title_id, views in zip(title_ids[ranked], totals[ranked]):
+        yield {
+            **ranked_article(request_schema, title_id),
+            "total_views": int(views)
+        }
+
+
+def most_viewed_articles_summary(start_date, end_date, title_ids,
+                                 missing_days):
+    """
+    The count and dates of a /articles/top response, along with the days
+    left out of it when it was asked to answer within a deadline.
+    """
+    summary = {
+        "count": len(title_ids),
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+    }
+    if missing_days is not None:
+        summary["missing_days"] = [day.isoformat() for day in missing_days]
+    return summary
+
+
+def most_viewed_articles_response(request_schema, start_date, end_date,
+                                  title_ids, totals, missing_days=None):
+    return {
+        **most_viewed_articles_summary(
+            start_date, end_date, title_ids, missing_days
+        ),
+        "articles": list(ranked_articles(request_schema, title_ids, totals))
+    }
+
+
+def most_viewed_articles_ndjson(request_schema, start_date, end_date,
+                                title_ids, totals, missing_days=None):
+    """
+    Yield a /articles/top response as newline-delimited JSON: a first line
+    with the count and dates, then one line per article, in chunks of
+    NDJSON_CHUNK_SIZE lines.
+    """
+    yield app.json.dumps(most_viewed_articles_summary(
+        start_date, end_date, title_ids, missing_days
+    )) + "\n"
+
+    lines = []
+    for article in ranked_articles(request_schema, title_ids, totals):
+        lines.append(app.json.dumps(article) + "\n")
+        if len(lines) == NDJSON_CHUNK_SIZE:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+def wants_ndjson(accept_mimetypes):
+    """Whether the client asked for newline-delimited JSON."""
+    return accept_mimetypes.best_match(
+        ["application/json", NDJSON_MIMETYPE]
+    ) == NDJSON_MIMETYPE
 
-    article_counts = {}
-    LOGGER.info(f"Making {len(days)} requests to {WIKIMEDIA_BASE_URL}"
-                + f"{WIKIMEDIA_TOP_PATH}")
-    for day in days:
-        formatted_day = str(day.day) if day.day >= 10 else f"0{day.day}"
-        formatted_month = (str(day.month) if day.month >= 10
-                           else f"0{day.month}")
-        resp = requests.get(
-            f"{WIKIMEDIA_BASE_URL}{WIKIMEDIA_TOP_PATH}/"
-            + f"{WIKIMEDIA_PROJECT_PARAM}/{WIKIMEDIA_ACCESS_PARAM}/"
-            + f"{day.year}/{formatted_month}/{formatted_day}",
-            headers=USER_AGENT_HEADER,
+
+def previous_period(start_date, end_date, time_period=None):
+    """
+    Return the start and end dates of the period right before the one from
+    start_date to end_date: the month before for a month, otherwise as many
+    days as it has.
+    """
+    previous_end_date = start_date - timedelta(days=1)
+    if time_period == "month":
+        return previous_end_date.replace(day=1), previous_end_date
+    return previous_end_date - (end_date - start_date), previous_end_date
+
+
+def parse_trending_articles_request(args):
+    """
+    Validate the query of a /articles/trending request. Returns the request
+    schema, the start and end dates it covers and those of the period
+    before, which it is compared to.
+    """
+    if uses_date_range(args):
+        request_schema = GetTrendingArticlesRangeRequest(
+            start_date=args.get("start_date"),
+            end_date=args.get("end_date"),
+            limit=args.get("limit"),
+            offset=args.get("offset"),
+            project=args.get("project"),
+            access=args.get("access"),
+            sort=args.get("sort"),
+        )
+        start_date = request_schema.start_date
+        end_date = request_schema.end_date
+        time_period = None
+    else:
+        request_schema = GetTrendingArticlesRequest(
+            day=args.get("day"),
+            month=args.get("month"),
+            year=args.get("year"),
+            time_period=args.get("time_period"),
+            limit=args.get("limit"),
+            offset=args.get("offset"),
+            project=args.get("project"),
+            access=args.get("access"),
+            sort=args.get("sort"),
         )
+        time_period = request_schema.time_period
+        start_date, end_date = calculate_start_and_end_date(
+            time_period,
+            request_schema.year,
+            request_schema.month,
+            request_schema.day,
+        )
+    return (request_schema, start_date, end_date,
+            *previous_period(start_date, end_date, time_period))
+
 
-        if resp.status_code == 404 and "valid" in resp.json()["detail"]:
-            LOGGER.warning(f"Missing data for {day.year}-{day.month}"
-                           + f"-{day.day}")
-            continue
-        resp.raise_for_status()
-
-        articles = resp.json()["items"][0]["articles"]
-        for article in articles:
-            article_counts[article["article"]] = article_counts.get(
-                article["article"], 0
-            ) + article["views"]
-    final_articles = []
-    for title, views in article_counts.items():
-        element = {"title": title, "total_views": views}
-        bisect.insort(
-            final_articles,
-            element,
-            key=lambda element: -1 * element["total_views"]
+def ranked_trending_articles(request_schema, title_ids, previous, current):
+    """
+    Yield the requested page of trending articles, those whose views rose
+    the most, by difference or by ratio, first. Articles without views in
+    the previous period have no ratio and come last when ranking by it.
+    """
+    offset = request_schema.offset
+    limit = request_schema.limit
+    with metrics.AGGREGATION_DURATION.time("rank"):
+        delta = current - previous
+        ratio = np.divide(
+            current, previous, out=np.full(len(current), np.nan),
+            where=previous > 0,
         )
+        keys = (delta if request_schema.sort == "delta"
+                else np.nan_to_num(ratio, nan=-np.inf))
+        ranked = rank(
+            keys, None if limit is None else offset + limit
+        )[offset:]
+    for position in ranked:
+        yield {
+            **ranked_article(request_schema, title_ids[position]),
+            "views": int(current[position]),
+            "previous_views": int(previous[position]),
+            "delta": int(delta[position]),
+            "ratio": (None if np.isnan(ratio[position])
+                      else float(ratio[position])),
+        }
+
 
+def trending_articles_response(request_schema, start_date, end_date,
+                               previous_start_date, previous_end_date,
+                               previous_range, current_range):
+    """
+    Compare the top articles of a period to those of the period before.
+    Each range is the title IDs and total views returned by
+    top_articles_range.
+    """
+    title_ids, (previous, current) = align(previous_range, current_range)
     return {
-        "count": len(article_counts),
-        "start_date": days[0].isoformat(),
-        "end_date": days[-1].isoformat(),
-        "articles": final_articles
+        "count": len(title_ids),
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "previous_start_date": previous_start_date.isoformat(),
+        "previous_end_date": previous_end_date.isoformat(),
+        "articles": list(ranked_trending_articles(
+            request_schema, title_ids, previous, current
+        ))
     }
 
 
-@app.get(f"{V1_BASE_URL}/articles/total_views")
-def total_article_views():
+def parse_total_article_views_request(args):
     """
-    For an article, get the total views for that article in a given a
-    week or a month.
+    Validate the query of a /articles/total_views request. Returns the
+    request schema along with the start and end dates it covers.
     """
+    if uses_date_range(args):
+        request_schema = GetArticleRangeRequest(
+            start_date=args.get("start_date"),
+            end_date=args.get("end_date"),
+            title=args.get("title"),
+            project=args.get("project"),
+            access=args.get("access"),
+            agent=args.get("agent"),
+        )
+        return (request_schema, request_schema.start_date,
+                request_schema.end_date)
+
     request_schema = GetTotalArticleViewsRequest(
-        day=request.args.get("day"),
-        month=request.args.get("month"),
-        year=request.args.get("year"),
-        time_period=request.args.get("time_period"),
-        title=request.args.get("title"),
+        day=args.get("day"),
+        month=args.get("month"),
+        year=args.get("year"),
+        time_period=args.get("time_period"),
+        title=args.get("title"),
+        project=args.get("project"),
+        access=args.get("access"),
+        agent=args.get("agent"),
     )
-
     start_date, end_date = calculate_start_and_end_date(
         request_schema.time_period,
         request_schema.year,
         request_schema.month,
         request_schema.day,
     )
+    return request_schema, start_date, end_date
+
 
-    LOGGER.info(f"Requesting with start date: {start_date} and "
-                + f"end date: {end_date}")
-    resp = requests.get(
-        f"{WIKIMEDIA_BASE_URL}/metrics/pageviews/per-article/"
-        + f"{WIKIMEDIA_PROJECT_PARAM}/{WIKIMEDIA_ACCESS_PARAM}/"
-        + f"{WIKIMEDIA_AGENT_PARAM}/{request_schema.title}/"
-        + f"{WIKIMEDIA_GRANULARITY_PARAM}/"
-        + f"{start_date.strftime(WIKIMEDIA_TIME_FORMAT)}/"
-        + f"{end_date.strftime(WIKIMEDIA_TIME_FORMAT)}",
-        headers=USER_AGENT_HEADER,
+def total_article_views_response(request_schema, start_date, end_date,
+                                 series):
+    return {
+        "title": request_schema.title,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "total_views": series.total()
+    }
+
+
+def parse_article_series_request(args):
+    """
+    Validate the query of a /articles/series request. Returns the request
+    schema, the start and end dates it covers and the percentiles to
+    report.
+    """
+    request_schema, start_date, end_date = (
+        parse_total_article_views_request(args)
     )
-    if resp.status_code == 404 and "valid" in resp.json()["detail"]:
-        LOGGER.warning(f"No data for year: {request_schema.year}, "
-                       + f"month: {request_schema.month}")
-        return {
-            "title": request_schema.title,
-            "start_date": start_date.isoformat(),
-            "end_date": end_date.isoformat(),
-            "total_views": 0
-        }
-    else:
-        resp.raise_for_status()
+    percentiles = validate_percentiles(args.get("percentiles"))
+    return request_schema, start_date, end_date, percentiles
 
-    total_views = 0
-    for entry in resp.json()["items"]:
-        total_views += entry["views"]
+
+def article_series_response(request_schema, start_date, end_date, series,
+                            percentiles):
+    top_day, top_day_views = series.top_day()
+    percentile_views = (series.percentiles(percentiles)
+                        or [None] * len(percentiles))
 
     return {
         "title": request_schema.title,
         "start_date": start_date.isoformat(),
         "end_date": end_date.isoformat(),
-        "total_views": total_views
+        "total_views": series.total(),
+        "mean_views": series.mean(),
+        "top_day": {
+            "date": top_day.isoformat() if top_day else None,
+            "views": top_day_views
+        },
+        "percentiles": {
+            f"{percentile:g}": views
+            for percentile, views in zip(percentiles, percentile_views)
+        },
+        "views": [
+            {"date": day.isoformat(), "views": views}
+            for day, views in series.days()
+        ]
     }
 
 
-@app.get(f"{V1_BASE_URL}/articles/top_day")
-def article_top_day():
+def parse_article_top_day_request(args):
     """
-    For an article in a given month, return which day it got the most
-    views.
+    Validate the query of a /articles/top_day request. Returns the request
+    schema along with the start and end dates it covers.
     """
+    if uses_date_range(args):
+        request_schema = GetArticleRangeRequest(
+            start_date=args.get("start_date"),
+            end_date=args.get("end_date"),
+            title=args.get("title"),
+            project=args.get("project"),
+            access=args.get("access"),
+            agent=args.get("agent"),
+        )
+        return (request_schema, request_schema.start_date,
+                request_schema.end_date)
+
     request_schema = GetArticleTopDayRequest(
-        month=request.args.get("month"),
-        year=request.args.get("year"),
-        title=request.args.get("title"),
+        month=args.get("month"),
+        year=args.get("year"),
+        title=args.get("title"),
+        project=args.get("project"),
+        access=args.get("access"),
+        agent=args.get("agent"),
     )
-
     start_date, end_date = calculate_start_and_end_date(
         "month",
         request_schema.year,
         request_schema.month,
         None,
     )
+    return request_schema, start_date, end_date
 
-    LOGGER.info(f"Requesting with start date: {start_date} and "
-                + f"end date: {end_date}")
-    resp = requests.get(
-        f"{WIKIMEDIA_BASE_URL}/metrics/pageviews/per-article/"
-        + f"{WIKIMEDIA_PROJECT_PARAM}/{WIKIMEDIA_ACCESS_PARAM}/"
-        + f"{WIKIMEDIA_AGENT_PARAM}/{request_schema.title}/"
-        + f"{WIKIMEDIA_GRANULARITY_PARAM}/"
-        + f"{start_date.strftime(WIKIMEDIA_TIME_FORMAT)}/"
-        + f"{end_date.strftime(WIKIMEDIA_TIME_FORMAT)}",
-        headers=USER_AGENT_HEADER,
-    )
-    if resp.status_code == 404 and "valid" in resp.json()["detail"]:
-        LOGGER.warning(f"No data for year: {request_schema.year}, "
-                       + f"month: {request_schema.month}")
-        return {
-          "title": request_schema.title,
-          "date": None,
-          "views": 0
-        }
-    else:
-        resp.raise_for_status()
-
-    most_views = 0
-    most_viewed_day = None
-    for entry in resp.json()["items"]:
-        if entry["views"] > most_views:
-            most_views = entry["views"]
-            most_viewed_day = entry["timestamp"]
 
-    most_viewed_day = datetime.strptime(most_viewed_day, "%Y%m%d00")
+def article_top_day_response(request_schema, series):
+    most_viewed_day, most_views = series.top_day()
 
     return {
         "title": request_schema.title,
-        "date": most_viewed_day.strftime("%Y-%m-%d"),
+        "date": most_viewed_day.isoformat() if most_viewed_day else None,
         "views": most_views
     }
+
+
+def freshness_headers(freshness):
+    """
+    Headers telling whether a response was computed from stale data, and
+    how many seconds past its expiry the stalest of it was.
+    """
+    headers = {"X-Data-Freshness": freshness.state}
+    if freshness.state != "fresh":
+        headers["X-Data-Staleness"] = str(math.ceil(freshness.staleness))
+    return headers
+
+
+def article_dimensions(request_schema):
+    """The projects, access method and agent type an article request is for."""
+    return (request_schema.project, request_schema.access,
+            request_schema.agent)
+
+
+def most_viewed_articles_query(path, request_schema, start_date, end_date,
+                               ndjson):
+    """Resolved query of a /articles/top request, for its ETag."""
+    return [path, start_date, end_date, request_schema.limit,
+            request_schema.offset, request_schema.project,
+            request_schema.access, request_schema.deadline_ms is not None,
+            ndjson]
+
+
+def trending_articles_query(path, request_schema, start_date, end_date):
+    """Resolved query of a /articles/trending request, for its ETag."""
+    return [path, start_date, end_date, request_schema.limit,
+            request_schema.offset, request_schema.project,
+            request_schema.access, request_schema.sort]
+
+
+def article_query(path, request_schema, start_date, end_date, *extra):
+    """Resolved query of a request about an article, for its ETag."""
+    return [path, request_schema.title, start_date, end_date,
+            *article_dimensions(request_schema), *extra]
+
+
+def period_is_final(end_date):
+    """
+    Whether Wikimedia's data for a period ending on end_date is taken as
+    final, so that responses covering it never change.
+    """
+    settle_days = app.config["HTTP_CACHE_SETTLE_DAYS"]
+    return (utc_today() - end_date).days > settle_days
+
+
+def query_etag(query, final):
+    """
+    ETag of the response to a resolved query, a list of the request path and
+    of the parameters it resolved to. Responses that may still change get a
+    new ETag every HTTP_CACHE_MAX_AGE seconds.
+    """
+    if not final:
+        query = [*query, int(time.time()) // app.config["HTTP_CACHE_MAX_AGE"]]
+    payload = json.dumps(query, default=str).encode()
+    return hashlib.sha256(payload).hexdigest()[:32]
+
+
+def cache_headers(etag, final):
+    if final:
+        cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = f"public, max-age={app.config['HTTP_CACHE_MAX_AGE']}"
+    return {"ETag": quote_etag(etag), "Cache-Control": cache_control}
+
+
+def not_modified_headers(if_none_match, query, end_date):
+    """
+    Headers of a 304 response when one of the ETags the client sent in
+    If-None-Match is still that of the response to the query, otherwise
+    None. Nothing is computed or fetched to tell.
+    """
+    for final in ([True, False] if period_is_final(end_date) else [False]):
+        etag = query_etag(query, final)
+        if if_none_match.contains_weak(etag):
+            return cache_headers(etag, final)
+    return None
+
+
+def response_cache_headers(query, end_date, freshness):
+    """
+    ETag and Cache-Control headers of the response to a query. Responses
+    computed from stale or incomplete data are not to be reused without
+    revalidation.
+    """
+    if freshness.state != "fresh" or not freshness.complete:
+        return {"Cache-Control": "no-cache"}
+    final = period_is_final(end_date)
+    return cache_headers(query_etag(query, final), final)
+
+
+def error_details(e):
+    """Describe an HTTP error the way handle_exception does."""
+    return {
+        "code": e.code,
+        "name": e.name,
+        "description": e.description,
+    }
+
+
+def parse_month(value):
+    try:
+        parsed = datetime.strptime(value, "%Y-%m")
+    except ValueError:
+        raise click.BadParameter(f"'{value}' is not formatted as YYYY-MM")
+    return parsed.year, parsed.month
+
+
+@app.cli.command("backfill")
+@click.argument("start_month")
+@click.argument("end_month", required=False)
+def backfill(start_month, end_month):
+    """
+    Precompute the top articles of every month from START_MONTH to
+    END_MONTH (YYYY-MM, defaults to START_MONTH).
+    """
+    start = parse_month(start_month)
+    end = parse_month(end_month) if end_month else start
+    incomplete = warmer.backfill(start, end)
+    for year, month in incomplete:
+        click.echo(f"{year}-{month:02}: data incomplete, not precomputed")
+    click.echo("Backfill finished")
+
+
+@app.cli.command("ingest")
+@click.argument("files", nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+@click.option("--project", "projects", multiple=True,
+              help="Only keep this project's views (may be repeated).")
+def ingest(files, projects):
+    """
+    Ingest pageview dump FILES (daily pageviews-YYYYMMDD-user.bz2 files or
+    hourly pageviews-YYYYMMDD-HH0000.gz files) into DUMPS_DB.
+    """
+    if not dump_store:
+        raise click.UsageError("Set DUMPS_DB to ingest dump files")
+    try:
+        ingested = dump_store.ingest(files, projects=set(projects) or None)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    click.echo(f"Ingested {len(ingested)} of {len(files)} files")
+
+
+@app.before_request
+def start_timer():
+    if metrics.REGISTRY.enabled:
+        g.request_started = time.perf_counter()
+
+
+@app.before_request
+def start_deadline():
+    g.deadline_token = request_deadline.set(
+        deadline_after(app.config["REQUEST_TIME_BUDGET"])
+    )
+    g.freshness = Freshness()
+    g.freshness_token = response_freshness.set(g.freshness)
+
+
+@app.teardown_request
+def clear_deadline(exc):
+    if "deadline_token" in g:
+        request_deadline.reset(g.pop("deadline_token"))
+    if "freshness_token" in g:
+        response_freshness.reset(g.pop("freshness_token"))
+
+
+@app.after_request
+def add_freshness_headers(response):
+    if ("freshness" in g and response.status_code < 400
+            and request.path.startswith(V1_BASE_URL)):
+        response.headers.update(freshness_headers(g.freshness))
+    return response
+
+
+@app.after_request
+def record_request_duration(response):
+    if metrics.REGISTRY.enabled and "request_started" in g:
+        metrics.REQUEST_DURATION.observe(
+            time.perf_counter() - g.request_started,
+            request.url_rule.rule if request.url_rule else "unmatched",
+            request.method,
+            response.status_code,
+        )
+    return response
+
+
+@app.errorhandler(HTTPException)
+def handle_exception(e):
+    """Return JSON instead of HTML for HTTP errors."""
+    # start with the correct headers and status code from the error
+    response = e.get_response()
+    # replace the body with JSON
+    response.data = json.dumps(error_details(e))
+    response.content_type = "application/json"
+    return response
+
+
+def conditional_response(query, end_date, respond):
+    """
+    Answer with a 304 when the client's copy of the response to the query
+    is still valid, otherwise with the response respond() returns, along
+    with its ETag and Cache-Control headers.
+    """
+    headers = not_modified_headers(request.if_none_match, query, end_date)
+    if headers:
+        return Response(status=304, headers=headers)
+    response = app.make_response(respond())
+    response.headers.update(
+        response_cache_headers(query, end_date, g.freshness)
+    )
+    return response
+
+
+@app.get(f"{V1_BASE_URL}/articles/top")
+def most_viewed_articles():
+    """
+    Retrieve a list of the most viewed articles for a given week, month
+    or range of dates. The list is streamed as newline-delimited JSON when
+    the client accepts it.
+    """
+    request_schema, start_date, end_date = (
+        parse_most_viewed_articles_request(request.args)
+    )
+    ndjson = wants_ndjson(request.accept_mimetypes)
+
+    def respond():
+        missing_days = None
+        if request_schema.deadline_ms is None:
+            title_ids, totals = pageviews.top_articles_range(
+                start_date, end_date, request_schema.project,
+                request_schema.access,
+            )
+        else:
+            title_ids, totals, missing_days = (
+                pageviews.top_articles_range_within(
+                    start_date, end_date, request_schema.deadline_ms / 1000,
+                    request_schema.project, request_schema.access,
+                )
+            )
+        if ndjson:
+            return Response(
+                most_viewed_articles_ndjson(
+                    request_schema, start_date, end_date, title_ids, totals,
+                    missing_days,
+                ),
+                mimetype=NDJSON_MIMETYPE,
+            )
+        return most_viewed_articles_response(
+            request_schema, start_date, end_date, title_ids, totals,
+            missing_days,
+        )
+
+    response = conditional_response(
+        most_viewed_articles_query(
+            request.path, request_schema, start_date, end_date, ndjson
+        ),
+        end_date,
+        respond,
+    )
+    response.vary.add("Accept")
+    return response
+
+
+@app.get(f"{V1_BASE_URL}/articles/trending")
+def trending_articles():
+    """
+    Rank the top articles of a given week, month or range of dates by how
+    much their views rose since the period of the same length before it.
+    """
+    (request_schema, start_date, end_date, previous_start_date,
+     previous_end_date) = parse_trending_articles_request(request.args)
+
+    def respond():
+        previous_range, current_range = pageviews.top_articles_ranges(
+            [(previous_start_date, previous_end_date),
+             (start_date, end_date)],
+            request_schema.project,
+            request_schema.access,
+        )
+        return trending_articles_response(
+            request_schema, start_date, end_date, previous_start_date,
+            previous_end_date, previous_range, current_range,
+        )
+
+    return conditional_response(
+        trending_articles_query(
+            request.path, request_schema, start_date, end_date
+        ),
+        end_date,
+        respond,
+    )
+
+
+@app.get(f"{V1_BASE_URL}/articles/total_views")
+def total_article_views():
+    """
+    For an article, get the total views for that article in a given a
+    week, month or range of dates.
+    """
+    request_schema, start_date, end_date = (
+        parse_total_article_views_request(request.args)
+    )
+
+    def respond():
+        series = pageviews.indexed_series(
+            request_schema.title, start_date, end_date,
+            *article_dimensions(request_schema)
+        )
+        return total_article_views_response(
+            request_schema, start_date, end_date, series
+        )
+
+    return conditional_response(
+        article_query(request.path, request_schema, start_date, end_date),
+        end_date,
+        respond,
+    )
+
+
+@app.post(f"{V1_BASE_URL}/articles/total_views:batch")
+def total_article_views_batch():
+    """
+    For many articles, get the total views of each in a given week, month
+    or range of dates. Lookups that fail are reported per article.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise BadRequest("Request body must be a JSON object")
+
+    if uses_date_range(body):
+        request_schema = GetArticlesBatchRangeRequest(
+            start_date=body.get("start_date"),
+            end_date=body.get("end_date"),
+            titles=body.get("titles"),
+            project=body.get("project"),
+            access=body.get("access"),
+            agent=body.get("agent"),
+        )
+        start_date = request_schema.start_date
+        end_date = request_schema.end_date
+    else:
+        request_schema = GetTotalArticleViewsBatchRequest(
+            day=body.get("day"),
+            month=body.get("month"),
+            year=body.get("year"),
+            time_period=body.get("time_period"),
+            titles=body.get("titles"),
+            project=body.get("project"),
+            access=body.get("access"),
+            agent=body.get("agent"),
+        )
+        start_date, end_date = calculate_start_and_end_date(
+            request_schema.time_period,
+            request_schema.year,
+            request_schema.month,
+            request_schema.day,
+        )
+
+    def title_total_views(title):
+        try:
+            series = pageviews.indexed_series(
+                title, start_date, end_date,
+                *article_dimensions(request_schema)
+            )
+        except HTTPException as e:
+            return {"title": title, "error": error_details(e)}
+        except requests.RequestException as e:
+            LOGGER.error(f"Failed to get views for {title}: {e}")
+            return {"title": title, "error": error_details(BadGateway(str(e)))}
+        return {"title": title, "total_views": series.total()}
+
+    return {
+        "count": len(request_schema.titles),
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "articles": pageviews.map_concurrently(
+            title_total_views, request_schema.titles
+        )
+    }
+
+
+@app.get(f"{V1_BASE_URL}/articles/top_day")
+def article_top_day():
+    """
+    For an article in a given month or range of dates, return which day
+    it got the most views.
+    """
+    request_schema, start_date, end_date = (
+        parse_article_top_day_request(request.args)
+    )
+
+    def respond():
+        series = pageviews.indexed_series(
+            request_schema.title, start_date, end_date,
+            *article_dimensions(request_schema)
+        )
+        return article_top_day_response(request_schema, series)
+
+    return conditional_response(
+        article_query(request.path, request_schema, start_date, end_date),
+        end_date,
+        respond,
+    )
+
+
+@app.get(f"{V1_BASE_URL}/articles/series")
+def article_series():
+    """
+    For an article, get its daily views in a given week, month or range of
+    dates along with statistics derived from them.
+    """
+    request_schema, start_date, end_date, percentiles = (
+        parse_article_series_request(request.args)
+    )
+
+    def respond():
+        series = pageviews.daily_series(
+            request_schema.title, start_date, end_date,
+            *article_dimensions(request_schema)
+        )
+        return article_series_response(
+            request_schema, start_date, end_date, series, percentiles
+        )
+
+    return conditional_response(
+        article_query(
+            request.path, request_schema, start_date, end_date, percentiles
+        ),
+        end_date,
+        respond,
+    )
+
+
+@app.get(f"{V1_BASE_URL}/warmup")
+def warmup_status():
+    """Report on the background warm-up of closed days and months."""
+    return warmer.status()
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Expose the recorded metrics in the Prometheus text format."""
+    if not metrics.REGISTRY.enabled:
+        raise NotFound()
+    return Response(
+        metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE
+    )
@@ -0,0 +1,371 @@
+import logging
+import time
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import Headers, MIMEAccept, MultiDict
+from werkzeug.exceptions import (
+    HTTPException,
+    InternalServerError,
+    MethodNotAllowed,
+    NotFound,
+)
+from werkzeug.http import parse_accept_header, parse_etags
+
+import metrics
+from app import (
+    app,
+    article_dimensions,
+    article_query,
+    article_series_response,
+    article_top_day_response,
+    daily_cache,
+    dump_store,
+    error_details,
+    freshness_headers,
+    month_cache,
+    most_viewed_articles_ndjson,
+    most_viewed_articles_query,
+    most_viewed_articles_response,
+    NDJSON_MIMETYPE,
+    not_modified_headers,
+    parse_article_series_request,
+    parse_article_top_day_request,
+    parse_most_viewed_articles_request,
+    parse_total_article_views_request,
+    parse_trending_articles_request,
+    response_cache_headers,
+    titles,
+    top_articles_store,
+    total_article_views_response,
+    trending_articles_query,
+    trending_articles_response,
+    upstream_scheduler,
+    V1_BASE_URL,
+    wants_ndjson,
+)
+from pageviews import AsyncPageviewsService, Freshness, response_freshness
+from upstream import AsyncWikimediaClient, deadline
+
+
+LOGGER = logging.getLogger("pageviewsApi")
+
+wikimedia = AsyncWikimediaClient(
+    base_url=app.config["WIKIMEDIA_BASE_URL"],
+    pool_maxsize=app.config["WIKIMEDIA_POOL_MAXSIZE"],
+    connect_timeout=app.config["WIKIMEDIA_CONNECT_TIMEOUT"],
+    read_timeout=app.config["WIKIMEDIA_READ_TIMEOUT"],
+    scheduler=upstream_scheduler,
+)
+pageviews = AsyncPageviewsService(
+    wikimedia,
+    daily_cache,
+    month_cache,
+    store=top_articles_store,
+    max_in_flight=app.config["WIKIMEDIA_MAX_IN_FLIGHT"],
+    titles=titles,
+    dumps=dump_store,
+    index_max_size=app.config["ARTICLE_INDEX_MAX_SIZE"],
+)
+
+
+async def conditional_response(query, end_date, headers, respond):
+    """
+    Answer with a 304 when the client's copy of the response to the query
+    is still valid, otherwise with the body respond() returns. Returns the
+    status code, headers and body of the response.
+    """
+    if_none_match = parse_etags(headers.get("If-None-Match"))
+    cache_headers = not_modified_headers(if_none_match, query, end_date)
+    if cache_headers:
+        return 304, list(cache_headers.items()), None
+    body = await respond()
+    cache_headers = response_cache_headers(
+        query, end_date, response_freshness.get()
+    )
+    return 200, list(cache_headers.items()), body
+
+
+async def most_viewed_articles(path, args, headers):
+    request_schema, start_date, end_date = (
+        parse_most_viewed_articles_request(args)
+    )
+    accept = parse_accept_header(headers.get("Accept"), MIMEAccept)
+    ndjson = wants_ndjson(accept)
+
+    async def respond():
+        missing_days = None
+        if request_schema.deadline_ms is None:
+            title_ids, totals = await pageviews.top_articles_range(
+                start_date, end_date, request_schema.project,
+                request_schema.access,
+            )
+        else:
+            title_ids, totals, missing_days = (
+                await pageviews.top_articles_range_within(
+                    start_date, end_date, request_schema.deadline_ms / 1000,
+                    request_schema.project, request_schema.access,
+                )
+            )
+        if ndjson:
+            return most_viewed_articles_ndjson(
+                request_schema, start_date, end_date, title_ids, totals,
+                missing_days,
+            )
+        return most_viewed_articles_response(
+            request_schema, start_date, end_date, title_ids, totals,
+            missing_days,
+        )
+
+    status, response_headers, body = await conditional_response(
+        most_viewed_articles_query(
+            path, request_schema, start_date, end_date, ndjson
+        ),
+        end_date,
+        headers,
+        respond,
+    )
+    return status, response_headers + [("Vary", "Accept")], body
+
+
+async def trending_articles(path, args, headers):
+    (request_schema, start_date, end_date, previous_start_date,
+     previous_end_date) = parse_trending_articles_request(args)
+
+    async def respond():
+        previous_range, current_range = await pageviews.top_articles_ranges(
+            [(previous_start_date, previous_end_date),
+             (start_date, end_date)],
+            request_schema.project,
+            request_schema.access,
+        )
+        return trending_articles_response(
+            request_schema, start_date, end_date, previous_start_date,
+            previous_end_date, previous_range, current_range,
+        )
+
+    return await conditional_response(
+        trending_articles_query(path, request_schema, start_date, end_date),
+        end_date,
+        headers,
+        respond,
+    )
+
+
+async def total_article_views(path, args, headers):
+    request_schema, start_date, end_date = (
+        parse_total_article_views_request(args)
+    )
+
+    async def respond():
+        series = await pageviews.indexed_series(
+            request_schema.title, start_date, end_date,
+            *article_dimensions(request_schema)
+        )
+        return total_article_views_response(
+            request_schema, start_date, end_date, series
+        )
+
+    return await conditional_response(
+        article_query(path, request_schema, start_date, end_date),
+        end_date,
+        headers,
+        respond,
+    )
+
+
+async def article_top_day(path, args, headers):
+    request_schema, start_date, end_date = (
+        parse_article_top_day_request(args)
+    )
+
+    async def respond():
+        series = await pageviews.indexed_series(
+            request_schema.title, start_date, end_date,
+            *article_dimensions(request_schema)
+        )
+        return article_top_day_response(request_schema, series)
+
+    return await conditional_response(
+        article_query(path, request_schema, start_date, end_date),
+        end_date,
+        headers,
+        respond,
+    )
+
+
+async def article_series(path, args, headers):
+    request_schema, start_date, end_date, percentiles = (
+        parse_article_series_request(args)
+    )
+
+    async def respond():
+        series = await pageviews.daily_series(
+            request_schema.title, start_date, end_date,
+            *article_dimensions(request_schema)
+        )
+        return article_series_response(
+            request_schema, start_date, end_date, series, percentiles
+        )
+
+    return await conditional_response(
+        article_query(
+            path, request_schema, start_date, end_date, percentiles
+        ),
+        end_date,
+        headers,
+        respond,
+    )
+
+
+async def metrics_endpoint(path, args, headers):
+    if not metrics.REGISTRY.enabled:
+        raise NotFound()
+    return 200, [], metrics.REGISTRY.render()
+
+
+ROUTES = {
+    f"{V1_BASE_URL}/articles/top": most_viewed_articles,
+    f"{V1_BASE_URL}/articles/trending": trending_articles,
+    f"{V1_BASE_URL}/articles/total_views": total_article_views,
+    f"{V1_BASE_URL}/articles/top_day": article_top_day,
+    f"{V1_BASE_URL}/articles/series": article_series,
+    "/metrics": metrics_endpoint,
+}
+
+
+async def dispatch(scope):
+    """
+    Run the handler for an HTTP request. Returns the status code, extra
+    headers and body of the response, which is either a dict to send as
+    JSON, the text of the metrics, an iterator of newline-delimited JSON
+    chunks or None for a 304.
+    """
+    try:
+        handler = ROUTES.get(scope["path"])
+        if handler is None:
+            raise NotFound()
+        if scope["method"] != "GET":
+            raise MethodNotAllowed(valid_methods=["GET"])
+
+        args = MultiDict(parse_qsl(
+            scope["query_string"].decode("latin-1"), keep_blank_values=True
+        ))
+        headers = Headers([
+            (name.decode("latin-1"), value.decode("latin-1"))
+            for name, value in scope["headers"]
+        ])
+        freshness = Freshness()
+        token = response_freshness.set(freshness)
+        try:
+            with deadline(app.config["REQUEST_TIME_BUDGET"]):
+                status, response_headers, body = await handler(
+                    scope["path"], args, headers
+                )
+        finally:
+            response_freshness.reset(token)
+        if scope["path"].startswith(V1_BASE_URL):
+            response_headers += freshness_headers(freshness).items()
+        return status, response_headers, body
+    except HTTPException as e:
+        headers = [
+            (name, value) for name, value in e.get_headers()
+            if name.lower() != "content-type"
+        ]
+        return e.code, headers, error_details(e)
+    except Exception:
+        LOGGER.exception(f"Error handling {scope['path']}")
+        return 500, [], error_details(InternalServerError())
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await wikimedia.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """
+    ASGI entry point serving the /api/v1/articles/* GET routes, with
+    non-blocking calls to Wikimedia, and /metrics. Responses, including
+    error JSON, match the Flask app's.
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    started = time.perf_counter()
+    status, headers, body = await dispatch(scope)
+    await send_response(send, status, headers, body)
+    if metrics.REGISTRY.enabled:
+        metrics.REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            scope["path"] if scope["path"] in ROUTES else "unmatched",
+            scope["method"],
+            status,
+        )
+
+
+async def send_response(send, status, headers, body):
+    if body is None:
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (name.lower().encode(), value.encode())
+                for name, value in headers
+            ],
+        })
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    if isinstance(body, str):
+        payload = body.encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", metrics.CONTENT_TYPE.encode()),
+                (b"content-length", str(len(payload)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": payload})
+        return
+
+    if not isinstance(body, dict):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", NDJSON_MIMETYPE.encode())] + [
+                (name.lower().encode(), value.encode())
+                for name, value in headers
+            ],
+        })
+        for chunk in body:
+            await send({
+                "type": "http.response.body",
+                "body": chunk.encode(),
+                "more_body": True,
+            })
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    payload = app.json.dumps(body).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+        ] + [
+            (name.lower().encode(), value.encode())
+            for name, value in headers
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
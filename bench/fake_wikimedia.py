@@ -0,0 +1,209 @@
+"""
+Local stand-in for the Wikimedia pageviews REST API, for benchmarks.
+
+Serves the top and per-article routes with deterministic, generated data
+and can add latency and inject 404 (no data) and 429 (rate limited)
+responses. GET /_stats returns the number of calls served so far, per
+status code, and POST /_reset zeroes them.
+
+    python -m bench.fake_wikimedia --port 8081 --latency-ms 50
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+TOP_PREFIX = "/metrics/pageviews/top/"
+PER_ARTICLE_PREFIX = "/metrics/pageviews/per-article/"
+NO_DATA_DETAIL = ("The date(s) you used are valid, but we either do not "
+                  + "have data for those date(s), or the project you asked "
+                  + "for is not loaded yet.")
+
+
+def stable_fraction(key):
+    """Map a string to a number in [0, 1) that is the same on every run."""
+    return zlib.crc32(key.encode()) / 2 ** 32
+
+
+@lru_cache(maxsize=4096)
+def top_articles_payload(project, access, day, count):
+    """
+    Body of a day's top articles: count articles drawn from a pool of
+    3 * count titles, so that consecutive days overlap but differ.
+    """
+    rng = random.Random(day.toordinal())
+    titles = rng.sample(range(3 * count), count)
+    articles = [
+        {
+            "article": f"Article_{title}",
+            "views": 10_000_000 // (rank + 1) + rng.randrange(1000),
+            "rank": rank + 1,
+        }
+        for rank, title in enumerate(titles)
+    ]
+    return json.dumps({"items": [{
+        "project": project,
+        "access": access,
+        "year": f"{day.year}",
+        "month": f"{day.month:02}",
+        "day": f"{day.day:02}",
+        "articles": articles,
+    }]}).encode()
+
+
+@lru_cache(maxsize=4096)
+def per_article_payload(project, access, agent, title, start, end):
+    items = []
+    day = start
+    while day <= end:
+        items.append({
+            "project": project,
+            "article": title,
+            "granularity": "daily",
+            "timestamp": f"{day.strftime('%Y%m%d')}00",
+            "access": access,
+            "agent": agent,
+            "views": int(stable_fraction(f"{title}{day}") * 100_000),
+        })
+        day += timedelta(days=1)
+    return json.dumps({"items": items}).encode()
+
+
+def parse_date(value):
+    return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+
+
+class FakeWikimedia(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0, jitter_ms=0, articles=1000,
+                 not_found_rate=0, rate_limit_rate=0):
+        """
+        not_found_rate is the share of days (or article ranges) with no
+        data: the same ones on every run. rate_limit_rate is the share of
+        calls answered with a 429, picked at random.
+        """
+        super().__init__(address, Handler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.articles = articles
+        self.not_found_rate = not_found_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def count(self, status):
+        with self.lock:
+            self.calls[status] = self.calls.get(status, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": sum(self.calls.values()),
+                "by_status": {str(k): v for k, v in self.calls.items()},
+            }
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            self.send_json(200, json.dumps(self.server.stats()).encode())
+            return
+
+        server = self.server
+        delay = server.latency_ms + random.uniform(0, server.jitter_ms)
+        if delay:
+            time.sleep(delay / 1000)
+
+        status, body = self.route(self.path.split("?")[0])
+        server.count(status)
+        headers = {"Retry-After": "1"} if status == 429 else {}
+        self.send_json(status, body, headers)
+
+    def do_POST(self):
+        if self.path == "/_reset":
+            self.server.reset()
+            self.send_json(200, b"{}")
+        else:
+            self.send_json(404, b"{}")
+
+    def route(self, path):
+        server = self.server
+        if random.random() < server.rate_limit_rate:
+            return 429, json.dumps({"detail": "Too many requests"}).encode()
+        if stable_fraction(path) < server.not_found_rate:
+            return 404, json.dumps({"detail": NO_DATA_DETAIL}).encode()
+
+        parts = path.split("/")
+        try:
+            if path.startswith(TOP_PREFIX):
+                project, access, year, month, day = parts[-5:]
+                return 200, top_articles_payload(
+                    project, access,
+                    date(int(year), int(month), int(day)), server.articles,
+                )
+            if path.startswith(PER_ARTICLE_PREFIX):
+                project, access, agent, title, _, start, end = parts[-7:]
+                return 200, per_article_payload(
+                    project, access, agent, title,
+                    parse_date(start), parse_date(end),
+                )
+        except ValueError:
+            pass
+        return 400, json.dumps({"detail": "Invalid request"}).encode()
+
+    def send_json(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--articles", type=int, default=1000,
+                        help="number of articles in each day's top list")
+    parser.add_argument("--not-found-rate", type=float, default=0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    server = FakeWikimedia(
+        (args.host, args.port),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        articles=args.articles,
+        not_found_rate=args.not_found_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    # The benchmark runner waits for this line to learn the port.
+    print(f"http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+End-to-end benchmark of the /api/v1/articles/* endpoints.
+
+Starts the fake Wikimedia server in a subprocess, points the app at it,
+serves the app over real HTTP (Flask's threaded server or, with --server
+asgi, uvicorn) and runs each scenario with concurrent clients. Reports
+latency percentiles, requests per second, upstream calls per request and
+the peak RSS of the benchmark process, which serves the app but also runs
+the client threads, and can write the results as JSON and compare them
+with a previous run.
+
+    python -m bench.run --requests 200 --concurrency 8 --output new.json
+    python -m bench.run --compare old.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+import requests
+
+
+SCENARIOS = {
+    "top-week": ("/articles/top", "week"),
+    "top-month": ("/articles/top", "month"),
+    "total_views-week": ("/articles/total_views", "week"),
+    "total_views-month": ("/articles/total_views", "month"),
+    "top_day-week": ("/articles/top_day", "week"),
+    "top_day-month": ("/articles/top_day", "month"),
+}
+# Periods are picked backwards from this week and month, which Wikimedia
+# (and so the fake server) has data for.
+LAST_WEEK_START = date(2023, 12, 25)
+LAST_MONTH = (2023, 12)
+COMPARED_METRICS = ["p50_ms", "p95_ms", "p99_ms", "requests_per_second",
+                    "upstream_calls_per_request"]
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def scenario_params(path, time_period, index, distinct):
+    """
+    Query parameters of the index-th request of a scenario. Requests cycle
+    through `distinct` periods, and articles, so runs mix cache misses and
+    hits the way real traffic does.
+    """
+    period = index % distinct
+    if time_period == "week" and path == "/articles/top_day":
+        # top_day only takes months, or a range of dates.
+        start = LAST_WEEK_START - timedelta(weeks=period)
+        params = {
+            "start_date": start.isoformat(),
+            "end_date": (start + timedelta(days=6)).isoformat(),
+        }
+    elif time_period == "week":
+        start = LAST_WEEK_START - timedelta(weeks=period)
+        params = {"year": start.year, "month": start.month, "day": start.day}
+    else:
+        year, month = LAST_MONTH
+        month -= period
+        while month < 1:
+            year, month = year - 1, month + 12
+        params = {"year": year, "month": month}
+    if "start_date" not in params:
+        params["time_period"] = time_period
+    if path != "/articles/top":
+        params["title"] = f"Article_{period}"
+    return params
+
+
+def free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_wikimedia(args):
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "bench.fake_wikimedia",
+            "--host", args.host,
+            "--latency-ms", str(args.latency_ms),
+            "--jitter-ms", str(args.jitter_ms),
+            "--articles", str(args.articles),
+            "--not-found-rate", str(args.not_found_rate),
+            "--rate-limit-rate", str(args.rate_limit_rate),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    base_url = process.stdout.readline().strip()
+    if not base_url:
+        process.kill()
+        raise RuntimeError("The fake Wikimedia server failed to start")
+    return process, base_url
+
+
+def serve_app(server, host, port):
+    """Serve the app from a background thread. Returns a stop function."""
+    from app import app
+
+    # Per-request logging would dominate the timings.
+    for name in ("werkzeug", "pageviewsApi"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    if server == "asgi":
+        import uvicorn
+
+        import asgi
+
+        config = uvicorn.Config(
+            asgi.application, host=host, port=port, log_level="warning"
+        )
+        uvicorn_server = uvicorn.Server(config)
+        thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+        thread.start()
+        while not uvicorn_server.started:
+            time.sleep(0.01)
+
+        def stop():
+            uvicorn_server.should_exit = True
+            thread.join()
+        return stop
+
+    from werkzeug.serving import make_server
+
+    wsgi_server = make_server(host, port, app, threaded=True)
+    thread = threading.Thread(target=wsgi_server.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        wsgi_server.shutdown()
+        thread.join()
+    return stop
+
+
+def upstream_calls(fake_url):
+    return requests.get(f"{fake_url}/_stats").json()
+
+
+def run_scenario(name, app_url, fake_url, args):
+    import app
+
+    path, time_period = SCENARIOS[name]
+    # Every scenario starts cold.
+    app.daily_cache.clear()
+    app.month_cache.clear()
+    app.pageviews.clear_indexes()
+    if args.server == "asgi":
+        import asgi
+
+        asgi.pageviews.clear_indexes()
+    requests.post(f"{fake_url}/_reset")
+
+    local = threading.local()
+    statuses = {}
+    lock = threading.Lock()
+
+    def send(index):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        params = scenario_params(path, time_period, index, args.distinct)
+        started = time.perf_counter()
+        resp = local.session.get(f"{app_url}/api/v1{path}", params=params)
+        latency = time.perf_counter() - started
+        with lock:
+            statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+        return latency
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = [
+            latency * 1000
+            for latency in executor.map(send, range(args.requests))
+        ]
+    elapsed = time.perf_counter() - started
+    upstream = upstream_calls(fake_url)
+
+    return {
+        "requests": args.requests,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies),
+        "requests_per_second": args.requests / elapsed,
+        "upstream_calls_per_request": upstream["calls"] / args.requests,
+        "upstream_statuses": upstream["by_status"],
+    }
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process: the app along with the client
+    threads and sessions generating the load (but not the fake).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Return the relative change of each metric of every scenario found in
+    both runs, e.g. 0.1 for a 10% increase.
+    """
+    changes = {}
+    for name, metrics in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        changes[name] = {
+            metric: (metrics[metric] - previous[metric]) / previous[metric]
+            for metric in COMPARED_METRICS
+            if previous.get(metric) and metrics.get(metric) is not None
+        }
+    return changes
+
+
+def print_report(results, changes):
+    header = (f"{'scenario':<20}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              + f"{'req/s':>9}{'upstream':>10}")
+    print(header)
+    for name, metrics in results["scenarios"].items():
+        print(f"{name:<20}{metrics['p50_ms']:>9.1f}{metrics['p95_ms']:>9.1f}"
+              + f"{metrics['p99_ms']:>9.1f}"
+              + f"{metrics['requests_per_second']:>9.1f}"
+              + f"{metrics['upstream_calls_per_request']:>10.2f}")
+        for metric, change in changes.get(name, {}).items():
+            print(f"    {metric}: {change:+.1%}")
+    print(f"peak RSS (app and clients): {results['peak_rss_mb']:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--server", choices=["flask", "asgi"],
+                        default="flask")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--scenario", action="append",
+                        choices=sorted(SCENARIOS),
+                        help="scenario to run, may be repeated (default: all)")
+    parser.add_argument("--requests", type=int, default=100,
+                        help="requests sent per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--distinct", type=int, default=4,
+                        help="distinct periods and articles per scenario")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--articles", type=int, default=1000)
+    parser.add_argument("--not-found-rate", type=float, default=0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0)
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="results file of a previous run to compare with")
+    args = parser.parse_args()
+
+    fake, fake_url = start_fake_wikimedia(args)
+    try:
+        # The app reads its settings when first imported.
+        os.environ["FLASK_WIKIMEDIA_BASE_URL"] = fake_url
+        os.environ.pop("FLASK_CACHE_DIR", None)
+        os.environ["FLASK_WARMUP_ENABLED"] = "false"
+
+        port = free_port(args.host)
+        stop = serve_app(args.server, args.host, port)
+        app_url = f"http://{args.host}:{port}"
+        try:
+            scenarios = {
+                name: run_scenario(name, app_url, fake_url, args)
+                for name in args.scenario or SCENARIOS
+            }
+        finally:
+            stop()
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    results = {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "scenarios": scenarios,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    changes = {}
+    if args.compare:
+        with open(args.compare) as f:
+            changes = compare(results, json.load(f))
+        results["changes"] = changes
+
+    print_report(results, changes)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
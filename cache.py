@@ -0,0 +1,525 @@
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from urllib.parse import unquote, urlsplit
+
+import numpy as np
+
+import metrics
+from store import SNAPSHOT_DTYPE
+
+
+LOGGER = logging.getLogger("pageviewsApi")
+MISSING = object()
+# Header of an entry kept outside the process: when the value expires and
+# when it can be dropped (NaN for never), and how the value is encoded.
+ENTRY_HEADER = struct.Struct("<ddc7x")
+# How many entries a FileBackend writes between two sweeps of the entries
+# it can drop.
+SWEEP_INTERVAL = 1000
+
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+def entry_size(value):
+    """
+    Sequences (e.g. a day's top articles) weigh as much as their length.
+    """
+    return len(value) if hasattr(value, "__len__") else 1
+
+
+def encode_key(key):
+    return json.dumps(
+        [part.isoformat() if isinstance(part, date) else part
+         for part in key]
+    )
+
+
+def encode_entry(value, expires_at, drop_at, titles=None):
+    """
+    Encode a cache entry as bytes. Snapshots are written as their raw rows,
+    or, when titles is given, as the titles themselves followed by the
+    views, so that processes with different title tables can read them.
+    Anything else is written as JSON.
+    """
+    times = (math.nan if expires_at is None else expires_at,
+             math.nan if drop_at is None else drop_at)
+    if not isinstance(value, np.ndarray):
+        return ENTRY_HEADER.pack(*times, b"j") + json.dumps(value).encode()
+    if titles is None:
+        return ENTRY_HEADER.pack(*times, b"a") + value.tobytes()
+    names = "\n".join(titles.title(title_id) for title_id in value["id"])
+    return b"".join([
+        ENTRY_HEADER.pack(*times, b"t"),
+        struct.pack("<q", len(value)),
+        value["views"].astype("<i8").tobytes(),
+        names.encode(),
+    ])
+
+
+def decode_entry(data, titles=None):
+    """
+    Decode an entry encoded by encode_entry. Returns the value, when it
+    expires and when it can be dropped. Raw snapshot rows are not copied:
+    the snapshot is a view of data.
+    """
+    expires_at, drop_at, kind = ENTRY_HEADER.unpack_from(data)
+    expires_at = None if math.isnan(expires_at) else expires_at
+    drop_at = None if math.isnan(drop_at) else drop_at
+    offset = ENTRY_HEADER.size
+
+    if kind == b"j":
+        value = json.loads(bytes(data[offset:]))
+    elif kind == b"a":
+        value = np.frombuffer(data, dtype=SNAPSHOT_DTYPE, offset=offset)
+    elif kind == b"t":
+        (count,) = struct.unpack_from("<q", data, offset)
+        offset += 8
+        views = np.frombuffer(data, dtype="<i8", count=count, offset=offset)
+        names = bytes(data[offset + 8 * count:]).decode()
+        value = np.empty(count, dtype=SNAPSHOT_DTYPE)
+        value["id"] = titles.ids_for(names.split("\n") if count else [])
+        value["views"] = views
+    else:
+        raise ValueError(f"Unknown cache entry encoding {kind!r}")
+    return value, expires_at, drop_at
+
+
+class MemoryBackend:
+    """
+    Keeps a cache's entries in this process, in an LRU bounded by max_size
+    (see entry_size).
+    """
+
+    def __init__(self, max_size=500_000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the (value, expires_at) entry for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at, drop_at):
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (value, expires_at)
+            self._size += entry_size(value)
+            while self._size > self.max_size and len(self._entries) > 1:
+                self._evict(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _evict(self, key):
+        value, _ = self._entries.pop(key)
+        self._size -= entry_size(value)
+
+
+class FileBackend:
+    """
+    Keeps a cache's entries as files in a directory that every process of
+    a host can share, ideally on a memory-backed filesystem such as
+    /dev/shm. Entries are memory-mapped when read, so processes share the
+    pages of the snapshots they read instead of each holding a copy.
+
+    Snapshots are written with their title IDs: every process must use the
+    same file-backed TitleTable. Entries past their drop time are removed
+    every SWEEP_INTERVAL writes. When the entries outgrow max_bytes, the
+    least recently read or written are removed until they take up at most
+    TRIM_RATIO of it (None for no bound).
+    """
+
+    TRIM_RATIO = 0.9
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _, _ in self._entries())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            value, expires_at, _ = decode_entry(data)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error):
+            LOGGER.warning(f"Ignoring unreadable cache entry for {key}")
+            return None
+        if self.max_bytes is not None:
+            # Marks the entry as recently used for trim.
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return value, expires_at
+
+    def set(self, key, value, expires_at, drop_at):
+        data = encode_entry(value, expires_at, drop_at)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            self._writes += 1
+            self._size += len(data)
+            sweep = self._writes % SWEEP_INTERVAL == 0
+            trim = (
+                self.max_bytes is not None and self._size > self.max_bytes
+            )
+        if sweep:
+            self.sweep()
+        elif trim:
+            self.trim()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".entry"):
+                self._remove(name)
+        with self._lock:
+            self._size = 0
+
+    def sweep(self):
+        """Remove the entries past their drop time, then trim."""
+        now = time.time()
+        for name, _, _, drop_at in self._entries():
+            if drop_at <= now:
+                self._remove(name)
+        self.trim()
+
+    def trim(self):
+        """
+        Remove the least recently used entries while they take up more
+        than max_bytes, down to TRIM_RATIO of it.
+
+        Sizes are counted afresh from the directory, as other processes
+        sharing it write and remove entries too.
+        """
+        entries = []
+        size = 0
+        for name, entry_size, used_at, _ in self._entries():
+            entries.append((used_at, name, entry_size))
+            size += entry_size
+
+        if self.max_bytes is not None and size > self.max_bytes:
+            target = self.max_bytes * self.TRIM_RATIO
+            for _, name, entry_size in sorted(entries):
+                if size <= target:
+                    break
+                self._remove(name)
+                size -= entry_size
+        with self._lock:
+            self._size = size
+
+    def _entries(self):
+        """Yield the (file name, size, last use, drop time) of each entry."""
+        for name in os.listdir(self.directory):
+            if not name.endswith(".entry"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    _, drop_at, _ = ENTRY_HEADER.unpack(
+                        f.read(ENTRY_HEADER.size)
+                    )
+                    stat = os.fstat(f.fileno())
+            except (OSError, struct.error):
+                continue
+            yield name, stat.st_size, stat.st_mtime, drop_at
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key):
+        digest = hashlib.sha256(encode_key(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.entry")
+
+
+class RedisError(Exception):
+    """An error reply from a Redis server."""
+
+
+class RedisConnection:
+    """
+    Minimal client of the Redis protocol (RESP2), enough for the commands
+    RedisBackend sends.
+    """
+
+    def __init__(self, url, timeout=1):
+        parts = urlsplit(url)
+        self.sock = socket.create_connection(
+            (parts.hostname or "localhost", parts.port or 6379), timeout
+        )
+        self.reader = self.sock.makefile("rb")
+        if parts.password:
+            self.execute("AUTH", unquote(parts.password))
+        db = parts.path.lstrip("/")
+        if db and db != "0":
+            self.execute("SELECT", db)
+
+    def execute(self, *args):
+        command = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            elif isinstance(arg, int):
+                arg = str(arg).encode()
+            command.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self.sock.sendall(b"".join(command))
+        return self._read_reply()
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection to Redis closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply from Redis: {line!r}")
+
+
+class RedisBackend:
+    """
+    Keeps a cache's entries on a Redis server (or anything speaking its
+    protocol), shared by every process pointed at it. Entries expire on
+    the server once they can be dropped.
+
+    Snapshots are stored with their titles rather than title IDs, so the
+    processes sharing the server need not share a title table; titles maps
+    them to this process's IDs when read. Each thread uses its own
+    connection. When the server cannot be reached, entries are treated as
+    missing and writes are dropped.
+    """
+
+    def __init__(self, url, titles, prefix="pageviews"):
+        self.url = url
+        self.titles = titles
+        self.prefix = prefix
+        self._local = threading.local()
+
+    def get(self, key):
+        data = self._execute("GET", self._key(key))
+        if data is None:
+            return None
+        try:
+            value, expires_at, _ = decode_entry(data, self.titles)
+        except (ValueError, struct.error):
+            LOGGER.warning(f"Ignoring unreadable cache entry for {key}")
+            return None
+        return value, expires_at
+
+    def set(self, key, value, expires_at, drop_at):
+        data = encode_entry(value, expires_at, drop_at, self.titles)
+        if drop_at is None:
+            self._execute("SET", self._key(key), data)
+            return
+        keep_for = max(1, int((drop_at - time.time()) * 1000))
+        self._execute("SET", self._key(key), data, "PX", keep_for)
+
+    def delete(self, key):
+        self._execute("DEL", self._key(key))
+
+    def clear(self):
+        cursor = "0"
+        while True:
+            reply = self._execute(
+                "SCAN", cursor, "MATCH", f"{self.prefix}:*", "COUNT", 1000
+            )
+            if reply is None:
+                return
+            cursor, keys = reply[0].decode(), reply[1]
+            if keys:
+                self._execute("DEL", *keys)
+            if cursor == "0":
+                return
+
+    def _key(self, key):
+        return f"{self.prefix}:{encode_key(key)}"
+
+    def _execute(self, *args):
+        connection = getattr(self._local, "connection", None)
+        try:
+            if connection is None:
+                connection = RedisConnection(self.url)
+                self._local.connection = connection
+            return connection.execute(*args)
+        except (OSError, RedisError) as e:
+            LOGGER.warning(f"Redis command {args[0]} failed: {e!r}")
+            if connection is not None and not isinstance(e, RedisError):
+                connection.close()
+                self._local.connection = None
+            return None
+
+
+class DailyCache:
+    """
+    Cache of parsed daily Wikimedia results keyed by
+    (project, access, agent, article, day).
+
+    Entries live in a backend: by default an in-memory LRU bounded by
+    max_size (see MemoryBackend), or one shared by several processes (see
+    FileBackend and RedisBackend). When a directory is given, they are also
+    kept in an on-disk tier that survives restarts. Data for days that have
+    fully elapsed never changes upstream, so those entries never expire and
+    are the only ones written to disk. Everything else (today's data, or a
+    day Wikimedia has not loaded yet, stored as None) expires after
+    recent_ttl seconds.
+
+    Expired entries are kept for up to max(stale_while_revalidate,
+    stale_if_error) more seconds, and lookup() still returns them along
+    with how long ago they expired, so that callers can serve them while
+    they refresh them, or when refreshing them fails.
+
+    name identifies the cache in metrics.
+    """
+
+    def __init__(self, max_size=500_000, directory=None, recent_ttl=300,
+                 stale_while_revalidate=0, stale_if_error=0, name="daily",
+                 backend=None):
+        self.name = name
+        self.directory = directory
+        self.recent_ttl = recent_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.backend = backend or MemoryBackend(max_size)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def max_staleness(self):
+        return max(self.stale_while_revalidate, self.stale_if_error)
+
+    def is_immutable(self, key, value):
+        return value is not None and key[-1] < utc_today()
+
+    def get(self, key):
+        """Return the cached value for key, or MISSING if it expired."""
+        value, staleness = self.lookup(key)
+        return MISSING if staleness is not None else value
+
+    def lookup(self, key):
+        """
+        Return the cached value for key and its staleness: None while the
+        value is fresh, otherwise the number of seconds since it expired.
+        Returns (MISSING, None) when nothing usable is cached.
+        """
+        entry = self.backend.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            now = time.time()
+            if expires_at is None or expires_at > now:
+                metrics.CACHE_REQUESTS.inc(self.name, "hit")
+                return value, None
+            staleness = now - expires_at
+            if staleness <= self.max_staleness:
+                metrics.CACHE_REQUESTS.inc(self.name, "stale")
+                return value, staleness
+            self.backend.delete(key)
+
+        value = self._read_from_disk(key)
+        if value is not MISSING:
+            self.backend.set(key, value, None, None)
+        metrics.CACHE_REQUESTS.inc(
+            self.name, "miss" if value is MISSING else "hit"
+        )
+        return value, None
+
+    def set(self, key, value):
+        if self.is_immutable(key, value):
+            self._write_to_disk(key, value)
+            self.backend.set(key, value, None, None)
+        else:
+            expires_at = time.time() + self.recent_ttl
+            self.backend.set(
+                key, value, expires_at, expires_at + self.max_staleness
+            )
+
+    def clear(self):
+        self.backend.clear()
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _path(self, key):
+        digest = hashlib.sha256(encode_key(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def _read_from_disk(self, key):
+        if not self.directory:
+            return MISSING
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return MISSING
+        except (OSError, ValueError):
+            LOGGER.warning(f"Ignoring unreadable cache entry for {key}")
+            return MISSING
+
+    def _write_to_disk(self, key, value):
+        if not self.directory:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, self._path(key))
@@ -0,0 +1,356 @@
+"""
+Local store of pageviews ingested from Wikimedia's dump files.
+
+Two formats are read, gzip or bz2 compressed (or not at all):
+
+- daily "pageview complete" files, e.g. pageviews-20230101-user.bz2, with
+  lines of "<project> <title> <page id> <access> <views> <hourly views>";
+- hourly pageviews files, e.g. pageviews-20230101-130000.gz, with lines of
+  "<domain code> <title> <views> <bytes>", which count user traffic. A day
+  is covered once its 24 hours are ingested.
+
+Views are kept per (project, title, day, access, agent) in SQLite, along
+with the most viewed articles of each day, so that the pageviews service
+can answer for covered days without going to Wikimedia.
+"""
+import bz2
+import gzip
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+
+from upstream import TopArticles
+
+
+LOGGER = logging.getLogger("pageviewsApi")
+DUMP_NAME_PATTERN = re.compile(
+    r"pageviews-(\d{8})-(?:(\d{2})0000|(user|automated|spider))"
+)
+ACCESS_METHODS = ["desktop", "mobile-app", "mobile-web"]
+AGENT_TYPES = ["user", "spider", "automated"]
+# Site of the hourly files' domain codes, by suffix, e.g. de.b for
+# de.wikibooks. A .m part marks mobile views.
+SITE_SUFFIXES = {
+    "": "wikipedia",
+    "z": "wikipedia",
+    "b": "wikibooks",
+    "d": "wiktionary",
+    "n": "wikinews",
+    "q": "wikiquote",
+    "s": "wikisource",
+    "v": "wikiversity",
+    "voy": "wikivoyage",
+}
+WIKIMEDIA_SITES = {"commons", "meta", "species", "incubator", "outreach"}
+# Distinct (project, title, day, access, agent) rows aggregated in memory
+# before they are added to the database.
+BATCH_SIZE = 100_000
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS views (
+    project TEXT NOT NULL,
+    title TEXT NOT NULL,
+    day TEXT NOT NULL,
+    access TEXT NOT NULL,
+    agent TEXT NOT NULL,
+    views INTEGER NOT NULL,
+    PRIMARY KEY (project, title, day, access, agent)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS views_by_day ON views (project, day, agent);
+CREATE TABLE IF NOT EXISTS top_articles (
+    project TEXT NOT NULL,
+    access TEXT NOT NULL,
+    day TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    views INTEGER NOT NULL,
+    PRIMARY KEY (project, access, day, rank)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ingested_files (
+    name TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    hour INTEGER,
+    agent TEXT NOT NULL,
+    projects TEXT
+);
+"""
+
+
+def open_dump(path):
+    """Open a dump file as text, decompressing it as its suffix says."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def parse_dump_name(path):
+    """
+    Return the day, hour (None for daily files) and agent type a dump file
+    covers, from its name.
+    """
+    match = DUMP_NAME_PATTERN.match(os.path.basename(path))
+    if not match:
+        raise ValueError(f"{path} is not named like a pageviews dump")
+    day = datetime.strptime(match[1], "%Y%m%d").date()
+    if match[2]:
+        return day, int(match[2]), "user"
+    return day, None, match[3]
+
+
+def hourly_project(domain_code):
+    """
+    Return the project and access method of an hourly file's domain code,
+    e.g. ("en.wikipedia", "mobile-web") for en.m, or None when the code is
+    not one of a known site.
+    """
+    parts = domain_code.split(".")
+    mobile = "m" in parts[1:]
+    suffix = ".".join(part for part in parts[1:] if part != "m")
+    if parts[0] in WIKIMEDIA_SITES and not suffix:
+        site = "wikimedia"
+    elif suffix in SITE_SUFFIXES:
+        site = SITE_SUFFIXES[suffix]
+    else:
+        return None
+    return f"{parts[0]}.{site}", "mobile-web" if mobile else "desktop"
+
+
+def parse_daily_line(line):
+    """Return (project, title, access, views) of a daily file's line."""
+    fields = line.split(" ")
+    if len(fields) < 5 or fields[3] not in ACCESS_METHODS:
+        return None
+    try:
+        return fields[0], fields[1], fields[3], int(fields[4])
+    except ValueError:
+        return None
+
+
+def parse_hourly_line(line):
+    """Return (project, title, access, views) of an hourly file's line."""
+    fields = line.split(" ")
+    if len(fields) < 3:
+        return None
+    project = hourly_project(fields[0])
+    if project is None:
+        return None
+    try:
+        return project[0], fields[1], project[1], int(fields[2])
+    except ValueError:
+        return None
+
+
+class DumpStore:
+    """
+    SQLite database of the views ingested from dump files, along with the
+    max_ranked most viewed articles of each day. Each thread reads through
+    its own connection.
+
+    A day is covered for an agent type once a daily file, or all 24 hourly
+    files, of that agent type were ingested, for every project or at least
+    for the one asked about. Files are only ingested once, whatever
+    projects they were restricted to, and a day is only ever ingested from
+    daily or from hourly files. Views of covered days are
+    complete: articles without a row had no views. all-access and
+    all-agents views are summed when read, and all-agents is only covered
+    when every agent type is.
+    """
+
+    def __init__(self, path, max_ranked=10_000):
+        self.path = path
+        self.max_ranked = max_ranked
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+
+    def ingest(self, paths, projects=None, batch_size=BATCH_SIZE):
+        """
+        Add the views of dump files, skipping those already ingested, then
+        rank the articles of the days they cover. Daily and hourly files
+        count the same views, so files of a day and agent type are skipped
+        when files of the other kind were ingested for it. projects, if
+        given, restricts the projects kept. Returns the names of the files
+        ingested.
+        """
+        ingested = []
+        days = set()
+        for path in paths:
+            name = os.path.basename(path)
+            day, hour, agent = parse_dump_name(path)
+            connection = self._connection()
+            if connection.execute(
+                "SELECT 1 FROM ingested_files WHERE name = ?", (name,)
+            ).fetchone():
+                LOGGER.info(f"Skipping {name}, already ingested")
+                continue
+            if connection.execute(
+                "SELECT 1 FROM ingested_files WHERE day = ? AND agent = ?"
+                " AND (hour IS NULL) != ?",
+                (day.isoformat(), agent, hour is None),
+            ).fetchone():
+                LOGGER.warning(
+                    f"Skipping {name}, {'hourly' if hour is None else 'daily'}"
+                    f" files of {day} were already ingested"
+                )
+                continue
+
+            LOGGER.info(f"Ingesting {name}")
+            parse_line = (parse_daily_line if hour is None
+                          else parse_hourly_line)
+            with connection:
+                self._ingest_file(
+                    connection, path, day.isoformat(), agent, parse_line,
+                    projects, batch_size,
+                )
+                connection.execute(
+                    "INSERT INTO ingested_files VALUES (?, ?, ?, ?, ?)",
+                    (name, day.isoformat(), hour, agent,
+                     ",".join(sorted(projects)) if projects else None),
+                )
+            ingested.append(name)
+            if agent == "user":
+                days.add(day)
+
+        for day in sorted(days):
+            self._rank_day(day)
+        return ingested
+
+    def is_covered(self, day, project, agent):
+        return day in self._covered_days([day], project, agent)
+
+    def top_articles(self, day, project, access):
+        """
+        Return a day's most viewed articles by users as TopArticles, or None
+        when the day is not covered.
+        """
+        if not self.is_covered(day, project, "user"):
+            return None
+        rows = self._connection().execute(
+            "SELECT title, views FROM top_articles"
+            " WHERE project = ? AND access = ? AND day = ? ORDER BY rank",
+            (project, access, day.isoformat()),
+        ).fetchall()
+        return TopArticles([row[0] for row in rows], [row[1] for row in rows])
+
+    def daily_views(self, title, days, project, access, agent):
+        """
+        Return a dict of the views of an article on each of days that is
+        covered for project and agent.
+        """
+        covered = self._covered_days(days, project, agent)
+        if not covered:
+            return {}
+
+        query = ("SELECT day, SUM(views) FROM views"
+                 " WHERE project = ? AND title = ? AND day BETWEEN ? AND ?")
+        params = [project, title, min(covered).isoformat(),
+                  max(covered).isoformat()]
+        if access != "all-access":
+            query += " AND access = ?"
+            params.append(access)
+        if agent != "all-agents":
+            query += " AND agent = ?"
+            params.append(agent)
+        views = dict.fromkeys(covered, 0)
+        for day, day_views in self._connection().execute(
+            query + " GROUP BY day", params
+        ):
+            day = date.fromisoformat(day)
+            if day in views:
+                views[day] = day_views
+        return views
+
+    def _covered_days(self, days, project, agent):
+        """Return the set of days that are covered for project and agent."""
+        covered = set(days)
+        for agent_type in AGENT_TYPES if agent == "all-agents" else [agent]:
+            rows = self._connection().execute(
+                "SELECT day FROM ingested_files"
+                " WHERE agent = ? AND day BETWEEN ? AND ?"
+                " AND (projects IS NULL"
+                " OR instr(',' || projects || ',', ',' || ? || ','))"
+                " GROUP BY day HAVING MAX(hour IS NULL) OR COUNT(hour) = 24",
+                (agent_type, min(days).isoformat(), max(days).isoformat(),
+                 project),
+            )
+            covered &= {date.fromisoformat(row[0]) for row in rows}
+        return covered
+
+    def _ingest_file(self, connection, path, day, agent, parse_line,
+                     projects, batch_size):
+        """
+        Stream a dump file into the views table, summing views in memory
+        over at most batch_size distinct rows at a time.
+        """
+        batch = {}
+        with open_dump(path) as f:
+            for line in f:
+                parsed = parse_line(line.rstrip("\n"))
+                if parsed is None:
+                    continue
+                project, title, access, views = parsed
+                if projects and project not in projects:
+                    continue
+                key = (project, title, day, access, agent)
+                batch[key] = batch.get(key, 0) + views
+                if len(batch) >= batch_size:
+                    self._add_views(connection, batch)
+                    batch = {}
+        self._add_views(connection, batch)
+
+    @staticmethod
+    def _add_views(connection, batch):
+        connection.executemany(
+            "INSERT INTO views VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (project, title, day, access, agent)"
+            " DO UPDATE SET views = views + excluded.views",
+            [(*key, views) for key, views in batch.items()],
+        )
+
+    def _rank_day(self, day):
+        """Rank the articles most viewed by users on a covered day."""
+        day = day.isoformat()
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "DELETE FROM top_articles WHERE day = ?", (day,)
+            )
+            projects = [row[0] for row in connection.execute(
+                "SELECT DISTINCT project FROM views"
+                " WHERE day = ? AND agent = 'user'", (day,)
+            )]
+            for project in projects:
+                for access in ACCESS_METHODS + ["all-access"]:
+                    access_filter = (
+                        "" if access == "all-access" else " AND access = ?"
+                    )
+                    params = [project, day]
+                    if access_filter:
+                        params.append(access)
+                    rows = connection.execute(
+                        "SELECT title, SUM(views) AS total FROM views"
+                        " WHERE project = ? AND day = ? AND agent = 'user'"
+                        + access_filter
+                        + " GROUP BY title ORDER BY total DESC, title"
+                        " LIMIT ?",
+                        params + [self.max_ranked],
+                    ).fetchall()
+                    connection.executemany(
+                        "INSERT INTO top_articles VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (project, access, day, rank, title, views)
+                            for rank, (title, views) in enumerate(rows, 1)
+                        ],
+                    )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            self._local.connection = connection
+        return connection
@@ -0,0 +1,227 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Buckets in seconds for request and Wikimedia call durations, and for the
+# much shorter in-process work (parsing, aggregating, ranking).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CPU_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+
+def escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"'
+                          for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    Holds the metrics of the process and renders them in the Prometheus
+    text format. Nothing is recorded while enabled is False, so that
+    instrumentation left on hot paths costs a single attribute check.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines += metric.samples()
+        return "\n".join(lines) + "\n"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            return [
+                f"{self.name}{format_labels(self.labels, labels)} "
+                + format_value(value)
+                for labels, value in sorted(self._values.items())
+            ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, registry, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, *labels):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            counts, total = self._values.get(
+                labels, ([0] * len(self.buckets), 0)
+            )
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[labels] = (counts, total + value)
+
+    def time(self, *labels):
+        """Context manager observing the duration of its block."""
+        if not self.registry.enabled:
+            return nullcontext()
+        return self._timer(labels)
+
+    @contextmanager
+    def _timer(self, labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels):
+        counts, _ = self._values.get(labels, ((), 0))
+        return sum(counts)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    bucket_labels = format_labels(
+                        self.labels, labels, [("le", format_value(bound))]
+                    )
+                    samples.append(
+                        f"{self.name}_bucket{bucket_labels} {cumulative}"
+                    )
+                label_text = format_labels(self.labels, labels)
+                samples.append(
+                    f"{self.name}_sum{label_text} {format_value(total)}"
+                )
+                samples.append(f"{self.name}_count{label_text} {cumulative}")
+        return samples
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = Histogram(
+    REGISTRY, "pageviews_request_duration_seconds",
+    "Time spent serving requests, per route.",
+    ["route", "method", "status"],
+)
+UPSTREAM_REQUESTS = Counter(
+    REGISTRY, "pageviews_upstream_requests_total",
+    "Requests made to Wikimedia, per API and response status.",
+    ["endpoint", "status"],
+)
+UPSTREAM_DURATION = Histogram(
+    REGISTRY, "pageviews_upstream_request_duration_seconds",
+    "Time until Wikimedia sent the response headers, per API.",
+    ["endpoint"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    REGISTRY, "pageviews_upstream_in_flight",
+    "Requests to Wikimedia currently waiting for a response.",
+)
+CACHE_REQUESTS = Counter(
+    REGISTRY, "pageviews_cache_requests_total",
+    "Cache lookups, per cache and result (hit or miss).",
+    ["cache", "result"],
+)
+PARSE_DURATION = Histogram(
+    REGISTRY, "pageviews_parse_duration_seconds",
+    "Time spent reading and decoding Wikimedia response bodies, per API.",
+    ["endpoint"], buckets=CPU_BUCKETS,
+)
+AGGREGATION_DURATION = Histogram(
+    REGISTRY, "pageviews_aggregation_duration_seconds",
+    "Time spent summing views across days and ranking articles, per stage.",
+    ["stage"], buckets=CPU_BUCKETS,
+)
+
+
+class UpstreamCall:
+    status = "error"
+
+
+@contextmanager
+def _track_upstream(endpoint):
+    call = UpstreamCall()
+    UPSTREAM_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        UPSTREAM_IN_FLIGHT.dec()
+        UPSTREAM_DURATION.observe(time.perf_counter() - started, endpoint)
+        UPSTREAM_REQUESTS.inc(endpoint, call.status)
+
+
+def track_upstream(endpoint):
+    """
+    Context manager recording a Wikimedia call: its duration, the number
+    of calls in flight and, once set on the yielded object, its status.
+    """
+    if not REGISTRY.enabled:
+        return nullcontext(UpstreamCall())
+    return _track_upstream(endpoint)
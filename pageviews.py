@@ -0,0 +1,929 @@
+import asyncio
+import contextvars
+import logging
+import threading
+from calendar import monthrange
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, timedelta
+from functools import partial
+
+import numpy as np
+
+import metrics
+from cache import MemoryBackend, MISSING, utc_today
+from series import DailySeries, SeriesIndex
+from store import (
+    aggregate,
+    article_keys,
+    as_snapshot,
+    TitleTable,
+    to_snapshot,
+)
+from upstream import (
+    request_deadline,
+    UPSTREAM_ERRORS,
+    WIKIMEDIA_ACCESS_PARAM,
+    WIKIMEDIA_AGENT_PARAM,
+    WIKIMEDIA_PROJECT_PARAM,
+    WIKIMEDIA_TIME_FORMAT,
+)
+
+
+LOGGER = logging.getLogger("pageviewsApi")
+
+# Month aggregates already available for a range of top articles, the whole
+# months that still need computing, the leftover days and every day whose
+# snapshot is needed.
+RangePlan = namedtuple(
+    "RangePlan", ["parts", "cold_months", "days", "days_to_fetch"]
+)
+# An article's cached daily views, the staleness of those that expired,
+# whether every day has a cached value and the days that must be fetched
+# before answering.
+DailyViewsPlan = namedtuple(
+    "DailyViewsPlan", ["views", "stale", "complete", "days_to_fetch"]
+)
+
+
+class Freshness:
+    """
+    How fresh the data behind a response is. Stale data is either served
+    while it is refreshed in the background ("stale-while-revalidate") or
+    because refreshing it failed ("stale-if-error"); staleness is how many
+    seconds past its expiry the stalest of it was.
+
+    complete is False when some of the data was left out to answer in time
+    (see top_articles_range_within), or when Wikimedia had not loaded the
+    data of some of the days yet, which may then still change.
+    """
+
+    def __init__(self):
+        self.state = "fresh"
+        self.staleness = 0
+        self.complete = True
+        self._lock = threading.Lock()
+
+    def record(self, state, staleness):
+        with self._lock:
+            if self.state != "stale-if-error":
+                self.state = state
+            self.staleness = max(self.staleness, staleness)
+
+
+# Freshness of the response being computed, if any is tracked.
+response_freshness = contextvars.ContextVar(
+    "response_freshness", default=None
+)
+
+
+def record_stale(state, staleness):
+    freshness = response_freshness.get()
+    if freshness is not None:
+        freshness.record(state, staleness)
+
+
+def record_incomplete():
+    freshness = response_freshness.get()
+    if freshness is not None:
+        freshness.complete = False
+
+
+def log_failed_fetch(key, future):
+    """
+    Log the failure of a fetch whose result is left out of a partial
+    response, whether it failed in time or running in the background.
+    """
+    if not future.cancelled() and future.exception() is not None:
+        LOGGER.warning(f"Fetch of {key} failed: {future.exception()!r}")
+
+
+def fetched_in_time(futures, done):
+    """
+    Return a dict of the results of the done futures, keyed like futures,
+    leaving out (and logging) those that failed.
+    """
+    results = {}
+    for future in done:
+        if future.exception() is None:
+            results[futures[future]] = future.result()
+        else:
+            log_failed_fetch(futures[future], future)
+    return results
+
+
+def missing_days(keys, snapshots):
+    """Sorted days of the (project, day) keys missing from snapshots."""
+    return sorted({key[1] for key in keys if key not in snapshots})
+
+
+def date_range(start_date, end_date):
+    return [
+        start_date + timedelta(days=offset)
+        for offset in range((end_date - start_date).days + 1)
+    ]
+
+
+def projects_of(project):
+    """A project, or a list of projects, as a list."""
+    return [project] if isinstance(project, str) else list(project)
+
+
+def sum_daily_views(daily_views):
+    """
+    Sum lists of (day, views) pairs over the same days. A day's sum is None
+    when none of the lists has data for it.
+    """
+    return [
+        (pairs[0][0],
+         None if all(views is None for _, views in pairs)
+         else sum(views or 0 for _, views in pairs))
+        for pairs in zip(*daily_views)
+    ]
+
+
+def last_day_of_month(year, month):
+    return date(year, month, monthrange(year, month)[1])
+
+
+def split_range(start_date, end_date):
+    """
+    Split a range of days (inclusive) into the whole calendar months it
+    covers and the leftover days. Returns a list of (year, month) pairs and
+    a list of days.
+    """
+    months = []
+    days = []
+    day = start_date
+    while day <= end_date:
+        month_end = last_day_of_month(day.year, day.month)
+        if day.day == 1 and month_end <= end_date:
+            months.append((day.year, day.month))
+            day = month_end + timedelta(days=1)
+        else:
+            days.append(day)
+            day += timedelta(days=1)
+    return months, days
+
+
+class PageviewsService:
+    """
+    Read-through access to Wikimedia pageview data, one day at a time.
+
+    Results are cached per (project, access, agent, article, day) so that
+    repeated queries over the same days do not go back to Wikimedia. Top
+    articles are kept as snapshot arrays (see store.py); when a store is
+    given, snapshots of fully elapsed days are persisted there instead of
+    the cache.
+
+    Ranges of top articles are aggregated from whole-month aggregates,
+    which are kept in month_cache (and the store) once computed, plus the
+    leftover days. Up to max_in_flight days are fetched concurrently.
+    Ranges and daily views can span several projects. Ranges keep the same
+    title on two projects as two articles, keyed by project and title ID
+    (see store.article_keys); daily views are summed per title.
+
+    Expired cache entries are served as is, and refreshed in the
+    background, for the cache's stale_while_revalidate seconds. Past that
+    they are refetched, but still served for up to stale_if_error seconds
+    if Wikimedia fails. Either way it is recorded in response_freshness.
+
+    When a DumpStore is given, days it covers are read from it instead of
+    Wikimedia, and cached the same way.
+
+    The elapsed days of the article series read through indexed_series are
+    kept in a SeriesIndex per article, bounded by index_max_size days in
+    all, so that totals and top days over any of their ranges are answered
+    without going through the cache again.
+    """
+
+    def __init__(self, client, cache, month_cache, store=None,
+                 max_in_flight=10, titles=None, dumps=None,
+                 index_max_size=1_000_000):
+        self.client = client
+        self.cache = cache
+        self.month_cache = month_cache
+        self.store = store
+        self.dumps = dumps
+        self.max_in_flight = max_in_flight
+        if titles is None:
+            titles = store.titles if store else TitleTable()
+        self.titles = titles
+        self._indexes = MemoryBackend(index_max_size)
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._refresher = None
+        self._late_fetches = set()
+
+    def top_articles(self, day, project=WIKIMEDIA_PROJECT_PARAM,
+                     access=WIKIMEDIA_ACCESS_PARAM):
+        """
+        Return the snapshot of top articles for a single day, or None when
+        Wikimedia has no data loaded for that day.
+        """
+        snapshot, staleness = self._cached_top_articles(day, project, access)
+        if snapshot is MISSING:
+            return self._fetch_top_articles(day, project, access)
+        if staleness is None:
+            return snapshot
+        return self._serve_stale(
+            snapshot, staleness, ("top", project, access, day),
+            lambda: self._fetch_top_articles(day, project, access),
+        )
+
+    def top_articles_range(self, start_date, end_date,
+                           project=WIKIMEDIA_PROJECT_PARAM,
+                           access=WIKIMEDIA_ACCESS_PARAM):
+        """
+        Return the distinct title IDs of the top articles between two dates
+        (inclusive) and an array with the total views of each. project may
+        be a list of projects, whose days are all fetched concurrently; with
+        more than one, article keys (see store.article_keys) are returned
+        instead of title IDs.
+        """
+        plans = self._plan_ranges(start_date, end_date, project, access)
+        snapshots = self._top_articles_for_days(
+            self._days_to_fetch(plans), access
+        )
+        return self._finish_ranges(plans, snapshots, access)
+
+    def top_articles_ranges(self, ranges, project=WIKIMEDIA_PROJECT_PARAM,
+                            access=WIKIMEDIA_ACCESS_PARAM):
+        """
+        Return what top_articles_range does for each of a list of
+        (start_date, end_date) ranges, fetching the days of every range
+        concurrently.
+        """
+        plans = [
+            self._plan_ranges(start_date, end_date, project, access)
+            for start_date, end_date in ranges
+        ]
+        snapshots = self._top_articles_for_days(
+            self._days_to_fetch_for_all(plans), access
+        )
+        return [self._finish_ranges(plan, snapshots, access)
+                for plan in plans]
+
+    def top_articles_range_within(self, start_date, end_date, timeout,
+                                  project=WIKIMEDIA_PROJECT_PARAM,
+                                  access=WIKIMEDIA_ACCESS_PARAM):
+        """
+        Return what top_articles_range does, over the days whose top
+        articles could be had within timeout seconds, along with a sorted
+        list of the days left out, because their fetch failed or was still
+        running. Those still running keep going in the background, so that
+        later requests find them cached.
+        """
+        plans = self._plan_ranges(start_date, end_date, project, access)
+        keys = self._days_to_fetch(plans)
+        snapshots = self._top_articles_for_days_within(keys, access, timeout)
+        missing = missing_days(keys, snapshots)
+        if missing:
+            record_incomplete()
+        return (*self._finish_ranges(plans, snapshots, access), missing)
+
+    def map_concurrently(self, fn, items):
+        """
+        Call fn on every item, running up to max_in_flight calls at once.
+        Returns the results in the order of items. Calls run in copies of
+        the caller's context, so they see its request deadline.
+        """
+        if not items:
+            return []
+        contexts = [contextvars.copy_context() for _ in items]
+        max_workers = min(self.max_in_flight, len(items))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(
+                lambda context, item: context.run(fn, item), contexts, items
+            ))
+
+    def daily_views(self, title, start_date, end_date,
+                    project=WIKIMEDIA_PROJECT_PARAM,
+                    access=WIKIMEDIA_ACCESS_PARAM,
+                    agent=WIKIMEDIA_AGENT_PARAM):
+        """
+        Return a list of (day, views) pairs for every day between two dates
+        (inclusive). views is None for days Wikimedia has no data for.
+        project may be a list of projects, whose views are summed per day.
+        """
+        days = date_range(start_date, end_date)
+        projects = projects_of(project)
+        if len(projects) > 1:
+            return sum_daily_views(self.map_concurrently(
+                lambda project: self._daily_views(
+                    title, days, (project, access, agent)
+                ),
+                projects,
+            ))
+        return self._daily_views(title, days, (projects[0], access, agent))
+
+    def _daily_views(self, title, days, dimensions):
+        plan = self._plan_daily_views(title, days, dimensions)
+
+        views = plan.views
+        if not plan.complete:
+            views = self._fetch_daily_views(
+                title, plan.days_to_fetch, dimensions, views
+            )
+        elif plan.stale:
+            stale_days = sorted(plan.stale)
+            views = self._serve_stale(
+                views, max(plan.stale.values()),
+                ("per-article", title, dimensions, stale_days[0],
+                 stale_days[-1]),
+                lambda: self._fetch_daily_views(
+                    title, stale_days, dimensions, dict(views)
+                ),
+            )
+
+        if any(views[day] is None for day in days):
+            record_incomplete()
+        return [(day, views[day]) for day in days]
+
+    def daily_series(self, title, start_date, end_date,
+                     project=WIKIMEDIA_PROJECT_PARAM,
+                     access=WIKIMEDIA_ACCESS_PARAM,
+                     agent=WIKIMEDIA_AGENT_PARAM):
+        """
+        Return the daily views of an article between two dates (inclusive)
+        as a DailySeries, from which every statistic can be derived.
+        """
+        return DailySeries.from_daily_views(self.daily_views(
+            title, start_date, end_date, project, access, agent
+        ))
+
+    def indexed_series(self, title, start_date, end_date,
+                       project=WIKIMEDIA_PROJECT_PARAM,
+                       access=WIKIMEDIA_ACCESS_PARAM,
+                       agent=WIKIMEDIA_AGENT_PARAM):
+        """
+        Return the daily views of an article between two dates (inclusive)
+        as an object with DailySeries' total() and top_day(). Ranges within
+        the article's index are answered from it alone; others are read
+        with daily_series, and their elapsed days added to the index.
+        """
+        key = self._index_key(title, project, access, agent)
+        entry = self._indexes.get(key)
+        if entry is not None and entry[0].covers(start_date, end_date):
+            return entry[0].window(start_date, end_date)
+        series = self.daily_series(
+            title, start_date, end_date, project, access, agent
+        )
+        self._remember_index(key, series)
+        return series
+
+    def clear_indexes(self):
+        self._indexes.clear()
+
+    @staticmethod
+    def _index_key(title, project, access, agent):
+        return tuple(projects_of(project)), access, agent, title
+
+    def _remember_index(self, key, series):
+        """
+        Add the leading days of series that have elapsed, and have data, to
+        the article's index. An index only ever spans consecutive days, so
+        days that would leave a gap replace it instead.
+        """
+        elapsed = min((utc_today() - series.start_date).days,
+                      len(series.views))
+        missing = np.flatnonzero(~series.has_data[:max(elapsed, 0)])
+        if len(missing):
+            elapsed = int(missing[0])
+        if elapsed <= 0:
+            return
+        part = series.head(elapsed)
+        entry = self._indexes.get(key)
+        if entry is not None:
+            part = entry[0].series.union(part) or part
+        self._indexes.set(key, SeriesIndex(part), None, None)
+
+    def _top_articles_for_days(self, days, access):
+        """Fetch the snapshots of a list of (project, day) pairs."""
+        LOGGER.info(f"Gathering top articles for {len(days)} days")
+        return dict(zip(days, self.map_concurrently(
+            lambda key: self.top_articles(key[1], key[0], access), days
+        )))
+
+    def _top_articles_for_days_within(self, days, access, timeout):
+        """
+        Fetch the snapshots of a list of (project, day) pairs, waiting at
+        most timeout seconds. Returns a dict of those fetched in time, and
+        without failing. The fetches are not bound by the request's
+        deadline, as they may outlive it.
+        """
+        if not days:
+            return {}
+        LOGGER.info(f"Gathering top articles for {len(days)} days"
+                    f" within {timeout}s")
+        context = contextvars.copy_context()
+        context.run(request_deadline.set, None)
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.max_in_flight, len(days)),
+            thread_name_prefix="top-articles",
+        )
+        futures = {
+            executor.submit(
+                context.copy().run, self.top_articles, day, project, access
+            ): (project, day)
+            for project, day in days
+        }
+        done, pending = wait(futures, timeout=timeout)
+        executor.shutdown(wait=False)
+        for future in pending:
+            future.add_done_callback(
+                partial(log_failed_fetch, futures[future])
+            )
+        return fetched_in_time(futures, done)
+
+    def _serve_stale(self, value, staleness, key, fetch):
+        """
+        Serve a value that expired staleness seconds ago: right away while
+        fetch refreshes it in the background if it is recent enough,
+        otherwise only if fetch fails.
+        """
+        if staleness <= self.cache.stale_while_revalidate:
+            record_stale("stale-while-revalidate", staleness)
+            self._refresh_in_background(key, fetch)
+            return value
+        try:
+            return fetch()
+        except UPSTREAM_ERRORS as e:
+            LOGGER.warning(f"Serving stale data for {key}: {e!r}")
+            record_stale("stale-if-error", staleness)
+            return value
+
+    def _refresh_in_background(self, key, fetch):
+        """Run fetch in a background thread, unless key is refreshing."""
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(
+                    max_workers=2, thread_name_prefix="revalidate"
+                )
+
+        def refresh():
+            try:
+                fetch()
+            except Exception:
+                LOGGER.exception(f"Background refresh of {key} failed")
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        self._refresher.submit(refresh)
+
+    def _fetch_top_articles(self, day, project, access):
+        articles = self._dumped_top_articles(day, project, access)
+        if articles is None:
+            articles = self.client.top_articles(day, project, access)
+        return self._remember_top_articles(day, articles, project, access)
+
+    def _dumped_top_articles(self, day, project, access):
+        """A day's top articles from the dump store, if it covers the day."""
+        if not self.dumps:
+            return None
+        return self.dumps.top_articles(day, project, access)
+
+    def _cached_top_articles(self, day, project, access):
+        """Return a day's cached snapshot and its staleness (see lookup)."""
+        if self.store:
+            snapshot = self.store.get(day, project, access)
+            if snapshot is not None:
+                return snapshot, None
+        return self.cache.lookup((project, access, None, None, day))
+
+    def _remember_top_articles(self, day, articles, project, access):
+        key = (project, access, None, None, day)
+        snapshot = (None if articles is None
+                    else to_snapshot(articles, self.titles))
+        if self.store and self.cache.is_immutable(key, snapshot):
+            self.store.put(day, snapshot, project, access)
+        else:
+            self.cache.set(key, snapshot)
+        return snapshot
+
+    def _plan_range(self, start_date, end_date, project, access):
+        """
+        Work out which parts of a range are covered by month aggregates and
+        which days still need their top articles.
+        """
+        months, days = split_range(start_date, end_date)
+
+        parts = []
+        cold_months = []
+        for year, month in months:
+            month_snapshot = self.month_aggregate(year, month, project, access)
+            if month_snapshot is None:
+                cold_months.append((year, month))
+            else:
+                parts.append(month_snapshot)
+
+        days_to_fetch = list(days)
+        for year, month in cold_months:
+            days_to_fetch += date_range(
+                date(year, month, 1), last_day_of_month(year, month)
+            )
+        return RangePlan(parts, cold_months, days, days_to_fetch)
+
+    def _plan_ranges(self, start_date, end_date, project, access):
+        """Plan a range for each project. Returns a dict of RangePlans."""
+        return {
+            project: self._plan_range(start_date, end_date, project, access)
+            for project in projects_of(project)
+        }
+
+    @staticmethod
+    def _days_to_fetch(plans):
+        return [
+            (project, day)
+            for project, plan in plans.items()
+            for day in plan.days_to_fetch
+        ]
+
+    @classmethod
+    def _days_to_fetch_for_all(cls, plans_of_ranges):
+        return list(dict.fromkeys(
+            key for plans in plans_of_ranges
+            for key in cls._days_to_fetch(plans)
+        ))
+
+    def _finish_ranges(self, plans, snapshots, access):
+        """
+        Aggregate the planned ranges of every project once the snapshots
+        of their days, keyed by (project, day), are known. Several projects
+        are aggregated apart, and their articles keyed by project.
+        """
+        aggregates = []
+        for project, plan in plans.items():
+            parts = self._range_parts(plan, snapshots, project, access)
+            with metrics.AGGREGATION_DURATION.time("aggregate"):
+                aggregates.append(aggregate(parts))
+        if len(aggregates) == 1:
+            return aggregates[0]
+        return (
+            np.concatenate([
+                article_keys(position, ids)
+                for position, (ids, _) in enumerate(aggregates)
+            ]),
+            np.concatenate([totals for _, totals in aggregates]),
+        )
+
+    def _range_parts(self, plan, snapshots, project, access):
+        """
+        List the snapshots making up a project's planned range, computing
+        (and keeping) the aggregates of its cold months on the way. Days
+        missing from snapshots are left out, like days without data, and
+        the response recorded as incomplete.
+        """
+        parts = list(plan.parts)
+        for year, month in plan.cold_months:
+            month_snapshots = [
+                snapshots.get((project, day)) for day in date_range(
+                    date(year, month, 1), last_day_of_month(year, month)
+                )
+            ]
+            if any(s is None for s in month_snapshots):
+                # Only complete months are worth keeping as an aggregate.
+                record_incomplete()
+                parts += [s for s in month_snapshots if s is not None]
+                continue
+            with metrics.AGGREGATION_DURATION.time("aggregate"):
+                month_snapshot = as_snapshot(*aggregate(month_snapshots))
+            self._set_month_aggregate(
+                year, month, month_snapshot, project, access
+            )
+            parts.append(month_snapshot)
+
+        days = [snapshots.get((project, day)) for day in plan.days]
+        if any(s is None for s in days):
+            record_incomplete()
+        return parts + [s for s in days if s is not None]
+
+    def month_aggregate(self, year, month, project=WIKIMEDIA_PROJECT_PARAM,
+                        access=WIKIMEDIA_ACCESS_PARAM):
+        """
+        Return the precomputed aggregate of a whole month's top articles, or
+        None when it has not been computed (or the month is incomplete).
+        """
+        if self.store:
+            month_snapshot = self.store.get_month(year, month, project, access)
+            if month_snapshot is not None:
+                return month_snapshot
+        month_snapshot = self.month_cache.get(
+            (project, access, None, None, last_day_of_month(year, month))
+        )
+        return None if month_snapshot is MISSING else month_snapshot
+
+    def _set_month_aggregate(self, year, month, month_snapshot, project,
+                             access):
+        key = (project, access, None, None, last_day_of_month(year, month))
+        if self.store and self.month_cache.is_immutable(key, month_snapshot):
+            self.store.put_month(year, month, month_snapshot, project, access)
+        else:
+            self.month_cache.set(key, month_snapshot)
+
+    def _plan_daily_views(self, title, days, dimensions):
+        views = {}
+        stale = {}
+        for day in days:
+            value, staleness = self.cache.lookup((*dimensions, title, day))
+            if value is not MISSING:
+                views[day] = value
+                if staleness is not None:
+                    stale[day] = staleness
+
+        # Days that are not cached at all cannot be served stale, so they
+        # are fetched along with any stale day in the same request.
+        missing_days = [day for day in days if day not in views]
+        return DailyViewsPlan(
+            views, stale, not missing_days,
+            sorted(set(missing_days) | set(stale)),
+        )
+
+    def _fetch_daily_views(self, title, days, dimensions, views):
+        """
+        Fetch the span of days from the first to the last of days, add
+        their views to views and return it. Days the dump store covers are
+        read from it instead.
+        """
+        days = self._dumped_daily_views(title, days, dimensions, views)
+        if days:
+            items = self.client.per_article(
+                title, days[0], days[-1], *dimensions
+            )
+            self._remember_daily_views(title, days, items, views, dimensions)
+        return views
+
+    def _dumped_daily_views(self, title, days, dimensions, views):
+        """
+        Add to views, and cache, the views of the days the dump store
+        covers. Returns the other days.
+        """
+        if not self.dumps:
+            return days
+        dumped = self.dumps.daily_views(title, days, *dimensions)
+        for day, value in dumped.items():
+            views[day] = value
+            self.cache.set((*dimensions, title, day), value)
+        return [day for day in days if day not in dumped]
+
+    def _remember_daily_views(self, title, days, items, views, dimensions):
+        fetched = {
+            entry["timestamp"][:8]: entry["views"] for entry in items or []
+        }
+        for day in days:
+            value = fetched.get(day.strftime(WIKIMEDIA_TIME_FORMAT))
+            views[day] = value
+            self.cache.set((*dimensions, title, day), value)
+
+
+class AsyncPageviewsService(PageviewsService):
+    """
+    PageviewsService for asyncio code, backed by an AsyncWikimediaClient
+    and with coroutine versions of the public methods. It can share caches,
+    store and title table with a synchronous service.
+
+    Cache, store and dump store lookups are run in threads when any of
+    them does I/O (anything but in-memory caches), so that it does not
+    block the event loop.
+    """
+
+    @property
+    def blocks_on_io(self):
+        caches = (self.cache, self.month_cache)
+        return (self.store is not None or self.dumps is not None
+                or any(cache.directory for cache in caches)
+                or not all(isinstance(cache.backend, MemoryBackend)
+                           for cache in caches))
+
+    async def _off_loop(self, fn, *args):
+        """Call fn, in a thread when caches or stores do I/O."""
+        if self.blocks_on_io:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def top_articles(self, day, project=WIKIMEDIA_PROJECT_PARAM,
+                           access=WIKIMEDIA_ACCESS_PARAM):
+        snapshot, staleness = await self._off_loop(
+            self._cached_top_articles, day, project, access
+        )
+        if snapshot is MISSING:
+            return await self._fetch_top_articles(day, project, access)
+        if staleness is None:
+            return snapshot
+        return await self._serve_stale(
+            snapshot, staleness, ("top", project, access, day),
+            lambda: self._fetch_top_articles(day, project, access),
+        )
+
+    async def top_articles_range(self, start_date, end_date,
+                                 project=WIKIMEDIA_PROJECT_PARAM,
+                                 access=WIKIMEDIA_ACCESS_PARAM):
+        plans = await self._off_loop(
+            self._plan_ranges, start_date, end_date, project, access
+        )
+        snapshots = await self._top_articles_for_days(
+            self._days_to_fetch(plans), access
+        )
+        return await self._off_loop(
+            self._finish_ranges, plans, snapshots, access
+        )
+
+    async def top_articles_ranges(self, ranges,
+                                  project=WIKIMEDIA_PROJECT_PARAM,
+                                  access=WIKIMEDIA_ACCESS_PARAM):
+        plans = [
+            await self._off_loop(
+                self._plan_ranges, start_date, end_date, project, access
+            )
+            for start_date, end_date in ranges
+        ]
+        snapshots = await self._top_articles_for_days(
+            self._days_to_fetch_for_all(plans), access
+        )
+        return [
+            await self._off_loop(self._finish_ranges, plan, snapshots, access)
+            for plan in plans
+        ]
+
+    async def top_articles_range_within(self, start_date, end_date, timeout,
+                                        project=WIKIMEDIA_PROJECT_PARAM,
+                                        access=WIKIMEDIA_ACCESS_PARAM):
+        plans = await self._off_loop(
+            self._plan_ranges, start_date, end_date, project, access
+        )
+        keys = self._days_to_fetch(plans)
+        snapshots = await self._top_articles_for_days_within(
+            keys, access, timeout
+        )
+        missing = missing_days(keys, snapshots)
+        if missing:
+            record_incomplete()
+        return (
+            *await self._off_loop(
+                self._finish_ranges, plans, snapshots, access
+            ),
+            missing,
+        )
+
+    async def map_concurrently(self, fn, items):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def run(item):
+            async with semaphore:
+                return await fn(item)
+
+        return await asyncio.gather(*(run(item) for item in items))
+
+    async def daily_views(self, title, start_date, end_date,
+                          project=WIKIMEDIA_PROJECT_PARAM,
+                          access=WIKIMEDIA_ACCESS_PARAM,
+                          agent=WIKIMEDIA_AGENT_PARAM):
+        days = date_range(start_date, end_date)
+        projects = projects_of(project)
+        if len(projects) > 1:
+            return sum_daily_views(await self.map_concurrently(
+                lambda project: self._daily_views(
+                    title, days, (project, access, agent)
+                ),
+                projects,
+            ))
+        return await self._daily_views(
+            title, days, (projects[0], access, agent)
+        )
+
+    async def _daily_views(self, title, days, dimensions):
+        plan = await self._off_loop(
+            self._plan_daily_views, title, days, dimensions
+        )
+
+        views = plan.views
+        if not plan.complete:
+            views = await self._fetch_daily_views(
+                title, plan.days_to_fetch, dimensions, views
+            )
+        elif plan.stale:
+            stale_days = sorted(plan.stale)
+            views = await self._serve_stale(
+                views, max(plan.stale.values()),
+                ("per-article", title, dimensions, stale_days[0],
+                 stale_days[-1]),
+                lambda: self._fetch_daily_views(
+                    title, stale_days, dimensions, dict(views)
+                ),
+            )
+
+        if any(views[day] is None for day in days):
+            record_incomplete()
+        return [(day, views[day]) for day in days]
+
+    async def daily_series(self, title, start_date, end_date,
+                           project=WIKIMEDIA_PROJECT_PARAM,
+                           access=WIKIMEDIA_ACCESS_PARAM,
+                           agent=WIKIMEDIA_AGENT_PARAM):
+        return DailySeries.from_daily_views(await self.daily_views(
+            title, start_date, end_date, project, access, agent
+        ))
+
+    async def indexed_series(self, title, start_date, end_date,
+                             project=WIKIMEDIA_PROJECT_PARAM,
+                             access=WIKIMEDIA_ACCESS_PARAM,
+                             agent=WIKIMEDIA_AGENT_PARAM):
+        key = self._index_key(title, project, access, agent)
+        entry = self._indexes.get(key)
+        if entry is not None and entry[0].covers(start_date, end_date):
+            return entry[0].window(start_date, end_date)
+        series = await self.daily_series(
+            title, start_date, end_date, project, access, agent
+        )
+        self._remember_index(key, series)
+        return series
+
+    async def _top_articles_for_days(self, days, access):
+        LOGGER.info(f"Gathering top articles for {len(days)} days")
+        return dict(zip(days, await self.map_concurrently(
+            lambda key: self.top_articles(key[1], key[0], access), days
+        )))
+
+    async def _top_articles_for_days_within(self, days, access, timeout):
+        """
+        Fetch the snapshots of a list of (project, day) pairs as tasks,
+        waiting at most timeout seconds. Returns a dict of those fetched in
+        time, and without failing; the other tasks are kept running.
+        """
+        if not days:
+            return {}
+        LOGGER.info(f"Gathering top articles for {len(days)} days"
+                    f" within {timeout}s")
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def fetch(key):
+            request_deadline.set(None)
+            async with semaphore:
+                return await self.top_articles(key[1], key[0], access)
+
+        tasks = {asyncio.ensure_future(fetch(key)): key for key in days}
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            self._late_fetches.add(task)
+            task.add_done_callback(self._late_fetches.discard)
+            task.add_done_callback(partial(log_failed_fetch, tasks[task]))
+        return fetched_in_time(tasks, done)
+
+    async def _serve_stale(self, value, staleness, key, fetch):
+        if staleness <= self.cache.stale_while_revalidate:
+            record_stale("stale-while-revalidate", staleness)
+            self._refresh_in_background(key, fetch)
+            return value
+        try:
+            return await fetch()
+        except UPSTREAM_ERRORS as e:
+            LOGGER.warning(f"Serving stale data for {key}: {e!r}")
+            record_stale("stale-if-error", staleness)
+            return value
+
+    def _refresh_in_background(self, key, fetch):
+        """Run fetch as a background task, unless key is refreshing."""
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            # The task runs in a copy of the request's context: it must not
+            # be bound by its deadline nor count towards its freshness.
+            request_deadline.set(None)
+            response_freshness.set(None)
+            try:
+                await fetch()
+            except Exception:
+                LOGGER.exception(f"Background refresh of {key} failed")
+
+        task = asyncio.ensure_future(refresh())
+        self._refreshing.add(key)
+        task.add_done_callback(lambda _: self._refreshing.discard(key))
+
+    async def _fetch_top_articles(self, day, project, access):
+        articles = await self._off_loop(
+            self._dumped_top_articles, day, project, access
+        )
+        if articles is None:
+            articles = await self.client.top_articles(day, project, access)
+        return await self._off_loop(
+            self._remember_top_articles, day, articles, project, access
+        )
+
+    async def _fetch_daily_views(self, title, days, dimensions, views):
+        days = await self._off_loop(
+            self._dumped_daily_views, title, days, dimensions, views
+        )
+        if days:
+            items = await self.client.per_article(
+                title, days[0], days[-1], *dimensions
+            )
+            await self._off_loop(
+                self._remember_daily_views, title, days, items, views,
+                dimensions,
+            )
+        return views
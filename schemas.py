@@ -1,8 +1,32 @@
+import re
 from dataclasses import dataclass, InitVar
 from datetime import date
 
 from werkzeug.exceptions import BadRequest
 
+from upstream import (
+    WIKIMEDIA_ACCESS_PARAM,
+    WIKIMEDIA_AGENT_PARAM,
+    WIKIMEDIA_PROJECT_PARAM,
+)
+
+
+# Longest range (in days) that can be requested with start_date/end_date.
+MAX_DATE_RANGE_DAYS = 1098
+# Most titles that can be looked up in a single batch request.
+MAX_BATCH_TITLES = 500
+# Percentiles of daily views reported by default for a series.
+DEFAULT_PERCENTILES = [50, 90, 99]
+# Most projects whose views can be combined in a single request.
+MAX_PROJECTS = 20
+# Wikimedia project domains, e.g. en.wikipedia or commons.wikimedia.
+PROJECT_PATTERN = re.compile(r"[a-z0-9-]+(\.[a-z0-9-]+)*")
+ACCESS_VALUES = ["all-access", "desktop", "mobile-app", "mobile-web"]
+AGENT_VALUES = ["all-agents", "user", "spider", "automated"]
+# How trending articles can be ranked: by the difference or the ratio
+# between their views in a period and in the one before.
+TRENDING_SORTS = ["delta", "ratio"]
+
 
 def assert_date_components(*args):
     for arg in args:
@@ -19,6 +43,83 @@ def assert_title(title):
         raise BadRequest("Must provide a title")
 
 
+def validate_titles(titles):
+    """Check a list of titles and return it without duplicates."""
+    try:
+        assert titles
+    except AssertionError:
+        raise BadRequest("Must provide titles")
+
+    try:
+        assert isinstance(titles, list)
+        assert all(title and isinstance(title, str) for title in titles)
+    except AssertionError:
+        raise BadRequest("titles must be a list of non-empty strings")
+
+    titles = list(dict.fromkeys(titles))
+    try:
+        assert len(titles) <= MAX_BATCH_TITLES
+    except AssertionError:
+        raise BadRequest(f"Must provide at most {MAX_BATCH_TITLES} titles")
+
+    return titles
+
+
+def validate_projects(projects):
+    """
+    Check a comma-separated string (or a list) of projects and return them
+    as a list without duplicates, defaulting to WIKIMEDIA_PROJECT_PARAM.
+    """
+    if not projects:
+        return [WIKIMEDIA_PROJECT_PARAM]
+    if isinstance(projects, str):
+        projects = projects.split(",")
+
+    try:
+        assert isinstance(projects, list)
+        assert all(
+            isinstance(project, str) and PROJECT_PATTERN.fullmatch(project)
+            for project in projects
+        )
+    except AssertionError:
+        raise BadRequest("project must be a comma-separated list of "
+                         + "Wikimedia projects, e.g. en.wikipedia")
+
+    projects = list(dict.fromkeys(projects))
+    try:
+        assert len(projects) <= MAX_PROJECTS
+    except AssertionError:
+        raise BadRequest(f"Must provide at most {MAX_PROJECTS} projects")
+
+    return projects
+
+
+def validate_choice(value, name, choices, default):
+    if not value:
+        return default
+
+    try:
+        assert value in choices
+    except AssertionError:
+        raise BadRequest(f"{name} must be one of " + ", ".join(choices))
+
+    return value
+
+
+def validate_access(access):
+    return validate_choice(
+        access, "access", ACCESS_VALUES, WIKIMEDIA_ACCESS_PARAM
+    )
+
+
+def validate_agent(agent):
+    return validate_choice(agent, "agent", AGENT_VALUES, WIKIMEDIA_AGENT_PARAM)
+
+
+def validate_sort(sort):
+    return validate_choice(sort, "sort", TRENDING_SORTS, TRENDING_SORTS[0])
+
+
 def assert_week_has_day(day, time_period):
     """A day must be given when a week-long time period is requested."""
     if time_period.lower() == "week":
@@ -29,6 +130,32 @@ def assert_week_has_day(day, time_period):
                              + " of articles")
 
 
+def validate_date_range(start_date, end_date):
+    assert_date_components((start_date, "start_date"), (end_date, "end_date"))
+
+    try:
+        start_date = date.fromisoformat(start_date)
+        end_date = date.fromisoformat(end_date)
+    except (TypeError, ValueError):
+        raise BadRequest("start_date and end_date must be formatted as "
+                         + "YYYY-MM-DD")
+
+    validate_year(start_date.year)
+
+    try:
+        assert start_date <= end_date
+    except AssertionError:
+        raise BadRequest("start_date must not be after end_date")
+
+    try:
+        assert (end_date - start_date).days < MAX_DATE_RANGE_DAYS
+    except AssertionError:
+        raise BadRequest(f"Date range must not exceed {MAX_DATE_RANGE_DAYS}"
+                         + " days")
+
+    return start_date, end_date
+
+
 def validate_date(day, month, year):
     try:
         date(year=year, month=month, day=day)
@@ -42,10 +169,65 @@ def validate_day_month_year(day, month, year):
         month = int(month)
         year = int(year)
         return day, month, year
-    except ValueError:
+    except (TypeError, ValueError):
         raise BadRequest("Day, month, and year must be integers")
 
 
+def validate_limit_and_offset(limit, offset):
+    try:
+        limit = int(limit) if limit else None
+        offset = int(offset) if offset else 0
+    except ValueError:
+        raise BadRequest("limit and offset must be integers")
+
+    try:
+        assert limit is None or limit > 0
+    except AssertionError:
+        raise BadRequest("limit must be greater than 0")
+
+    try:
+        assert offset >= 0
+    except AssertionError:
+        raise BadRequest("offset must not be negative")
+
+    return limit, offset
+
+
+def validate_deadline_ms(deadline_ms):
+    if not deadline_ms:
+        return None
+
+    try:
+        deadline_ms = int(deadline_ms)
+    except ValueError:
+        raise BadRequest("deadline_ms must be an integer")
+
+    try:
+        assert deadline_ms > 0
+    except AssertionError:
+        raise BadRequest("deadline_ms must be greater than 0")
+
+    return deadline_ms
+
+
+def validate_percentiles(percentiles):
+    if not percentiles:
+        return DEFAULT_PERCENTILES
+
+    try:
+        percentiles = [float(p) for p in percentiles.split(",")]
+    except ValueError:
+        raise BadRequest("percentiles must be a comma-separated list of "
+                         + "numbers")
+
+    try:
+        assert all(0 <= p <= 100 for p in percentiles)
+    except AssertionError:
+        raise BadRequest("percentiles must be between 0 and 100")
+
+    return percentiles
+
+
 def validate_time_period(time_period):
     try:
         assert time_period
@@ -53,6 +235,7 @@ def validate_time_period(time_period):
         raise BadRequest("Must provide a time_period")
 
     try:
+        assert isinstance(time_period, str)
         assert time_period.lower() == "month" or time_period.lower() == "week"
     except AssertionError:
         raise BadRequest("time_period must be 'month' or 'week'")
@@ -71,9 +254,20 @@ class GetMostViewedArticlesRequest:
     year: InitVar[int]
     time_period: str
     day: InitVar[int | None] = None
+    limit: int | None = None
+    offset: int = 0
+    project: list[str] | None = None
+    access: str | None = None
+    deadline_ms: int | None = None
 
     def __post_init__(self, month, year, day) -> None:
         validate_time_period(self.time_period)
+        self.limit, self.offset = validate_limit_and_offset(
+            self.limit, self.offset
+        )
+        self.deadline_ms = validate_deadline_ms(self.deadline_ms)
+        self.project = validate_projects(self.project)
+        self.access = validate_access(self.access)
 
         assert_date_components((month, "month"), (year, "year"))
         assert_week_has_day(day, self.time_period)
@@ -91,6 +285,15 @@ class GetMostViewedArticlesRequest:
         validate_date(self.day, self.month, self.year)
 
 
+@dataclass
+class GetTrendingArticlesRequest(GetMostViewedArticlesRequest):
+    sort: str | None = None
+
+    def __post_init__(self, month, year, day) -> None:
+        super().__post_init__(month, year, day)
+        self.sort = validate_sort(self.sort)
+
+
 @dataclass
 class GetTotalArticleViewsRequest:
     month: InitVar[int]
@@ -98,9 +301,50 @@ class GetTotalArticleViewsRequest:
     time_period: str
     title: str
     day: InitVar[int | None] = None
+    project: list[str] | None = None
+    access: str | None = None
+    agent: str | None = None
 
     def __post_init__(self, month, year, day) -> None:
         assert_title(self.title)
+        self.project = validate_projects(self.project)
+        self.access = validate_access(self.access)
+        self.agent = validate_agent(self.agent)
+
+        validate_time_period(self.time_period)
+
+        assert_date_components((month, "month"), (year, "year"))
+        assert_week_has_day(day, self.time_period)
+
+        if day:
+            self.day, self.month, self.year = (
+                validate_day_month_year(day, month, year)
+            )
+        else:
+            self.day, self.month, self.year = (
+                validate_day_month_year(1, month, year)
+            )
+
+        validate_year(self.year)
+        validate_date(self.day, self.month, self.year)
+
+
+@dataclass
+class GetTotalArticleViewsBatchRequest:
+    month: InitVar[int]
+    year: InitVar[int]
+    time_period: str
+    titles: list[str]
+    day: InitVar[int | None] = None
+    project: list[str] | None = None
+    access: str | None = None
+    agent: str | None = None
+
+    def __post_init__(self, month, year, day) -> None:
+        self.titles = validate_titles(self.titles)
+        self.project = validate_projects(self.project)
+        self.access = validate_access(self.access)
+        self.agent = validate_agent(self.agent)
 
         validate_time_period(self.time_period)
 
@@ -125,16 +369,92 @@ class GetArticleTopDayRequest:
     month: InitVar[int]
     year: InitVar[int]
     title: str
+    project: list[str] | None = None
+    access: str | None = None
+    agent: str | None = None
 
     def __post_init__(self, month, year) -> None:
         assert_title(self.title)
+        self.project = validate_projects(self.project)
+        self.access = validate_access(self.access)
+        self.agent = validate_agent(self.agent)
 
         assert_date_components((month, "month"), (year, "year"))
 
         try:
             self.month = int(month)
             self.year = int(year)
-        except ValueError:
+        except (TypeError, ValueError):
             raise BadRequest("Month and year must be integers")
 
         validate_year(self.year)
+
+
+@dataclass
+class DateRangeRequest:
+    start_date: date
+    end_date: date
+
+    def __post_init__(self) -> None:
+        self.start_date, self.end_date = validate_date_range(
+            self.start_date, self.end_date
+        )
+
+
+@dataclass
+class GetMostViewedArticlesRangeRequest(DateRangeRequest):
+    limit: int | None = None
+    offset: int = 0
+    project: list[str] | None = None
+    access: str | None = None
+    deadline_ms: int | None = None
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        self.limit, self.offset = validate_limit_and_offset(
+            self.limit, self.offset
+        )
+        self.deadline_ms = validate_deadline_ms(self.deadline_ms)
+        self.project = validate_projects(self.project)
+        self.access = validate_access(self.access)
+
+
+@dataclass
+class GetTrendingArticlesRangeRequest(GetMostViewedArticlesRangeRequest):
+    sort: str | None = None
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        self.sort = validate_sort(self.sort)
+
+
+@dataclass
+class GetArticleRangeRequest(DateRangeRequest):
+    title: str
+    project: list[str] | None = None
+    access: str | None = None
+    agent: str | None = None
+
+    def __post_init__(self) -> None:
+        assert_title(self.title)
+        self.project = validate_projects(self.project)
+        self.access = validate_access(self.access)
+        self.agent = validate_agent(self.agent)
+
+        super().__post_init__()
+
+
+@dataclass
+class GetArticlesBatchRangeRequest(DateRangeRequest):
+    titles: list[str]
+    project: list[str] | None = None
+    access: str | None = None
+    agent: str | None = None
+
+    def __post_init__(self) -> None:
+        self.titles = validate_titles(self.titles)
+        self.project = validate_projects(self.project)
+        self.access = validate_access(self.access)
+        self.agent = validate_agent(self.agent)
+
+        super().__post_init__()
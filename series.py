@@ -0,0 +1,174 @@
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class DailySeries:
+    """
+    Daily views of an article over consecutive days, starting at
+    start_date. views holds 0 for days Wikimedia has no data for, which
+    are flagged as False in has_data.
+    """
+    start_date: date
+    views: np.ndarray
+    has_data: np.ndarray
+
+    @classmethod
+    def from_daily_views(cls, daily_views):
+        """Build a series from a list of (day, views or None) pairs."""
+        views = np.fromiter(
+            (views or 0 for _, views in daily_views),
+            dtype=np.int64,
+            count=len(daily_views),
+        )
+        has_data = np.fromiter(
+            (views is not None for _, views in daily_views),
+            dtype=bool,
+            count=len(daily_views),
+        )
+        return cls(daily_views[0][0], views, has_data)
+
+    def day(self, index):
+        return self.start_date + timedelta(days=int(index))
+
+    def total(self):
+        return int(self.views.sum())
+
+    def mean(self):
+        """Mean views of the days with data, or None when there are none."""
+        if not self.has_data.any():
+            return None
+        return float(self.views[self.has_data].mean())
+
+    def top_day(self):
+        """
+        Return the first day with the most views along with its views, or
+        (None, 0) when the article had no views.
+        """
+        index = int(self.views.argmax())
+        if self.views[index] <= 0:
+            return None, 0
+        return self.day(index), int(self.views[index])
+
+    def percentiles(self, percentiles):
+        """
+        Return the daily views at each of the given percentiles, over the
+        days with data, or None when there are none.
+        """
+        if not self.has_data.any():
+            return None
+        return np.percentile(self.views[self.has_data], percentiles).tolist()
+
+    def days(self):
+        """List the series as (day, views or None) pairs."""
+        return [
+            (self.day(index), int(views) if has_data else None)
+            for index, (views, has_data) in enumerate(
+                zip(self.views, self.has_data)
+            )
+        ]
+
+    @property
+    def end_date(self):
+        return self.day(len(self.views) - 1)
+
+    def head(self, count):
+        """The series of the first count days."""
+        return DailySeries(
+            self.start_date, self.views[:count], self.has_data[:count]
+        )
+
+    def union(self, other):
+        """
+        Return a series spanning both series, or None when there are days
+        between them. Days in both take their views from other.
+        """
+        start_date = min(self.start_date, other.start_date)
+        end_date = max(self.end_date, other.end_date)
+        if ((other.start_date - self.end_date).days > 1
+                or (self.start_date - other.end_date).days > 1):
+            return None
+
+        length = (end_date - start_date).days + 1
+        views = np.zeros(length, dtype=np.int64)
+        has_data = np.zeros(length, dtype=bool)
+        for series in (self, other):
+            offset = (series.start_date - start_date).days
+            views[offset:offset + len(series.views)] = series.views
+            has_data[offset:offset + len(series.views)] = series.has_data
+        return DailySeries(start_date, views, has_data)
+
+
+class SeriesIndex:
+    """
+    Index of a DailySeries answering, for any range of its days, the total
+    views in constant time from prefix sums, and the top day in constant
+    time from a sparse table: table[k][i] is the position of the first
+    largest views among the 2**k days starting at position i.
+    """
+
+    def __init__(self, series):
+        self.series = series
+        views = series.views
+        self.prefix = np.concatenate(([0], np.cumsum(views)))
+        self.table = [np.arange(len(views), dtype=np.int32)]
+        span = 1
+        while 2 * span <= len(views):
+            previous = self.table[-1]
+            left = previous[:len(previous) - span]
+            right = previous[span:]
+            self.table.append(
+                np.where(views[right] > views[left], right, left)
+            )
+            span *= 2
+
+    def __len__(self):
+        return len(self.series.views)
+
+    def covers(self, start_date, end_date):
+        return (self.series.start_date <= start_date
+                and end_date <= self.series.end_date)
+
+    def window(self, start_date, end_date):
+        """The range of days from start_date to end_date (inclusive)."""
+        return IndexedRange(
+            self,
+            (start_date - self.series.start_date).days,
+            (end_date - self.series.start_date).days,
+        )
+
+    def total(self, first, last):
+        """Total views from position first to last (inclusive)."""
+        return int(self.prefix[last + 1] - self.prefix[first])
+
+    def argmax(self, first, last):
+        """Position of the first largest views from first to last."""
+        level = (last - first + 1).bit_length() - 1
+        left = self.table[level][first]
+        right = self.table[level][last - (1 << level) + 1]
+        views = self.series.views
+        return int(right if views[right] > views[left] else left)
+
+
+@dataclass(frozen=True)
+class IndexedRange:
+    """A range of an indexed series, with DailySeries' total and top_day."""
+    index: SeriesIndex
+    first: int
+    last: int
+
+    def total(self):
+        return self.index.total(self.first, self.last)
+
+    def top_day(self):
+        """
+        Return the first day with the most views along with its views, or
+        (None, 0) when the article had no views.
+        """
+        position = self.index.argmax(self.first, self.last)
+        views = int(self.index.series.views[position])
+        if views <= 0:
+            return None, 0
+        return self.index.series.day(position), views
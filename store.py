@@ -0,0 +1,232 @@
+import fcntl
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+import metrics
+
+
+# One row per article in a day's top list.
+SNAPSHOT_DTYPE = np.dtype([("id", "<i4"), ("views", "<i8")])
+# Bits of an article key (see article_keys) below its project's position.
+PROJECT_SHIFT = 32
+
+
+class TitleTable:
+    """
+    Interns article titles as consecutive integer IDs.
+
+    When backed by a file the table is append-only and shared by every
+    process using the same file: new titles are appended under an
+    exclusive lock after catching up with titles other processes added.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._titles = []
+        self._ids = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+
+        if path:
+            open(path, "a").close()
+            with self._lock:
+                self._catch_up()
+
+    def __len__(self):
+        return len(self._titles)
+
+    def ids_for(self, titles):
+        """Return an array with the ID of each title, interning new ones."""
+        with self._lock:
+            new_titles = [title for title in titles if title not in self._ids]
+            if new_titles:
+                self._add(new_titles)
+            return np.fromiter(
+                (self._ids[title] for title in titles),
+                dtype=np.int32,
+                count=len(titles),
+            )
+
+    def title(self, title_id):
+        """
+        Return the title of an ID. IDs another process interned, e.g. in a
+        snapshot read from a shared cache, are loaded from the file first.
+        """
+        if title_id >= len(self._titles) and self.path:
+            with self._lock:
+                self._catch_up()
+        return self._titles[title_id]
+
+    def _add(self, titles):
+        if not self.path:
+            self._append(titles)
+            return
+
+        with open(self.path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._catch_up()
+                titles = dict.fromkeys(
+                    title for title in titles if title not in self._ids
+                )
+                f.write("".join(f"{title}\n" for title in titles).encode())
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self._catch_up()
+
+    def _append(self, titles):
+        for title in titles:
+            if title not in self._ids:
+                self._ids[title] = len(self._titles)
+                self._titles.append(title)
+
+    def _catch_up(self):
+        """Load titles appended to the file since it was last read."""
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end:
+            self._append(data[:end - 1].decode().split("\n"))
+            self._offset += end
+
+
+def as_snapshot(title_ids, views):
+    snapshot = np.empty(len(title_ids), dtype=SNAPSHOT_DTYPE)
+    snapshot["id"] = title_ids
+    snapshot["views"] = views
+    return snapshot
+
+
+def to_snapshot(top_articles, titles):
+    """
+    Convert a day's top articles, given as parallel titles and views
+    columns, into a snapshot array.
+    """
+    return as_snapshot(
+        titles.ids_for(top_articles.titles),
+        np.asarray(top_articles.views, dtype=np.int64),
+    )
+
+
+def aggregate(snapshots):
+    """
+    Sum views per article across snapshots. Returns an array of distinct
+    title IDs, in ascending order, and an array with the total views of
+    each.
+
+    IDs are compacted to positions among the distinct IDs before views are
+    summed into counters, so that the cost follows the number of rows
+    rather than the size of the title table.
+    """
+    if not snapshots:
+        return (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64))
+    rows = np.concatenate(snapshots)
+    ids, positions = np.unique(rows["id"], return_inverse=True)
+    totals = np.bincount(
+        positions.ravel(), weights=rows["views"], minlength=len(ids)
+    )
+    return ids.astype(np.int32), totals.astype(np.int64)
+
+
+def article_keys(project_position, title_ids):
+    """
+    Key the title IDs of an aggregate of one of several projects by that
+    project's position among them too, so that a title found on two of the
+    projects stays two articles. Keys sort by project, then title ID.
+    """
+    return (np.int64(project_position) << PROJECT_SHIFT) | title_ids
+
+
+def split_article_key(key):
+    """The project position and title ID of a key (see article_keys)."""
+    return divmod(int(key), 1 << PROJECT_SHIFT)
+
+
+def align(*aggregates):
+    """
+    Line up the totals of several aggregates (see aggregate) on their title
+    IDs (or article keys). Returns the distinct IDs of them all, in
+    ascending order, and for each aggregate an array with the total views of
+    every one of those articles, 0 where it had none.
+    """
+    ids = np.unique(np.concatenate(
+        [np.empty(0, dtype=np.int32)] + [ids for ids, _ in aggregates]
+    ))
+    aligned = []
+    for aggregate_ids, totals in aggregates:
+        views = np.zeros(len(ids), dtype=np.int64)
+        views[np.searchsorted(ids, aggregate_ids)] = totals
+        aligned.append(views)
+    return ids, aligned
+
+
+def rank(totals, count=None):
+    """
+    Return the positions of the count largest totals (all of them when
+    count is None), largest first. Ties keep their original order.
+    """
+    if count is None or count >= len(totals):
+        return np.argsort(-totals, kind="stable")
+    if count <= 0:
+        return np.empty(0, dtype=np.intp)
+    candidates = np.argpartition(-totals, count - 1)[:count]
+    return candidates[np.lexsort((candidates, -totals[candidates]))]
+
+
+class TopArticlesStore:
+    """
+    On-disk store of daily top-articles snapshots.
+
+    Each day is kept as one .npy file of (title ID, views) rows under
+    <directory>/<project>/<access>/ and is memory-mapped when read, so
+    aggregating a range of days only touches the pages it needs. Whole-month
+    aggregates are kept alongside them in the same format. Title IDs refer
+    to the store's TitleTable.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.titles = TitleTable(os.path.join(directory, "titles.txt"))
+
+    def _path(self, name, project, access):
+        return os.path.join(self.directory, project, access, f"{name}.npy")
+
+    def get(self, day, project, access):
+        """Return the snapshot for a day, or None if it is not stored."""
+        return self._load(day.strftime("%Y%m%d"), project, access)
+
+    def put(self, day, snapshot, project, access):
+        self._save(day.strftime("%Y%m%d"), snapshot, project, access)
+
+    def get_month(self, year, month, project, access):
+        """Return the aggregate of a month, or None if it is not stored."""
+        return self._load(f"{year}{month:02}", project, access)
+
+    def put_month(self, year, month, snapshot, project, access):
+        self._save(f"{year}{month:02}", snapshot, project, access)
+
+    def _load(self, name, project, access):
+        try:
+            snapshot = np.load(
+                self._path(name, project, access), mmap_mode="r"
+            )
+        except FileNotFoundError:
+            metrics.CACHE_REQUESTS.inc("store", "miss")
+            return None
+        metrics.CACHE_REQUESTS.inc("store", "hit")
+        return snapshot
+
+    def _save(self, name, snapshot, project, access):
+        path = self._path(name, project, access)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, snapshot)
+        os.replace(tmp_path, path)
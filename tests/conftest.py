@@ -0,0 +1,11 @@
+import pytest
+
+from app import daily_cache, month_cache, pageviews
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Keep cached Wikimedia results from leaking between tests."""
+    daily_cache.clear()
+    month_cache.clear()
+    pageviews.clear_indexes()
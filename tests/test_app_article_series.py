@@ -0,0 +1,109 @@
+from unittest.mock import patch
+
+import pytest
+from requests import Response
+
+from app import app, V1_BASE_URL
+
+
+GET_ARTICLE_SERIES_URL = f"{V1_BASE_URL}/articles/series"
+GET_TOTAL_ARTICLE_VIEWS_URL = f"{V1_BASE_URL}/articles/total_views"
+GET_ARTICLE_TOP_DAY_URL = f"{V1_BASE_URL}/articles/top_day"
+WIKIMEDIA_RESPONSE = {
+    "items": [
+        {
+            "project": "en.wikipedia",
+            "article": "Carlos_Hathcock",
+            "granularity": "daily",
+            "timestamp": "2015101000",
+            "access": "all-access",
+            "agent": "all-agents",
+            "views": 291926
+        },
+        {
+            "project": "en.wikipedia",
+            "article": "Carlos_Hathcock",
+            "granularity": "daily",
+            "timestamp": "2015101100",
+            "access": "all-access",
+            "agent": "all-agents",
+            "views": 13380
+        }
+    ]
+}
+
+
+app.config.update({
+        "TESTING": True,
+    })
+
+
+@pytest.fixture()
+def client():
+    return app.test_client()
+
+
+@patch("upstream.requests.Session.get")
+def test_article_series(mock_request, client):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
+    response_with_json.status_code = 200
+    mock_request.return_value = response_with_json
+
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-12",
+        "title": "Carlos_Hathcock",
+        "percentiles": "0,100",
+    }
+    resp = client.get(GET_ARTICLE_SERIES_URL, query_string=params)
+
+    assert resp.json["total_views"] == 305306
+    # 2015-10-12 has no data, and is left out of the statistics.
+    assert resp.json["mean_views"] == pytest.approx(305306 / 2)
+    assert resp.json["top_day"] == {"date": "2015-10-10", "views": 291926}
+    assert resp.json["percentiles"] == {"0": 13380, "100": 291926}
+    assert resp.json["views"] == [
+        {"date": "2015-10-10", "views": 291926},
+        {"date": "2015-10-11", "views": 13380},
+        {"date": "2015-10-12", "views": None},
+    ]
+
+
+@patch("upstream.requests.Session.get")
+def test_article_statistics_share_one_fetch(mock_request, client):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
+    response_with_json.status_code = 200
+    mock_request.return_value = response_with_json
+
+    params = {"month": 10, "year": 2015, "title": "Carlos_Hathcock"}
+    client.get(GET_TOTAL_ARTICLE_VIEWS_URL,
+               query_string={**params, "time_period": "month"})
+    client.get(GET_ARTICLE_TOP_DAY_URL, query_string=params)
+    client.get(GET_ARTICLE_SERIES_URL,
+               query_string={**params, "time_period": "month"})
+
+    assert mock_request.call_count == 1
+
+
+def test_article_series_bad_percentiles(client):
+    params = {
+        "month": 10,
+        "year": 2015,
+        "time_period": "month",
+        "title": "Carlos_Hathcock",
+        "percentiles": "50,101",
+    }
+    resp = client.get(GET_ARTICLE_SERIES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "percentiles must be between 0 and 100"
+
+
+def test_article_series_missing_title(client):
+    params = {"month": 10, "year": 2015, "time_period": "month"}
+    resp = client.get(GET_ARTICLE_SERIES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "Must provide a title"
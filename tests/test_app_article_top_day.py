@@ -44,7 +44,7 @@ def client():
     return app.test_client()
 
 
-@patch("app.requests.get")
+@patch("upstream.requests.Session.get")
 def test_article_top_day(mock_request, client):
     response_with_json = Response()
     response_with_json.json = lambda: WIKIMEDIA_RESPONSE
@@ -59,7 +59,7 @@ def test_article_top_day(mock_request, client):
     assert resp.json["views"] == 291926
 
 
-@patch("app.requests.get")
+@patch("upstream.requests.Session.get")
 def test_article_top_day_no_data(mock_request, client):
     """
     Should return an empty response when the provided parameters are valid,
@@ -78,6 +78,32 @@ def test_article_top_day_no_data(mock_request, client):
     assert resp.json["views"] == 0
 
 
+@patch("upstream.requests.Session.get")
+def test_article_top_day_date_range(mock_request, client):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
+    response_with_json.status_code = 200
+    mock_request.return_value = response_with_json
+
+    params = {
+        "start_date": "2015-10-05",
+        "end_date": "2015-10-12",
+        "title": "Carlos_Hathcock"
+    }
+    resp = client.get(GET_ARTICLE_TOP_DAY_URL, query_string=params)
+
+    assert resp.json["date"] == "2015-10-10"
+    assert resp.json["views"] == 291926
+
+
+def test_article_top_day_date_range_missing_title(client):
+    params = {"start_date": "2015-10-05", "end_date": "2015-10-12"}
+    resp = client.get(GET_ARTICLE_TOP_DAY_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "Must provide a title"
+
+
 def test_article_top_day_bad_date_format(client):
     params = {"month": "October", "year": 2015, "title": "Carlos_Hathcock"}
     resp = client.get(GET_ARTICLE_TOP_DAY_URL, query_string=params)
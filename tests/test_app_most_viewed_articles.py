@@ -1,12 +1,20 @@
+import json
+import threading
+import time
+from datetime import date
 from unittest.mock import patch
 
 import pytest
 from requests import Response
 
-from app import app, V1_BASE_URL
+from app import app, daily_cache, V1_BASE_URL
+from cache import MISSING
 
 
 GET_MOST_VIEWED_ARTICLES_URL = f"{V1_BASE_URL}/articles/top"
+WIKIMEDIA_EMPTY_RESPONSE = {
+    "detail": "The date(s) you used are valid, but..."
+}
 WIKIMEDIA_RESPONSE = {
     "items": [
         {
@@ -47,11 +55,18 @@ def client():
     return app.test_client()
 
 
-@patch("app.requests.get")
+def wikimedia_response(payload, status_code=200):
+    """A response whose body can be streamed again on every request."""
+    response = Response()
+    response.status_code = status_code
+    response._content = json.dumps(payload).encode()
+    response._content_consumed = True
+    return response
+
+
+@patch("upstream.requests.Session.get")
 def test_most_viewed_articles_week(mock_request, client):
-    response_with_json = Response()
-    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
-    response_with_json.status_code = 200
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
     mock_request.return_value = response_with_json
 
     params = {"day": 10, "month": 10, "year": 2015, "time_period": "week"}
@@ -62,11 +77,9 @@ def test_most_viewed_articles_week(mock_request, client):
     assert len(resp.json["articles"]) == resp.json["count"]
 
 
-@patch("app.requests.get")
+@patch("upstream.requests.Session.get")
 def test_most_viewed_articles_month(mock_request, client):
-    response_with_json = Response()
-    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
-    response_with_json.status_code = 200
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
     mock_request.return_value = response_with_json
 
     params = {"month": 10, "year": 2015, "time_period": "month"}
@@ -77,6 +90,300 @@ def test_most_viewed_articles_month(mock_request, client):
     assert len(resp.json["articles"]) == resp.json["count"]
 
 
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_month_fetches_every_day(mock_request, client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    mock_request.return_value = response_with_json
+
+    params = {"month": 10, "year": 2015, "time_period": "month"}
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    requested_urls = {call.args[0] for call in mock_request.call_args_list}
+    assert len(requested_urls) == 31
+    assert any(url.endswith("/2015/10/01") for url in requested_urls)
+    assert any(url.endswith("/2015/10/31") for url in requested_urls)
+    assert resp.json["articles"][0] == {
+        "title": "Main_Page",
+        "total_views": 31 * 18793503
+    }
+
+
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_skips_days_without_data(mock_request, client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    empty_response = Response()
+    empty_response.json = lambda: WIKIMEDIA_EMPTY_RESPONSE
+    empty_response.status_code = 404
+
+    def get(url, **kwargs):
+        return empty_response if url.endswith("/16") else response_with_json
+
+    mock_request.side_effect = get
+
+    params = {"day": 10, "month": 10, "year": 2015, "time_period": "week"}
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 200
+    assert resp.json["end_date"] == "2015-10-16"
+    assert resp.json["articles"][0]["total_views"] == 6 * 18793503
+    assert resp.headers["Cache-Control"] == "no-cache"
+
+
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_repeat_request_is_cached(mock_request, client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    mock_request.return_value = response_with_json
+
+    params = {"day": 10, "month": 10, "year": 2015, "time_period": "week"}
+    first = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+    second = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert mock_request.call_count == 7
+    assert first.json == second.json
+
+
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_limit_and_offset(mock_request, client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    mock_request.return_value = response_with_json
+
+    params = {
+        "day": 10,
+        "month": 10,
+        "year": 2015,
+        "time_period": "week",
+        "limit": 1,
+        "offset": 1,
+    }
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.json["count"] == 3
+    assert resp.json["articles"] == [
+        {"title": "Special:Search", "total_views": 7 * 2629537}
+    ]
+
+
+def test_most_viewed_articles_bad_limit(client):
+    params = {"month": 10, "year": 2015, "time_period": "month", "limit": 0}
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "limit must be greater than 0"
+
+
+def test_most_viewed_articles_bad_offset(client):
+    params = {"month": 10, "year": 2015, "time_period": "month", "offset": -1}
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "offset must not be negative"
+
+
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_date_range(mock_request, client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    mock_request.return_value = response_with_json
+
+    params = {"start_date": "2015-09-29", "end_date": "2015-11-02"}
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.json["start_date"] == "2015-09-29"
+    assert resp.json["end_date"] == "2015-11-02"
+    assert resp.json["articles"][0]["total_views"] == 35 * 18793503
+    assert mock_request.call_count == 35
+
+
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_across_projects(mock_request, client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    mock_request.return_value = response_with_json
+
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-16",
+        "project": "en.wikipedia,de.wikipedia",
+        "access": "desktop",
+    }
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.json["count"] == 6
+    assert resp.json["articles"][:2] == [
+        {"project": "en.wikipedia", "title": "Main_Page",
+         "total_views": 7 * 18793503},
+        {"project": "de.wikipedia", "title": "Main_Page",
+         "total_views": 7 * 18793503},
+    ]
+    paths = [call.args[0] for call in mock_request.call_args_list]
+    assert len(paths) == 14
+    assert sum("/de.wikipedia/desktop/" in path for path in paths) == 7
+
+
+def test_most_viewed_articles_bad_project(client):
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-16",
+        "project": "en.wikipedia,../top",
+    }
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"].startswith("project must be")
+
+
+def test_most_viewed_articles_bad_access(client):
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-16",
+        "access": "mobile",
+    }
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == (
+        "access must be one of all-access, desktop, mobile-app, mobile-web"
+    )
+
+
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_partial_within_deadline(mock_request, client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    release = threading.Event()
+
+    def get(url, **kwargs):
+        if url.endswith("/2015/10/12"):
+            release.wait(5)
+        return response_with_json
+
+    mock_request.side_effect = get
+
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-12",
+        "deadline_ms": 200,
+    }
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+    release.set()
+
+    assert resp.status_code == 200
+    assert resp.json["missing_days"] == ["2015-10-12"]
+    assert resp.json["articles"][0]["total_views"] == 2 * 18793503
+    assert resp.headers["Cache-Control"] == "no-cache"
+    assert "ETag" not in resp.headers
+
+    # The slow day is still fetched, and cached for the next request.
+    key = ("en.wikipedia", "all-access", None, None, date(2015, 10, 12))
+    for _ in range(50):
+        if daily_cache.get(key) is not MISSING:
+            break
+        time.sleep(0.1)
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.json["missing_days"] == []
+    assert resp.json["articles"][0]["total_views"] == 3 * 18793503
+    assert resp.headers["Cache-Control"].endswith("immutable")
+    assert mock_request.call_count == 3
+
+
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_partial_without_failed_days(mock_request,
+                                                          client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    failure = wikimedia_response({"detail": "Bad request"}, 400)
+    mock_request.side_effect = lambda url, **kwargs: (
+        failure if url.endswith("/2015/10/11") else response_with_json
+    )
+
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-12",
+        "deadline_ms": 2000,
+    }
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 200
+    assert resp.json["missing_days"] == ["2015-10-11"]
+    assert resp.json["articles"][0]["total_views"] == 2 * 18793503
+    assert resp.headers["Cache-Control"] == "no-cache"
+
+
+def test_most_viewed_articles_bad_deadline(client):
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-16",
+        "deadline_ms": "0",
+    }
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "deadline_ms must be greater than 0"
+
+
+def test_most_viewed_articles_date_range_reversed(client):
+    params = {"start_date": "2015-11-02", "end_date": "2015-09-29"}
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "start_date must not be after end_date"
+
+
+def test_most_viewed_articles_date_range_bad_format(client):
+    params = {"start_date": "2015-11-02", "end_date": "November 3rd"}
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert "YYYY-MM-DD" in resp.json["description"]
+
+
+def test_most_viewed_articles_date_range_missing_end_date(client):
+    params = {"start_date": "2015-11-02"}
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "Must provide end_date"
+
+
+@patch("app.NDJSON_CHUNK_SIZE", 2)
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_ndjson(mock_request, client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    mock_request.return_value = response_with_json
+
+    params = {"day": 10, "month": 10, "year": 2015, "time_period": "week"}
+    resp = client.get(
+        GET_MOST_VIEWED_ARTICLES_URL,
+        query_string=params,
+        headers={"Accept": "application/x-ndjson"},
+    )
+
+    assert resp.is_streamed
+    assert resp.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert lines[0] == {
+        "count": 3,
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-16"
+    }
+    assert [line["title"] for line in lines[1:]] == [
+        "Main_Page", "Special:Search", "Carlos_Hathcock"
+    ]
+
+
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_prefers_json(mock_request, client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    mock_request.return_value = response_with_json
+
+    params = {"day": 10, "month": 10, "year": 2015, "time_period": "week"}
+    resp = client.get(
+        GET_MOST_VIEWED_ARTICLES_URL,
+        query_string=params,
+        headers={"Accept": "*/*"},
+    )
+
+    assert resp.mimetype == "application/json"
+    assert resp.json["count"] == 3
+
+
 def test_most_viewed_articles_bad_time_period(client):
     params = {"month": 10, "year": 2015, "time_period": "year"}
     resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
@@ -115,3 +422,23 @@ def test_most_viewed_articles_missing_required_params(client):
 
     assert resp.status_code == 400
     assert resp.json["description"] == "Must provide a time_period"
+
+
+@patch("upstream.time.sleep")
+@patch("upstream.requests.Session.get")
+def test_most_viewed_articles_retries_failed_days(mock_request, mock_sleep,
+                                                  client):
+    response_with_json = wikimedia_response(WIKIMEDIA_RESPONSE)
+    failures = {"/2015/10/17": wikimedia_response({}, 429)}
+
+    def get(url, **kwargs):
+        return failures.pop(url[-11:], response_with_json)
+
+    mock_request.side_effect = get
+
+    params = {"month": 10, "year": 2015, "time_period": "month"}
+    resp = client.get(GET_MOST_VIEWED_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 200
+    assert resp.json["articles"][0]["total_views"] == 31 * 18793503
+    assert mock_request.call_count == 32
@@ -1,9 +1,11 @@
+from datetime import timedelta
 from unittest.mock import patch
 
 import pytest
 from requests import Response
 
 from app import app, V1_BASE_URL
+from cache import utc_today
 
 
 GET_TOTAL_ARTICLE_VIEWS = f"{V1_BASE_URL}/articles/total_views"
@@ -44,7 +46,7 @@ def client():
     return app.test_client()
 
 
-@patch("app.requests.get")
+@patch("upstream.requests.Session.get")
 def test_total_article_views_week(mock_request, client):
     response_with_json = Response()
     response_with_json.json = lambda: WIKIMEDIA_RESPONSE
@@ -63,10 +65,11 @@ def test_total_article_views_week(mock_request, client):
     assert resp.json["start_date"] == "2015-10-10"
     assert resp.json["end_date"] == "2015-10-16"
     assert resp.json["total_views"] == 305306
+    assert resp.headers["X-Data-Freshness"] == "fresh"
     assert resp.json["title"] == params["title"]
 
 
-@patch("app.requests.get")
+@patch("upstream.requests.Session.get")
 def test_total_article_views_week_no_data(mock_request, client):
     """
     Should return a response with 0 views when the provided parameters are
@@ -92,7 +95,7 @@ def test_total_article_views_week_no_data(mock_request, client):
     assert resp.json["title"] == params["title"]
 
 
-@patch("app.requests.get")
+@patch("upstream.requests.Session.get")
 def test_total_article_views_month(mock_request, client):
     response_with_json = Response()
     response_with_json.json = lambda: WIKIMEDIA_RESPONSE
@@ -113,6 +116,164 @@ def test_total_article_views_month(mock_request, client):
     assert resp.json["title"] == params["title"]
 
 
+@patch("upstream.requests.Session.get")
+def test_total_article_views_not_modified(mock_request, client):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
+    response_with_json.status_code = 200
+    mock_request.return_value = response_with_json
+
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-11",
+        "title": "Carlos_Hathcock"
+    }
+    resp = client.get(GET_TOTAL_ARTICLE_VIEWS, query_string=params)
+    etag = resp.headers["ETag"]
+
+    assert resp.headers["Cache-Control"] == (
+        "public, max-age=31536000, immutable"
+    )
+
+    resp = client.get(
+        GET_TOTAL_ARTICLE_VIEWS,
+        query_string=params,
+        headers={"If-None-Match": etag},
+    )
+
+    assert resp.status_code == 304
+    assert resp.headers["ETag"] == etag
+    assert mock_request.call_count == 1
+
+    params["title"] = "Main_Page"
+    resp = client.get(
+        GET_TOTAL_ARTICLE_VIEWS,
+        query_string=params,
+        headers={"If-None-Match": etag},
+    )
+
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+@patch("upstream.requests.Session.get")
+def test_total_article_views_recent_period_short_max_age(mock_request,
+                                                         client):
+    today = utc_today()
+    response_with_json = Response()
+    response_with_json.json = lambda: {"items": [
+        {"timestamp": day.strftime("%Y%m%d00"), "views": 1}
+        for day in (today - timedelta(days=1), today)
+    ]}
+    response_with_json.status_code = 200
+    mock_request.return_value = response_with_json
+
+    params = {
+        "start_date": (today - timedelta(days=1)).isoformat(),
+        "end_date": today.isoformat(),
+        "title": "Carlos_Hathcock"
+    }
+    resp = client.get(GET_TOTAL_ARTICLE_VIEWS, query_string=params)
+
+    assert resp.headers["Cache-Control"] == "public, max-age=300"
+
+    resp = client.get(
+        GET_TOTAL_ARTICLE_VIEWS,
+        query_string=params,
+        headers={"If-None-Match": resp.headers["ETag"]},
+    )
+
+    assert resp.status_code == 304
+    assert resp.headers["Cache-Control"] == "public, max-age=300"
+
+
+@patch("upstream.requests.Session.get")
+def test_total_article_views_unloaded_day_not_cached(mock_request, client):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
+    response_with_json.status_code = 200
+    mock_request.return_value = response_with_json
+
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-12",
+        "title": "Carlos_Hathcock"
+    }
+    resp = client.get(GET_TOTAL_ARTICLE_VIEWS, query_string=params)
+
+    assert resp.json["total_views"] == 305306
+    assert resp.headers["Cache-Control"] == "no-cache"
+    assert "ETag" not in resp.headers
+
+
+@patch("upstream.requests.Session.get")
+def test_total_article_views_date_range(mock_request, client):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
+    response_with_json.status_code = 200
+    mock_request.return_value = response_with_json
+
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-11",
+        "title": "Carlos_Hathcock"
+    }
+    resp = client.get(GET_TOTAL_ARTICLE_VIEWS, query_string=params)
+
+    assert resp.json["start_date"] == "2015-10-10"
+    assert resp.json["end_date"] == "2015-10-11"
+    assert resp.json["total_views"] == 305306
+    assert mock_request.call_args.args[0].endswith("/20151010/20151011")
+
+
+@patch("upstream.requests.Session.get")
+def test_total_article_views_access_and_agent(mock_request, client):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
+    response_with_json.status_code = 200
+    mock_request.return_value = response_with_json
+
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-11",
+        "title": "Carlos_Hathcock",
+        "project": "fr.wikipedia",
+        "access": "mobile-web",
+        "agent": "user",
+    }
+    resp = client.get(GET_TOTAL_ARTICLE_VIEWS, query_string=params)
+
+    assert resp.json["total_views"] == 305306
+    assert "/fr.wikipedia/mobile-web/user/Carlos_Hathcock/" in (
+        mock_request.call_args.args[0]
+    )
+
+
+def test_total_article_views_bad_agent(client):
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-11",
+        "title": "Carlos_Hathcock",
+        "agent": "robot",
+    }
+    resp = client.get(GET_TOTAL_ARTICLE_VIEWS, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"].startswith("agent must be one of")
+
+
+def test_total_article_views_date_range_too_long(client):
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2019-10-11",
+        "title": "Carlos_Hathcock"
+    }
+    resp = client.get(GET_TOTAL_ARTICLE_VIEWS, query_string=params)
+
+    assert resp.status_code == 400
+    assert "Date range must not exceed" in resp.json["description"]
+
+
 def test_total_article_views_bad_date_format(client):
     params = {
         "month": "February",
@@ -0,0 +1,156 @@
+from unittest.mock import patch
+
+import pytest
+from requests import Response
+
+from app import app, V1_BASE_URL
+
+
+TOTAL_ARTICLE_VIEWS_BATCH_URL = f"{V1_BASE_URL}/articles/total_views:batch"
+WIKIMEDIA_RESPONSE = {
+    "items": [
+        {
+            "project": "en.wikipedia",
+            "article": "Carlos_Hathcock",
+            "granularity": "daily",
+            "timestamp": "2015101000",
+            "access": "all-access",
+            "agent": "all-agents",
+            "views": 291926
+        },
+        {
+            "project": "en.wikipedia",
+            "article": "Carlos_Hathcock",
+            "granularity": "daily",
+            "timestamp": "2015101100",
+            "access": "all-access",
+            "agent": "all-agents",
+            "views": 13380
+        }
+    ]
+}
+
+
+app.config.update({
+        "TESTING": True,
+    })
+
+
+@pytest.fixture()
+def client():
+    return app.test_client()
+
+
+@patch("upstream.requests.Session.get")
+def test_total_article_views_batch(mock_request, client):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
+    response_with_json.status_code = 200
+    mock_request.return_value = response_with_json
+
+    body = {
+        "day": 10,
+        "month": 10,
+        "year": 2015,
+        "time_period": "week",
+        "titles": ["Carlos_Hathcock", "Main_Page", "Carlos_Hathcock"]
+    }
+    resp = client.post(TOTAL_ARTICLE_VIEWS_BATCH_URL, json=body)
+
+    assert resp.json["start_date"] == "2015-10-10"
+    assert resp.json["end_date"] == "2015-10-16"
+    assert resp.json["count"] == 2
+    assert resp.json["articles"] == [
+        {"title": "Carlos_Hathcock", "total_views": 305306},
+        {"title": "Main_Page", "total_views": 305306},
+    ]
+    assert mock_request.call_count == 2
+
+
+@patch("upstream.time.sleep")
+@patch("upstream.requests.Session.get")
+def test_total_article_views_batch_per_title_errors(mock_request, mock_sleep,
+                                                    client):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
+    response_with_json.status_code = 200
+    error_response = Response()
+    error_response.status_code = 500
+
+    def get(url, **kwargs):
+        return error_response if "/Main_Page/" in url else response_with_json
+
+    mock_request.side_effect = get
+
+    body = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-11",
+        "titles": ["Carlos_Hathcock", "Main_Page"]
+    }
+    resp = client.post(TOTAL_ARTICLE_VIEWS_BATCH_URL, json=body)
+
+    assert resp.status_code == 200
+    assert resp.json["articles"][0]["total_views"] == 305306
+    assert resp.json["articles"][1]["title"] == "Main_Page"
+    assert resp.json["articles"][1]["error"]["code"] == 502
+    assert mock_sleep.call_count >= app.config["WIKIMEDIA_MAX_RETRIES"]
+
+
+def test_total_article_views_batch_not_json(client):
+    resp = client.post(TOTAL_ARTICLE_VIEWS_BATCH_URL, data="titles")
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "Request body must be a JSON object"
+
+
+def test_total_article_views_batch_missing_titles(client):
+    body = {"month": 10, "year": 2015, "time_period": "month"}
+    resp = client.post(TOTAL_ARTICLE_VIEWS_BATCH_URL, json=body)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "Must provide titles"
+
+
+def test_total_article_views_batch_bad_titles(client):
+    body = {
+        "month": 10,
+        "year": 2015,
+        "time_period": "month",
+        "titles": "Main_Page"
+    }
+    resp = client.post(TOTAL_ARTICLE_VIEWS_BATCH_URL, json=body)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == (
+        "titles must be a list of non-empty strings"
+    )
+
+
+def test_total_article_views_batch_too_many_titles(client):
+    body = {
+        "month": 10,
+        "year": 2015,
+        "time_period": "month",
+        "titles": [f"Title_{i}" for i in range(501)]
+    }
+    resp = client.post(TOTAL_ARTICLE_VIEWS_BATCH_URL, json=body)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "Must provide at most 500 titles"
+
+
+@pytest.mark.parametrize("fields, description", [
+    ({"time_period": 5, "month": 10, "year": 2015},
+     "time_period must be 'month' or 'week'"),
+    ({"time_period": "month", "month": [10], "year": 2015},
+     "Day, month, and year must be integers"),
+    ({"start_date": 20151010, "end_date": "2015-10-11"},
+     "start_date and end_date must be formatted as YYYY-MM-DD"),
+])
+def test_total_article_views_batch_fields_of_wrong_type(client, fields,
+                                                        description):
+    body = {**fields, "titles": ["Main_Page"]}
+    resp = client.post(TOTAL_ARTICLE_VIEWS_BATCH_URL, json=body)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == description
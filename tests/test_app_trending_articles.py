@@ -0,0 +1,126 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from requests import Response
+
+from app import app, V1_BASE_URL
+
+
+GET_TRENDING_ARTICLES_URL = f"{V1_BASE_URL}/articles/trending"
+
+
+app.config.update({
+        "TESTING": True,
+    })
+
+
+@pytest.fixture()
+def client():
+    return app.test_client()
+
+
+def top_articles_response(views_by_title):
+    response = Response()
+    response.status_code = 200
+    response._content = json.dumps({
+        "items": [{
+            "articles": [
+                {"article": title, "views": views, "rank": rank}
+                for rank, (title, views) in enumerate(views_by_title.items())
+            ]
+        }]
+    }).encode()
+    response._content_consumed = True
+    return response
+
+
+def week_of_views(url, *args, **kwargs):
+    """Main_Page steady, Python rising and Java new from 2015-10-10."""
+    if url.endswith(("/2015/10/08", "/2015/10/09")):
+        return top_articles_response({"Main_Page": 100, "Python": 10})
+    return top_articles_response({"Main_Page": 100, "Python": 25,
+                                  "Java": 40})
+
+
+@patch("upstream.requests.Session.get", side_effect=week_of_views)
+def test_trending_articles_by_delta(mock_request, client):
+    params = {"start_date": "2015-10-10", "end_date": "2015-10-11"}
+    resp = client.get(GET_TRENDING_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 200
+    assert resp.json["previous_start_date"] == "2015-10-08"
+    assert resp.json["previous_end_date"] == "2015-10-09"
+    assert resp.json["count"] == 3
+    assert resp.json["articles"] == [
+        {"title": "Java", "views": 80, "previous_views": 0, "delta": 80,
+         "ratio": None},
+        {"title": "Python", "views": 50, "previous_views": 20, "delta": 30,
+         "ratio": 2.5},
+        {"title": "Main_Page", "views": 200, "previous_views": 200,
+         "delta": 0, "ratio": 1.0},
+    ]
+    assert mock_request.call_count == 4
+
+
+@patch("upstream.requests.Session.get", side_effect=week_of_views)
+def test_trending_articles_by_ratio(mock_request, client):
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-11",
+        "sort": "ratio",
+        "limit": 2,
+    }
+    resp = client.get(GET_TRENDING_ARTICLES_URL, query_string=params)
+
+    assert [article["title"] for article in resp.json["articles"]] == [
+        "Python", "Main_Page"
+    ]
+
+
+@patch("upstream.requests.Session.get", side_effect=week_of_views)
+def test_trending_articles_month_compared_to_month_before(mock_request,
+                                                         client):
+    params = {"month": 3, "year": 2016, "time_period": "month"}
+    resp = client.get(GET_TRENDING_ARTICLES_URL, query_string=params)
+
+    assert resp.json["previous_start_date"] == "2016-02-01"
+    assert resp.json["previous_end_date"] == "2016-02-29"
+    assert mock_request.call_count == 31 + 29
+
+
+@patch("upstream.requests.Session.get")
+def test_trending_articles_keeps_projects_apart(mock_request, client):
+    def views(url, *args, **kwargs):
+        previous = url.endswith("/2015/10/09")
+        if "/de.wikipedia/" in url:
+            return top_articles_response({"Berlin": 20 if previous else 25})
+        return top_articles_response({"Berlin": 10 if previous else 30})
+
+    mock_request.side_effect = views
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-10",
+        "project": "en.wikipedia,de.wikipedia",
+    }
+    resp = client.get(GET_TRENDING_ARTICLES_URL, query_string=params)
+
+    assert resp.json["count"] == 2
+    assert resp.json["articles"] == [
+        {"project": "en.wikipedia", "title": "Berlin", "views": 30,
+         "previous_views": 10, "delta": 20, "ratio": 3.0},
+        {"project": "de.wikipedia", "title": "Berlin", "views": 25,
+         "previous_views": 20, "delta": 5, "ratio": 1.25},
+    ]
+
+
+def test_trending_articles_bad_sort(client):
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-16",
+        "sort": "views",
+    }
+    resp = client.get(GET_TRENDING_ARTICLES_URL, query_string=params)
+
+    assert resp.status_code == 400
+    assert resp.json["description"] == "sort must be one of delta, ratio"
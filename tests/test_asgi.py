@@ -0,0 +1,240 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import asgi
+import metrics
+from app import V1_BASE_URL
+from upstream import AsyncWikimediaClient
+
+
+WIKIMEDIA_TOP_RESPONSE = {
+    "items": [
+        {
+            "articles": [
+                {"article": "Main_Page", "views": 18793503, "rank": 1},
+                {"article": "Special:Search", "views": 2629537, "rank": 2},
+            ]
+        }
+    ]
+}
+WIKIMEDIA_PER_ARTICLE_RESPONSE = {
+    "items": [
+        {"timestamp": "2015101000", "views": 291926},
+        {"timestamp": "2015101100", "views": 13380},
+    ]
+}
+
+
+@pytest.fixture()
+def upstream_requests(monkeypatch):
+    """Serve canned Wikimedia responses and record the requested paths."""
+    requested_paths = []
+
+    def handler(request):
+        requested_paths.append(request.url.path)
+        if "/per-article/" in request.url.path:
+            return httpx.Response(200, json=WIKIMEDIA_PER_ARTICLE_RESPONSE)
+        return httpx.Response(200, json=WIKIMEDIA_TOP_RESPONSE)
+
+    client = AsyncWikimediaClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(asgi.pageviews, "client", client)
+    return requested_paths
+
+
+def get(url, params=None, method="GET", headers=None):
+    async def request():
+        transport = httpx.ASGITransport(app=asgi.application)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as client:
+            return await client.request(
+                method, url, params=params, headers=headers
+            )
+
+    return asyncio.run(request())
+
+
+def test_most_viewed_articles(upstream_requests):
+    params = {"day": 10, "month": 10, "year": 2015, "time_period": "week"}
+    resp = get(f"{V1_BASE_URL}/articles/top", params)
+
+    assert resp.status_code == 200
+    assert resp.json()["start_date"] == "2015-10-10"
+    assert resp.json()["end_date"] == "2015-10-16"
+    assert resp.json()["articles"][0] == {
+        "title": "Main_Page",
+        "total_views": 7 * 18793503
+    }
+    assert len(upstream_requests) == 7
+
+
+def test_most_viewed_articles_ndjson(upstream_requests):
+    params = {"day": 10, "month": 10, "year": 2015, "time_period": "week"}
+    resp = get(
+        f"{V1_BASE_URL}/articles/top",
+        params,
+        headers={"Accept": "application/x-ndjson"},
+    )
+
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert lines[0]["count"] == 2
+    assert lines[1]["title"] == "Main_Page"
+
+
+def test_most_viewed_articles_not_modified(upstream_requests):
+    params = {"day": 10, "month": 10, "year": 2015, "time_period": "week"}
+    resp = get(f"{V1_BASE_URL}/articles/top", params)
+    etag = resp.headers["etag"]
+
+    assert resp.headers["cache-control"].endswith("immutable")
+    assert resp.headers["vary"] == "Accept"
+
+    resp = get(
+        f"{V1_BASE_URL}/articles/top", params,
+        headers={"If-None-Match": etag},
+    )
+
+    assert resp.status_code == 304
+    assert resp.content == b""
+    assert resp.headers["etag"] == etag
+    assert len(upstream_requests) == 7
+
+    resp = get(
+        f"{V1_BASE_URL}/articles/top", params,
+        headers={"If-None-Match": etag, "Accept": "application/x-ndjson"},
+    )
+
+    assert resp.status_code == 200
+    assert resp.headers["etag"] != etag
+
+
+def test_most_viewed_articles_within_deadline(upstream_requests):
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-11",
+        "deadline_ms": 5000,
+    }
+    resp = get(f"{V1_BASE_URL}/articles/top", params)
+
+    assert resp.status_code == 200
+    assert resp.json()["missing_days"] == []
+    assert resp.json()["articles"][0]["total_views"] == 2 * 18793503
+    assert len(upstream_requests) == 2
+
+
+def test_most_viewed_articles_within_deadline_without_failed_days(
+    monkeypatch,
+):
+    def handler(request):
+        if request.url.path.endswith("/2015/10/11"):
+            return httpx.Response(400, json={"detail": "Bad request"})
+        return httpx.Response(200, json=WIKIMEDIA_TOP_RESPONSE)
+
+    client = AsyncWikimediaClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(asgi.pageviews, "client", client)
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-12",
+        "deadline_ms": 2000,
+    }
+    resp = get(f"{V1_BASE_URL}/articles/top", params)
+
+    assert resp.status_code == 200
+    assert resp.json()["missing_days"] == ["2015-10-11"]
+    assert resp.json()["articles"][0]["total_views"] == 2 * 18793503
+    assert resp.headers["cache-control"] == "no-cache"
+
+def test_trending_articles(upstream_requests):
+    params = {"start_date": "2015-10-10", "end_date": "2015-10-16"}
+    resp = get(f"{V1_BASE_URL}/articles/trending", params)
+
+    assert resp.status_code == 200
+    assert resp.json()["previous_start_date"] == "2015-10-03"
+    assert resp.json()["articles"][0] == {
+        "title": "Main_Page",
+        "views": 7 * 18793503,
+        "previous_views": 7 * 18793503,
+        "delta": 0,
+        "ratio": 1.0,
+    }
+    assert len(upstream_requests) == 14
+
+def test_total_article_views(upstream_requests):
+    params = {
+        "month": 10,
+        "year": 2015,
+        "time_period": "month",
+        "title": "Carlos_Hathcock"
+    }
+    resp = get(f"{V1_BASE_URL}/articles/total_views", params)
+
+    assert resp.json()["total_views"] == 305306
+
+
+def test_article_top_day(upstream_requests):
+    params = {"month": 10, "year": 2015, "title": "Carlos_Hathcock"}
+    resp = get(f"{V1_BASE_URL}/articles/top_day", params)
+
+    assert resp.json() == {
+        "title": "Carlos_Hathcock",
+        "date": "2015-10-10",
+        "views": 291926
+    }
+
+
+def test_article_series(upstream_requests):
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-11",
+        "title": "Carlos_Hathcock"
+    }
+    resp = get(f"{V1_BASE_URL}/articles/series", params)
+
+    assert resp.json()["total_views"] == 305306
+    assert resp.json()["top_day"] == {"date": "2015-10-10", "views": 291926}
+
+
+def test_bad_request_error_json():
+    params = {"month": 10, "year": 2015, "time_period": "year"}
+    resp = get(f"{V1_BASE_URL}/articles/top", params)
+
+    assert resp.status_code == 400
+    assert resp.json()["name"] == "Bad Request"
+    assert "time_period" in resp.json()["description"]
+
+
+def test_unknown_route():
+    resp = get(f"{V1_BASE_URL}/articles/unknown")
+
+    assert resp.status_code == 404
+    assert resp.json()["code"] == 404
+
+
+def test_method_not_allowed():
+    resp = get(f"{V1_BASE_URL}/articles/top", method="POST")
+
+    assert resp.status_code == 405
+    assert resp.headers["allow"] == "GET"
+
+
+def test_metrics(upstream_requests):
+    metrics.REGISTRY.clear()
+    metrics.REGISTRY.enabled = True
+    try:
+        params = {"day": 10, "month": 10, "year": 2015, "time_period": "week"}
+        get(f"{V1_BASE_URL}/articles/top", params)
+        resp = get("/metrics")
+    finally:
+        metrics.REGISTRY.enabled = False
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert metrics.UPSTREAM_REQUESTS.value("top", 200) == 7
+    assert metrics.REQUEST_DURATION.count(
+        f"{V1_BASE_URL}/articles/top", "GET", 200
+    ) == 1
+    assert "pageviews_aggregation_duration_seconds_count" in resp.text
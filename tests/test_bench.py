@@ -0,0 +1,96 @@
+import json
+import threading
+from datetime import date
+
+import pytest
+import requests
+
+from bench.fake_wikimedia import FakeWikimedia, top_articles_payload
+from bench.run import compare, percentile, scenario_params
+from upstream import WikimediaClient
+
+
+@pytest.fixture()
+def fake_wikimedia():
+    server = FakeWikimedia(("127.0.0.1", 0), articles=50)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3], 95) == 3
+    assert percentile([], 50) is None
+
+
+def test_scenario_params_cycle_through_periods():
+    assert scenario_params("/articles/top", "month", 13, 12) == {
+        "year": 2023, "month": 11, "time_period": "month"
+    }
+    assert scenario_params("/articles/total_views", "week", 1, 4) == {
+        "year": 2023, "month": 12, "day": 18,
+        "time_period": "week", "title": "Article_1",
+    }
+    assert scenario_params("/articles/top_day", "week", 1, 4) == {
+        "start_date": "2023-12-18", "end_date": "2023-12-24",
+        "title": "Article_1",
+    }
+
+
+def test_top_articles_payload_is_deterministic():
+    payload = json.loads(top_articles_payload(
+        "en.wikipedia", "all-access", date(2023, 1, 1), 10
+    ))
+    articles = payload["items"][0]["articles"]
+
+    assert len(articles) == 10
+    assert [article["rank"] for article in articles] == list(range(1, 11))
+    assert payload == json.loads(top_articles_payload.__wrapped__(
+        "en.wikipedia", "all-access", date(2023, 1, 1), 10
+    ))
+
+
+def test_fake_wikimedia_serves_the_client(fake_wikimedia):
+    base_url = f"http://127.0.0.1:{fake_wikimedia.server_port}"
+    client = WikimediaClient(base_url=base_url)
+
+    top_articles = client.top_articles(date(2023, 1, 1))
+    items = client.per_article(
+        "Article_1", date(2023, 1, 1), date(2023, 1, 3)
+    )
+
+    assert len(top_articles.titles) == 50
+    assert len(items) == 3
+    assert requests.get(f"{base_url}/_stats").json()["calls"] == 2
+
+
+def test_fake_wikimedia_injects_errors(fake_wikimedia):
+    base_url = f"http://127.0.0.1:{fake_wikimedia.server_port}"
+    client = WikimediaClient(base_url=base_url)
+
+    fake_wikimedia.not_found_rate = 1
+    assert client.top_articles(date(2023, 1, 1)) is None
+
+    fake_wikimedia.not_found_rate = 0
+    fake_wikimedia.rate_limit_rate = 1
+    resp = requests.get(f"{base_url}/metrics/pageviews/top/x/y/2023/01/01")
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == "1"
+
+
+def test_compare_reports_relative_changes():
+    baseline = {"scenarios": {"top-week": {"p50_ms": 10, "p95_ms": 20}}}
+    results = {"scenarios": {
+        "top-week": {"p50_ms": 15, "p95_ms": 10},
+        "top-month": {"p50_ms": 5},
+    }}
+
+    assert compare(results, baseline) == {
+        "top-week": {"p50_ms": 0.5, "p95_ms": -0.5}
+    }
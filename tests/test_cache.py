@@ -0,0 +1,278 @@
+import os
+import socket
+import socketserver
+import threading
+from datetime import date
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from cache import (
+    DailyCache,
+    decode_entry,
+    encode_entry,
+    FileBackend,
+    MISSING,
+    RedisBackend,
+)
+from store import as_snapshot, TitleTable
+
+
+PAST_KEY = ("en.wikipedia", "all-access", None, None, date(2015, 10, 10))
+TODAY_KEY = ("en.wikipedia", "all-access", None, None, date(2023, 6, 1))
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Answers the few Redis commands RedisBackend sends."""
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            command = args[0].upper()
+            if command == b"GET":
+                value = data.get(args[1])
+                self.wfile.write(
+                    b"$-1\r\n" if value is None
+                    else b"$%d\r\n%s\r\n" % (len(value), value)
+                )
+            elif command == b"SET":
+                data[args[1]] = args[2]
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"DEL":
+                removed = sum(data.pop(key, None) is not None
+                              for key in args[1:])
+                self.wfile.write(b":%d\r\n" % removed)
+            elif command == b"SCAN":
+                prefix = args[3].rstrip(b"*")
+                keys = [key for key in data if key.startswith(prefix)]
+                self.wfile.write(b"*2\r\n$1\r\n0\r\n*%d\r\n" % len(keys))
+                for key in keys:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(key), key))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture()
+def redis_url():
+    server = socketserver.ThreadingTCPServer(
+        ("127.0.0.1", 0), FakeRedisHandler
+    )
+    server.daemon_threads = True
+    server.data = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"redis://127.0.0.1:{server.server_address[1]}/0"
+    server.shutdown()
+    server.server_close()
+
+
+def test_cache_get_missing():
+    cache = DailyCache()
+
+    assert cache.get(PAST_KEY) is MISSING
+
+
+def test_cache_evicts_least_recently_used():
+    cache = DailyCache(max_size=4)
+    first_key = PAST_KEY[:-1] + (date(2015, 10, 1),)
+    second_key = PAST_KEY[:-1] + (date(2015, 10, 2),)
+    cache.set(first_key, [1, 2])
+    cache.set(second_key, [3, 4])
+    cache.get(first_key)
+    cache.set(PAST_KEY, [5])
+
+    assert cache.get(first_key) == [1, 2]
+    assert cache.get(second_key) is MISSING
+    assert cache.get(PAST_KEY) == [5]
+
+
+@patch("cache.utc_today", return_value=date(2023, 6, 1))
+def test_cache_elapsed_days_never_expire(mock_today):
+    cache = DailyCache(recent_ttl=0)
+    cache.set(PAST_KEY, [1])
+
+    assert cache.get(PAST_KEY) == [1]
+
+
+@patch("cache.utc_today", return_value=date(2023, 6, 1))
+def test_cache_recent_days_expire(mock_today):
+    cache = DailyCache(recent_ttl=0)
+    cache.set(TODAY_KEY, [1])
+
+    assert cache.get(TODAY_KEY) is MISSING
+
+
+@patch("cache.utc_today", return_value=date(2023, 6, 1))
+def test_cache_missing_data_expires(mock_today):
+    cache = DailyCache(recent_ttl=0)
+    cache.set(PAST_KEY, None)
+
+    assert cache.get(PAST_KEY) is MISSING
+
+
+@patch("cache.utc_today", return_value=date(2023, 6, 1))
+def test_cache_lookup_returns_stale_entries(mock_today):
+    cache = DailyCache(recent_ttl=-10, stale_if_error=60)
+    cache.set(TODAY_KEY, [1])
+
+    value, staleness = cache.lookup(TODAY_KEY)
+
+    assert value == [1]
+    assert 10 <= staleness < 11
+    assert cache.get(TODAY_KEY) is MISSING
+
+
+@patch("cache.utc_today", return_value=date(2023, 6, 1))
+def test_cache_lookup_drops_entries_past_max_staleness(mock_today):
+    cache = DailyCache(recent_ttl=-10, stale_while_revalidate=5)
+    cache.set(TODAY_KEY, [1])
+
+    assert cache.lookup(TODAY_KEY) == (MISSING, None)
+
+
+def test_cache_disk_tier_survives_restart(tmp_path):
+    DailyCache(directory=tmp_path).set(PAST_KEY, [{"article": "Main_Page"}])
+
+    cache = DailyCache(directory=tmp_path)
+    assert cache.get(PAST_KEY) == [{"article": "Main_Page"}]
+
+    cache.clear()
+    assert DailyCache(directory=tmp_path).get(PAST_KEY) is MISSING
+
+
+def test_encode_entry_round_trips():
+    titles = TitleTable()
+    snapshot = as_snapshot(titles.ids_for(["Main_Page", "Python"]), [5, 3])
+
+    assert decode_entry(encode_entry([1], 10.5, None)) == ([1], 10.5, None)
+
+    value, expires_at, drop_at = decode_entry(
+        encode_entry(snapshot, None, 20.0)
+    )
+    assert value.tolist() == snapshot.tolist()
+    assert (expires_at, drop_at) == (None, 20.0)
+
+    # Portable snapshots are read back with another process's title IDs.
+    other_titles = TitleTable()
+    other_titles.ids_for(["Python"])
+    value, _, _ = decode_entry(
+        encode_entry(snapshot, None, None, titles), other_titles
+    )
+    assert [other_titles.title(i) for i in value["id"]] == [
+        "Main_Page", "Python"
+    ]
+    assert value["views"].tolist() == [5, 3]
+
+
+@patch("cache.utc_today", return_value=date(2023, 6, 1))
+def test_file_backend_shared_between_caches(mock_today, tmp_path):
+    snapshot = as_snapshot(np.array([0, 1]), [5, 3])
+    worker = DailyCache(backend=FileBackend(tmp_path))
+    other_worker = DailyCache(backend=FileBackend(tmp_path))
+    worker.set(PAST_KEY, snapshot)
+    worker.set(TODAY_KEY, [1])
+
+    cached = other_worker.get(PAST_KEY)
+    assert cached.tolist() == snapshot.tolist()
+    assert not cached.flags.writeable
+    assert other_worker.get(TODAY_KEY) == [1]
+
+    other_worker.clear()
+    assert worker.get(PAST_KEY) is MISSING
+
+
+@patch("cache.utc_today", return_value=date(2023, 6, 1))
+def test_file_backend_titles_interned_by_other_worker(mock_today, tmp_path):
+    titles = TitleTable(tmp_path / "titles.txt")
+    other_titles = TitleTable(tmp_path / "titles.txt")
+    DailyCache(backend=FileBackend(tmp_path)).set(
+        PAST_KEY, as_snapshot(titles.ids_for(["Main_Page", "Python"]), [5, 3])
+    )
+
+    cached = DailyCache(backend=FileBackend(tmp_path)).get(PAST_KEY)
+
+    assert [other_titles.title(title_id) for title_id in cached["id"]] == [
+        "Main_Page", "Python"
+    ]
+
+
+@patch("cache.utc_today", return_value=date(2023, 6, 1))
+def test_file_backend_sweeps_dropped_entries(mock_today, tmp_path):
+    backend = FileBackend(tmp_path)
+    cache = DailyCache(recent_ttl=-10, stale_if_error=5, backend=backend)
+    cache.set(TODAY_KEY, [1])
+    cache.set(PAST_KEY, [2])
+
+    backend.sweep()
+
+    assert len(list(tmp_path.glob("*.entry"))) == 1
+    assert cache.get(PAST_KEY) == [2]
+
+
+@patch("cache.utc_today", return_value=date(2023, 6, 1))
+def test_file_backend_evicts_least_recently_used(mock_today, tmp_path):
+    keys = [PAST_KEY[:-1] + (date(2015, 10, day),) for day in (10, 11, 12)]
+    DailyCache(backend=FileBackend(tmp_path)).set(keys[0], [1])
+    entry_size = next(tmp_path.glob("*.entry")).stat().st_size
+    backend = FileBackend(tmp_path, max_bytes=entry_size * 2.5)
+    cache = DailyCache(backend=backend)
+    cache.set(keys[1], [2])
+    for path in tmp_path.glob("*.entry"):
+        os.utime(path, (1, 1))
+
+    assert cache.get(keys[0]) == [1]
+    cache.set(keys[2], [3])
+
+    assert len(list(tmp_path.glob("*.entry"))) == 2
+    assert cache.get(keys[0]) == [1]
+    assert cache.get(keys[1]) is MISSING
+    assert cache.get(keys[2]) == [3]
+
+
+@patch("cache.utc_today", return_value=date(2023, 6, 1))
+def test_redis_backend_shared_between_caches(mock_today, redis_url):
+    titles = TitleTable()
+    snapshot = as_snapshot(titles.ids_for(["Main_Page"]), [5])
+    DailyCache(backend=RedisBackend(redis_url, titles)).set(
+        PAST_KEY, snapshot
+    )
+
+    other_titles = TitleTable()
+    other_titles.ids_for(["Python"])
+    cache = DailyCache(
+        recent_ttl=-10,
+        stale_while_revalidate=60,
+        backend=RedisBackend(redis_url, other_titles),
+    )
+    cached = cache.get(PAST_KEY)
+    assert other_titles.title(cached["id"][0]) == "Main_Page"
+    assert cached["views"].tolist() == [5]
+
+    cache.set(TODAY_KEY, [1])
+    value, staleness = cache.lookup(TODAY_KEY)
+    assert value == [1]
+    assert staleness >= 10
+
+    cache.clear()
+    assert cache.get(PAST_KEY) is MISSING
+
+
+def test_redis_backend_unreachable_is_a_miss():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    cache = DailyCache(
+        backend=RedisBackend(f"redis://127.0.0.1:{port}/0", TitleTable())
+    )
+
+    cache.set(PAST_KEY, [1])
+
+    assert cache.get(PAST_KEY) is MISSING
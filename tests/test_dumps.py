@@ -0,0 +1,153 @@
+import bz2
+import gzip
+from datetime import date
+from unittest.mock import Mock
+
+import pytest
+
+from app import app
+from cache import DailyCache
+from dumps import DumpStore, hourly_project, parse_dump_name
+from pageviews import PageviewsService
+
+
+DAILY_LINES = [
+    "en.wikipedia Main_Page 15580374 desktop 100 A40B60",
+    "en.wikipedia Main_Page 15580374 mobile-web 50 C50",
+    "en.wikipedia Python 23862 desktop 70 A70",
+    "de.wikipedia Python 1 desktop 5 A5",
+    "en.wikipedia Broken null desktop not-a-number A1",
+]
+
+
+def write_dump(path, lines):
+    opener = bz2.open if str(path).endswith(".bz2") else gzip.open
+    with opener(path, "wt") as f:
+        f.write("".join(f"{line}\n" for line in lines))
+    return str(path)
+
+
+@pytest.fixture()
+def dumps(tmp_path):
+    return DumpStore(str(tmp_path / "dumps.db"))
+
+
+def test_parse_dump_name():
+    assert parse_dump_name("/x/pageviews-20230101-user.bz2") == (
+        date(2023, 1, 1), None, "user"
+    )
+    assert parse_dump_name("pageviews-20230101-130000.gz") == (
+        date(2023, 1, 1), 13, "user"
+    )
+    with pytest.raises(ValueError):
+        parse_dump_name("pagecounts-20230101.gz")
+
+
+def test_hourly_project():
+    assert hourly_project("en") == ("en.wikipedia", "desktop")
+    assert hourly_project("en.m") == ("en.wikipedia", "mobile-web")
+    assert hourly_project("de.m.b") == ("de.wikibooks", "mobile-web")
+    assert hourly_project("commons.m") == ("commons.wikimedia", "mobile-web")
+    assert hourly_project("en.unknown") is None
+
+
+def test_ingest_daily_dump(dumps, tmp_path):
+    path = write_dump(tmp_path / "pageviews-20230101-user.bz2", DAILY_LINES)
+
+    assert dumps.ingest([path], batch_size=2) == [
+        "pageviews-20230101-user.bz2"
+    ]
+    assert dumps.ingest([path]) == []
+
+    day = date(2023, 1, 1)
+    top = dumps.top_articles(day, "en.wikipedia", "all-access")
+    assert top.titles == ["Main_Page", "Python"]
+    assert top.views == [150, 70]
+    assert dumps.top_articles(day, "en.wikipedia", "mobile-web").views == [50]
+    assert dumps.top_articles(date(2023, 1, 2), "en.wikipedia",
+                              "all-access") is None
+
+    assert dumps.daily_views(
+        "Main_Page", [day, date(2023, 1, 2)], "en.wikipedia", "desktop",
+        "user"
+    ) == {day: 100}
+    assert dumps.daily_views(
+        "Coronavirus", [day], "en.wikipedia", "all-access", "user"
+    ) == {day: 0}
+    # Spider and automated traffic were not ingested.
+    assert dumps.daily_views(
+        "Main_Page", [day], "en.wikipedia", "all-access", "all-agents"
+    ) == {}
+
+
+def test_ingest_hourly_dumps_cover_whole_days(dumps, tmp_path):
+    paths = [
+        write_dump(tmp_path / f"pageviews-20230101-{hour:02}0000.gz",
+                   ["en Main_Page 2 0", "en.m Main_Page 1 0", "xx.zz A 1 0"])
+        for hour in range(24)
+    ]
+    day = date(2023, 1, 1)
+
+    dumps.ingest(paths[:23])
+    assert not dumps.is_covered(day, "en.wikipedia", "user")
+
+    dumps.ingest(paths[23:])
+    assert dumps.is_covered(day, "en.wikipedia", "user")
+    assert dumps.top_articles(day, "en.wikipedia", "all-access").views == [72]
+
+
+def test_ingest_skips_hourly_dumps_of_day_ingested_daily(dumps, tmp_path):
+    daily = write_dump(tmp_path / "pageviews-20230101-user.bz2", DAILY_LINES)
+    hourly = [
+        write_dump(tmp_path / f"pageviews-20230101-{hour:02}0000.gz",
+                   ["en Main_Page 5 0"])
+        for hour in range(24)
+    ]
+
+    dumps.ingest([daily])
+    assert dumps.ingest(hourly) == []
+
+    assert dumps.daily_views(
+        "Main_Page", [date(2023, 1, 1)], "en.wikipedia", "desktop", "user"
+    ) == {date(2023, 1, 1): 100}
+
+def test_ingest_restricted_to_projects(dumps, tmp_path):
+    path = write_dump(tmp_path / "pageviews-20230101-user.bz2", DAILY_LINES)
+
+    dumps.ingest([path], projects={"de.wikipedia"})
+
+    assert dumps.is_covered(date(2023, 1, 1), "de.wikipedia", "user")
+    assert not dumps.is_covered(date(2023, 1, 1), "en.wikipedia", "user")
+
+
+def test_service_reads_covered_days_from_dumps(dumps, tmp_path):
+    dumps.ingest([
+        write_dump(tmp_path / "pageviews-20230101-user.bz2", DAILY_LINES)
+    ])
+    client = Mock()
+    client.per_article.return_value = [
+        {"timestamp": "2023010200", "views": 7},
+    ]
+    service = PageviewsService(client, DailyCache(), DailyCache(),
+                               dumps=dumps)
+
+    daily_views = service.daily_views(
+        "Python", date(2023, 1, 1), date(2023, 1, 2), agent="user"
+    )
+    snapshot = service.top_articles(date(2023, 1, 1))
+
+    assert daily_views == [(date(2023, 1, 1), 70), (date(2023, 1, 2), 7)]
+    assert client.per_article.call_args.args[1:3] == (
+        date(2023, 1, 2), date(2023, 1, 2)
+    )
+    assert service.titles.title(snapshot["id"][0]) == "Main_Page"
+    client.top_articles.assert_not_called()
+
+
+def test_ingest_command_requires_database(tmp_path):
+    path = write_dump(tmp_path / "pageviews-20230101-user.bz2", DAILY_LINES)
+
+    result = app.test_cli_runner().invoke(args=["ingest", path])
+
+    assert result.exit_code != 0
+    assert "DUMPS_DB" in result.output
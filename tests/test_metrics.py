@@ -0,0 +1,114 @@
+from unittest.mock import patch
+
+import pytest
+from requests import Response
+
+import metrics
+from app import app, V1_BASE_URL
+from metrics import Counter, Histogram, Registry
+
+
+WIKIMEDIA_RESPONSE = {
+    "items": [
+        {
+            "project": "en.wikipedia",
+            "article": "Carlos_Hathcock",
+            "granularity": "daily",
+            "timestamp": "2015101000",
+            "access": "all-access",
+            "agent": "all-agents",
+            "views": 291926
+        },
+    ]
+}
+
+
+app.config.update({
+        "TESTING": True,
+    })
+
+
+@pytest.fixture()
+def client():
+    return app.test_client()
+
+
+@pytest.fixture()
+def enabled_metrics():
+    metrics.REGISTRY.clear()
+    metrics.REGISTRY.enabled = True
+    yield metrics.REGISTRY
+    metrics.REGISTRY.enabled = False
+    metrics.REGISTRY.clear()
+
+
+def test_disabled_registry_records_nothing():
+    registry = Registry()
+    counter = Counter(registry, "calls_total", "Calls.", ["kind"])
+    histogram = Histogram(registry, "duration_seconds", "Durations.")
+
+    counter.inc("a")
+    histogram.observe(0.1)
+    with histogram.time():
+        pass
+
+    assert counter.value("a") == 0
+    assert histogram.count() == 0
+
+
+def test_render_prometheus_text():
+    registry = Registry(enabled=True)
+    counter = Counter(registry, "calls_total", "Calls.", ["kind"])
+    histogram = Histogram(
+        registry, "duration_seconds", "Durations.", ["route"],
+        buckets=(0.1, 1),
+    )
+
+    counter.inc('say "hi"', amount=2)
+    histogram.observe(0.05, "/top")
+    histogram.observe(0.5, "/top")
+    histogram.observe(5, "/top")
+
+    assert registry.render().splitlines() == [
+        "# HELP calls_total Calls.",
+        "# TYPE calls_total counter",
+        'calls_total{kind="say \\"hi\\""} 2',
+        "# HELP duration_seconds Durations.",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{route="/top",le="0.1"} 1',
+        'duration_seconds_bucket{route="/top",le="1"} 2',
+        'duration_seconds_bucket{route="/top",le="+Inf"} 3',
+        'duration_seconds_sum{route="/top"} 5.55',
+        'duration_seconds_count{route="/top"} 3',
+    ]
+
+
+def test_metrics_endpoint_disabled(client):
+    assert client.get("/metrics").status_code == 404
+
+
+@patch("upstream.requests.Session.get")
+def test_metrics_endpoint(mock_request, client, enabled_metrics):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_RESPONSE
+    response_with_json.status_code = 200
+    mock_request.return_value = response_with_json
+
+    params = {
+        "start_date": "2015-10-10",
+        "end_date": "2015-10-10",
+        "title": "Carlos_Hathcock",
+    }
+    client.get(f"{V1_BASE_URL}/articles/series", query_string=params)
+    client.get(f"{V1_BASE_URL}/articles/series", query_string=params)
+    resp = client.get("/metrics")
+
+    assert resp.status_code == 200
+    assert resp.content_type.startswith("text/plain; version=0.0.4")
+    assert metrics.UPSTREAM_REQUESTS.value("per-article", 200) == 1
+    assert metrics.PARSE_DURATION.count("per-article") == 1
+    assert metrics.CACHE_REQUESTS.value("daily", "hit") == 1
+    assert metrics.REQUEST_DURATION.count(
+        f"{V1_BASE_URL}/articles/series", "GET", 200
+    ) == 2
+    assert "pageviews_upstream_in_flight 0" in resp.text
@@ -0,0 +1,264 @@
+import asyncio
+import threading
+from datetime import date
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+import requests
+
+from cache import DailyCache, FileBackend, utc_today
+from pageviews import (
+    AsyncPageviewsService,
+    Freshness,
+    PageviewsService,
+    response_freshness,
+    split_range,
+)
+from store import TopArticlesStore
+from upstream import TopArticles
+
+
+def test_top_articles_cached():
+    client = Mock()
+    client.top_articles.return_value = TopArticles(["Main_Page"], [1])
+    service = PageviewsService(client, DailyCache(), DailyCache())
+
+    service.top_articles(date(2015, 10, 10))
+    snapshot = service.top_articles(date(2015, 10, 10))
+
+    assert service.titles.title(snapshot["id"][0]) == "Main_Page"
+    assert snapshot["views"][0] == 1
+    assert client.top_articles.call_count == 1
+
+
+def test_top_articles_persisted_in_store(tmp_path):
+    client = Mock()
+    client.top_articles.return_value = TopArticles(["Main_Page"], [1])
+    PageviewsService(
+        client, DailyCache(), DailyCache(), TopArticlesStore(tmp_path)
+    ).top_articles(date(2015, 10, 10))
+
+    service = PageviewsService(
+        client, DailyCache(), DailyCache(), TopArticlesStore(tmp_path)
+    )
+    snapshot = service.top_articles(date(2015, 10, 10))
+
+    assert service.titles.title(snapshot["id"][0]) == "Main_Page"
+    assert client.top_articles.call_count == 1
+
+
+def test_split_range():
+    months, days = split_range(date(2020, 1, 30), date(2020, 4, 2))
+
+    assert months == [(2020, 2), (2020, 3)]
+    assert days == [
+        date(2020, 1, 30),
+        date(2020, 1, 31),
+        date(2020, 4, 1),
+        date(2020, 4, 2),
+    ]
+
+
+def test_split_range_within_month():
+    months, days = split_range(date(2020, 2, 1), date(2020, 2, 28))
+
+    assert months == []
+    assert len(days) == 28
+
+
+def test_top_articles_range_reuses_month_aggregates():
+    client = Mock()
+    client.top_articles.return_value = TopArticles(["Main_Page"], [1])
+    service = PageviewsService(client, DailyCache(), DailyCache())
+    service.top_articles_range(date(2020, 2, 1), date(2020, 2, 29))
+    service.cache.clear()
+
+    ids, totals = service.top_articles_range(
+        date(2020, 1, 31), date(2020, 2, 29)
+    )
+
+    assert totals.tolist() == [30]
+    assert client.top_articles.call_count == 29 + 1
+
+
+def test_top_articles_range_skips_incomplete_month_aggregates():
+    client = Mock()
+    client.top_articles.side_effect = lambda day, *args: (
+        None if day.day == 3 else TopArticles(["Main_Page"], [1])
+    )
+    service = PageviewsService(client, DailyCache(), DailyCache())
+
+    ids, totals = service.top_articles_range(
+        date(2020, 2, 1), date(2020, 2, 29)
+    )
+
+    assert totals.tolist() == [28]
+    assert len(service.month_cache.backend._entries) == 0
+
+
+def test_daily_views_fills_days_without_data():
+    client = Mock()
+    client.per_article.return_value = [
+        {"timestamp": "2015101000", "views": 10},
+        {"timestamp": "2015101200", "views": 12},
+    ]
+    service = PageviewsService(client, DailyCache(), DailyCache())
+
+    daily_views = service.daily_views(
+        "Main_Page", date(2015, 10, 10), date(2015, 10, 12)
+    )
+
+    assert daily_views == [
+        (date(2015, 10, 10), 10),
+        (date(2015, 10, 11), None),
+        (date(2015, 10, 12), 12),
+    ]
+
+
+def test_daily_views_sums_projects():
+    client = Mock()
+    client.per_article.side_effect = lambda title, start, end, project, *_: (
+        [{"timestamp": "2015101000", "views": 10}]
+        if project == "en.wikipedia"
+        else [{"timestamp": "2015101000", "views": 1},
+              {"timestamp": "2015101100", "views": 2}]
+    )
+    service = PageviewsService(client, DailyCache(), DailyCache())
+
+    daily_views = service.daily_views(
+        "Main_Page", date(2015, 10, 10), date(2015, 10, 12),
+        project=["en.wikipedia", "simple.wikipedia"],
+    )
+
+    assert daily_views == [
+        (date(2015, 10, 10), 11),
+        (date(2015, 10, 11), 2),
+        (date(2015, 10, 12), None),
+    ]
+    assert client.per_article.call_count == 2
+
+
+def test_daily_views_only_fetches_uncached_days():
+    client = Mock()
+    client.per_article.return_value = [
+        {"timestamp": "2015100100", "views": 1},
+        {"timestamp": "2015100200", "views": 2},
+    ]
+    service = PageviewsService(client, DailyCache(), DailyCache())
+    service.daily_views("Main_Page", date(2015, 10, 1), date(2015, 10, 2))
+
+    client.per_article.return_value = [
+        {"timestamp": "2015100300", "views": 3},
+    ]
+    daily_views = service.daily_views(
+        "Main_Page", date(2015, 10, 1), date(2015, 10, 3)
+    )
+
+    assert [views for _, views in daily_views] == [1, 2, 3]
+    assert client.per_article.call_args.args[1:3] == (
+        date(2015, 10, 3), date(2015, 10, 3)
+    )
+
+
+def test_indexed_series_answers_overlapping_ranges_from_index():
+    client = Mock()
+    client.per_article.return_value = [
+        {"timestamp": f"201510{day:02}00", "views": day} for day in (1, 2, 3)
+    ]
+    cache = Mock(wraps=DailyCache())
+    service = PageviewsService(client, cache, DailyCache())
+    service.indexed_series("Main_Page", date(2015, 10, 1), date(2015, 10, 3))
+    client.per_article.reset_mock()
+    cache.reset_mock()
+
+    window = service.indexed_series(
+        "Main_Page", date(2015, 10, 2), date(2015, 10, 3)
+    )
+
+    assert window.total() == 5
+    assert window.top_day() == (date(2015, 10, 3), 3)
+    client.per_article.assert_not_called()
+    assert not cache.method_calls
+
+
+def stale_service(client, **cache_settings):
+    """A service whose cached entries for today expired 10 seconds ago."""
+    cache = DailyCache(recent_ttl=-10, **cache_settings)
+    return PageviewsService(client, cache, DailyCache())
+
+
+@pytest.fixture()
+def freshness():
+    freshness = Freshness()
+    token = response_freshness.set(freshness)
+    yield freshness
+    response_freshness.reset(token)
+
+
+def test_daily_views_stale_while_revalidate(freshness):
+    today = utc_today()
+    client = Mock()
+    client.per_article.return_value = [
+        {"timestamp": today.strftime("%Y%m%d00"), "views": 1},
+    ]
+    service = stale_service(client, stale_while_revalidate=60)
+    service.daily_views("Main_Page", today, today)
+
+    client.per_article.return_value = [
+        {"timestamp": today.strftime("%Y%m%d00"), "views": 2},
+    ]
+    daily_views = service.daily_views("Main_Page", today, today)
+    service._refresher.shutdown(wait=True)
+
+    assert daily_views == [(today, 1)]
+    assert freshness.state == "stale-while-revalidate"
+    assert freshness.staleness >= 10
+    assert client.per_article.call_count == 2
+
+
+def test_top_articles_stale_if_error(freshness):
+    today = utc_today()
+    client = Mock()
+    client.top_articles.return_value = TopArticles(["Main_Page"], [1])
+    service = stale_service(client, stale_if_error=60)
+    service.top_articles(today)
+
+    client.top_articles.side_effect = requests.ConnectionError()
+    snapshot = service.top_articles(today)
+
+    assert service.titles.title(snapshot["id"][0]) == "Main_Page"
+    assert freshness.state == "stale-if-error"
+    assert client.top_articles.call_count == 2
+
+
+def test_daily_views_not_cached_are_not_served_stale():
+    client = Mock()
+    client.per_article.side_effect = requests.ConnectionError()
+    service = stale_service(client, stale_if_error=60)
+
+    with pytest.raises(requests.ConnectionError):
+        service.daily_views("Main_Page", utc_today(), utc_today())
+
+
+def test_async_service_reads_shared_cache_off_the_event_loop(tmp_path):
+    client = Mock()
+    client.top_articles = AsyncMock(
+        return_value=TopArticles(["Main_Page"], [1])
+    )
+    backend = FileBackend(tmp_path)
+    get = backend.get
+    threads = []
+
+    def recording_get(key):
+        threads.append(threading.current_thread())
+        return get(key)
+
+    backend.get = recording_get
+    service = AsyncPageviewsService(
+        client, DailyCache(backend=backend), DailyCache()
+    )
+
+    snapshot = asyncio.run(service.top_articles(date(2015, 10, 10)))
+
+    assert service.titles.title(snapshot["id"][0]) == "Main_Page"
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,72 @@
+from datetime import date
+
+import pytest
+
+from series import DailySeries, SeriesIndex
+
+
+DAILY_VIEWS = [
+    (date(2015, 10, 10), 10),
+    (date(2015, 10, 11), None),
+    (date(2015, 10, 12), 30),
+    (date(2015, 10, 13), 30),
+]
+
+
+def test_series_statistics():
+    series = DailySeries.from_daily_views(DAILY_VIEWS)
+
+    # 2015-10-11 has no data, and is left out of the mean and percentiles.
+    assert series.total() == 70
+    assert series.mean() == pytest.approx(70 / 3)
+    assert series.top_day() == (date(2015, 10, 12), 30)
+    assert series.percentiles([0, 50, 100]) == [10.0, 30.0, 30.0]
+
+
+def test_series_days():
+    series = DailySeries.from_daily_views(DAILY_VIEWS)
+
+    assert series.days() == DAILY_VIEWS
+
+
+def test_series_without_views():
+    series = DailySeries.from_daily_views([(date(2015, 10, 10), None)])
+
+    assert series.total() == 0
+    assert series.mean() is None
+    assert series.percentiles([50]) is None
+    assert series.top_day() == (None, 0)
+
+
+def test_index_answers_any_range():
+    series = DailySeries.from_daily_views(
+        [(date(2015, 10, day), views) for day, views in
+         zip(range(1, 11), [5, 1, 9, 9, 0, 2, 7, 9, 3, 4])]
+    )
+    index = SeriesIndex(series)
+
+    for first in range(10):
+        for last in range(first, 10):
+            window = index.window(date(2015, 10, first + 1),
+                                  date(2015, 10, last + 1))
+            expected = DailySeries(
+                series.day(first), series.views[first:last + 1],
+                series.has_data[first:last + 1],
+            )
+            assert window.total() == expected.total()
+            assert window.top_day() == expected.top_day()
+    assert index.covers(date(2015, 10, 2), date(2015, 10, 10))
+    assert not index.covers(date(2015, 10, 2), date(2015, 10, 11))
+
+
+def test_series_union():
+    series = DailySeries.from_daily_views(DAILY_VIEWS)
+    later = DailySeries.from_daily_views([
+        (date(2015, 10, 13), 40), (date(2015, 10, 14), 50)
+    ])
+    apart = DailySeries.from_daily_views([(date(2015, 10, 20), 1)])
+
+    assert series.union(later).days() == DAILY_VIEWS[:3] + [
+        (date(2015, 10, 13), 40), (date(2015, 10, 14), 50)
+    ]
+    assert series.union(apart) is None
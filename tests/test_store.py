@@ -0,0 +1,103 @@
+from datetime import date
+
+import numpy as np
+
+from store import (
+    aggregate,
+    as_snapshot,
+    rank,
+    TitleTable,
+    TopArticlesStore,
+    to_snapshot,
+)
+from upstream import TopArticles
+
+
+ARTICLES = TopArticles(["Main_Page", "Special:Search"], [100, 50])
+
+
+def test_title_table_interns_titles():
+    titles = TitleTable()
+
+    ids = titles.ids_for(["Main_Page", "Coronavirus", "Main_Page"])
+
+    assert ids.tolist() == [0, 1, 0]
+    assert titles.title(1) == "Coronavirus"
+    assert len(titles) == 2
+
+
+def test_title_table_shared_through_file(tmp_path):
+    path = tmp_path / "titles.txt"
+    first = TitleTable(path)
+    second = TitleTable(path)
+
+    first.ids_for(["Main_Page"])
+    second.ids_for(["Coronavirus"])
+    first.ids_for(["Special:Search"])
+
+    assert second.ids_for(["Special:Search"]).tolist() == [2]
+    assert TitleTable(path).title(1) == "Coronavirus"
+
+
+def test_aggregate_sums_views_per_title():
+    titles = TitleTable()
+    first_day = to_snapshot(ARTICLES, titles)
+    second_day = to_snapshot(
+        TopArticles(
+            ["Coronavirus"] + ARTICLES.titles, [10] + ARTICLES.views
+        ),
+        titles,
+    )
+
+    ids, totals = aggregate([first_day, second_day])
+
+    assert dict(zip(ids.tolist(), totals.tolist())) == {0: 200, 1: 100, 2: 10}
+
+
+def test_aggregate_skips_ids_not_in_snapshots():
+    first_day = as_snapshot([7, 2], [1, 2])
+    second_day = as_snapshot([2, 9], [3, 0])
+
+    ids, totals = aggregate([first_day, second_day])
+
+    assert ids.tolist() == [2, 7, 9]
+    assert totals.tolist() == [5, 1, 0]
+
+
+def test_aggregate_sparse_ids():
+    ids, totals = aggregate([as_snapshot([2_000_000_000, 3], [4, 5])])
+
+    assert ids.tolist() == [3, 2_000_000_000]
+    assert totals.tolist() == [5, 4]
+
+
+def test_aggregate_no_snapshots():
+    ids, totals = aggregate([])
+
+    assert len(ids) == 0
+    assert len(totals) == 0
+
+
+def test_rank_all():
+    totals = np.array([5, 20, 5, 30])
+
+    assert rank(totals).tolist() == [3, 1, 0, 2]
+
+
+def test_rank_top_n():
+    totals = np.array([5, 20, 5, 30, 1, 5])
+
+    assert rank(totals, 2).tolist() == [3, 1]
+    assert rank(totals, 4).tolist() == [3, 1, 0, 2]
+    assert rank(totals, 0).tolist() == []
+
+
+def test_store_round_trip(tmp_path):
+    store = TopArticlesStore(tmp_path)
+    snapshot = to_snapshot(ARTICLES, store.titles)
+
+    store.put(date(2015, 10, 10), snapshot, "en.wikipedia", "all-access")
+    loaded = store.get(date(2015, 10, 10), "en.wikipedia", "all-access")
+
+    assert loaded.tolist() == snapshot.tolist()
+    assert store.get(date(2015, 10, 11), "en.wikipedia", "all-access") is None
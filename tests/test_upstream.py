@@ -0,0 +1,333 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from unittest.mock import patch
+
+import httpx
+import pytest
+import requests
+from requests import Response
+from werkzeug.exceptions import GatewayTimeout
+
+from upstream import (
+    AsyncSingleFlight,
+    AsyncWikimediaClient,
+    deadline,
+    parse_retry_after,
+    SingleFlight,
+    TokenBucket,
+    TopArticles,
+    TopArticlesParser,
+    UpstreamScheduler,
+    WikimediaClient,
+)
+
+
+WIKIMEDIA_EMPTY_RESPONSE = {
+    "detail": "The date(s) you used are valid, but..."
+}
+WIKIMEDIA_TOP_RESPONSE = {
+    "items": [
+        {
+            "project": "en.wikipedia",
+            "access": "all-access",
+            "year": "2015",
+            "month": "10",
+            "day": "10",
+            "articles": [
+                {"article": "Main_Page", "views": 18793503, "rank": 1},
+                {"article": "Zoë_Saldaña", "views": 2629537, "rank": 2},
+                {"article": "Carlos_Hathcock", "views": 291358, "rank": 3},
+            ]
+        }
+    ]
+}
+
+
+def wikimedia_response(payload, status_code=200):
+    """A response whose body can be streamed again on every request."""
+    response = Response()
+    response.status_code = status_code
+    response._content = json.dumps(payload).encode()
+    response._content_consumed = True
+    return response
+
+
+def test_client_pools_connections_per_host():
+    client = WikimediaClient(pool_connections=4, pool_maxsize=16)
+    adapter = client.session.get_adapter("https://wikimedia.org")
+
+    assert adapter._pool_connections == 4
+    assert adapter._pool_maxsize == 16
+    assert adapter._pool_block is True
+    assert client.session.headers["Connection"] == "keep-alive"
+
+
+@patch("upstream.requests.Session.get")
+def test_client_passes_timeouts(mock_request):
+    client = WikimediaClient(
+        base_url="http://localhost",
+        connect_timeout=1,
+        read_timeout=2,
+    )
+    client.get("/some/path")
+
+    mock_request.assert_called_once_with(
+        "http://localhost/some/path",
+        timeout=(1, 2),
+    )
+
+
+@patch("upstream.time.sleep")
+@patch("upstream.requests.Session.get")
+def test_client_timeout_raises_gateway_timeout(mock_request, mock_sleep):
+    mock_request.side_effect = requests.ReadTimeout()
+    client = WikimediaClient(scheduler=UpstreamScheduler(max_retries=2))
+
+    with pytest.raises(GatewayTimeout):
+        client.get("/some/path")
+
+    assert mock_request.call_count == 3
+
+
+@patch("upstream.time.sleep")
+@patch("upstream.requests.Session.get")
+def test_client_retries_rate_limited_requests(mock_request, mock_sleep):
+    rate_limited = wikimedia_response({"detail": "Too many requests"}, 429)
+    rate_limited.headers["Retry-After"] = "2"
+    mock_request.side_effect = [
+        rate_limited, wikimedia_response(WIKIMEDIA_TOP_RESPONSE)
+    ]
+    client = WikimediaClient()
+
+    top_articles = client.top_articles(date(2015, 10, 10))
+
+    assert top_articles.titles[0] == "Main_Page"
+    assert mock_request.call_count == 2
+    assert max(call.args[0] for call in mock_sleep.call_args_list) >= 2
+
+
+@patch("upstream.time.sleep")
+@patch("upstream.requests.Session.get")
+def test_client_returns_last_response_once_retries_run_out(mock_request,
+                                                           mock_sleep):
+    mock_request.return_value = wikimedia_response({}, 503)
+    client = WikimediaClient(scheduler=UpstreamScheduler(max_retries=1))
+
+    assert client.get("/some/path").status_code == 503
+    assert mock_request.call_count == 2
+
+
+@patch("upstream.requests.Session.get")
+def test_client_does_not_retry_past_the_deadline(mock_request):
+    rate_limited = wikimedia_response({}, 429)
+    rate_limited.headers["Retry-After"] = "60"
+    mock_request.return_value = rate_limited
+    client = WikimediaClient()
+
+    with deadline(5):
+        assert client.get("/some/path").status_code == 429
+        read_timeout = mock_request.call_args.kwargs["timeout"][1]
+
+    assert mock_request.call_count == 1
+    assert read_timeout <= 5
+
+
+def test_scheduler_gives_up_when_the_deadline_has_passed():
+    scheduler = UpstreamScheduler()
+
+    with deadline(0):
+        with pytest.raises(GatewayTimeout):
+            scheduler.acquire("/some/path")
+
+
+def test_token_bucket_spaces_out_calls():
+    bucket = TokenBucket(rate=10, burst=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve(max_wait=0.1) is None
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket()
+    bucket.pause(5)
+
+    assert bucket.reserve() == pytest.approx(5, abs=0.1)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+
+
+@patch("upstream.requests.Session.get")
+def test_top_articles_no_data(mock_request):
+    response_with_json = Response()
+    response_with_json.json = lambda: WIKIMEDIA_EMPTY_RESPONSE
+    response_with_json.status_code = 404
+    mock_request.return_value = response_with_json
+    client = WikimediaClient()
+
+    assert client.top_articles(date(2015, 10, 10)) is None
+    assert mock_request.call_args.args[0].endswith(
+        "/en.wikipedia/all-access/2015/10/10"
+    )
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait()
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [
+            executor.submit(single_flight.do, "key", fetch) for _ in range(5)
+        ]
+        time.sleep(0.05)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+
+
+def test_single_flight_shares_errors_and_forgets_keys():
+    single_flight = SingleFlight()
+
+    def fail():
+        raise ValueError("upstream failed")
+
+    with pytest.raises(ValueError):
+        single_flight.do("key", fail)
+
+    assert single_flight.do("key", lambda: "retried") == "retried"
+
+
+def test_async_single_flight_coalesces_concurrent_calls():
+    single_flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def fetch_concurrently():
+        return await asyncio.gather(
+            *(single_flight.do("key", fetch) for _ in range(5))
+        )
+
+    assert asyncio.run(fetch_concurrently()) == ["result"] * 5
+    assert len(calls) == 1
+
+
+@patch("upstream.requests.Session.get")
+def test_top_articles_coalesces_identical_requests(mock_request):
+    release = threading.Event()
+    response_with_json = wikimedia_response({"items": [{"articles": []}]})
+
+    def get(url, **kwargs):
+        release.wait()
+        return response_with_json
+
+    mock_request.side_effect = get
+    client = WikimediaClient()
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [
+            executor.submit(client.top_articles, date(2015, 10, 10))
+            for _ in range(3)
+        ]
+        time.sleep(0.05)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == [TopArticles([], [])] * 3
+    assert mock_request.call_count == 1
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_top_articles_parser_handles_any_chunking(chunk_size):
+    body = json.dumps(WIKIMEDIA_TOP_RESPONSE, ensure_ascii=False).encode()
+    parser = TopArticlesParser()
+
+    for start in range(0, len(body), chunk_size):
+        parser.feed(body[start:start + chunk_size])
+
+    assert parser.close() == TopArticles(
+        ["Main_Page", "Zoë_Saldaña", "Carlos_Hathcock"],
+        [18793503, 2629537, 291358],
+    )
+
+
+def test_top_articles_parser_rejects_truncated_payload():
+    body = json.dumps(WIKIMEDIA_TOP_RESPONSE).encode()
+    parser = TopArticlesParser()
+    parser.feed(body[:len(body) // 2])
+
+    with pytest.raises(ValueError):
+        parser.close()
+
+
+@patch("upstream.requests.Session.get")
+def test_top_articles_streams_response(mock_request):
+    mock_request.return_value = wikimedia_response(WIKIMEDIA_TOP_RESPONSE)
+    client = WikimediaClient()
+
+    top_articles = client.top_articles(date(2015, 10, 10))
+
+    assert top_articles.titles[0] == "Main_Page"
+    assert top_articles.views[0] == 18793503
+    assert mock_request.call_args.kwargs["stream"] is True
+
+
+def test_async_top_articles_streams_response():
+    def handler(request):
+        return httpx.Response(200, json=WIKIMEDIA_TOP_RESPONSE)
+
+    async def fetch():
+        client = AsyncWikimediaClient(transport=httpx.MockTransport(handler))
+        try:
+            return await client.top_articles(date(2015, 10, 10))
+        finally:
+            await client.close()
+
+    top_articles = asyncio.run(fetch())
+
+    assert top_articles.titles == [
+        "Main_Page", "Zoë_Saldaña", "Carlos_Hathcock"
+    ]
+
+
+def test_async_client_retries_rate_limited_requests():
+    responses = [
+        httpx.Response(429, json={}, headers={"Retry-After": "0"}),
+        httpx.Response(200, json=WIKIMEDIA_TOP_RESPONSE),
+    ]
+
+    async def fetch():
+        client = AsyncWikimediaClient(
+            transport=httpx.MockTransport(lambda request: responses.pop(0)),
+            scheduler=UpstreamScheduler(backoff_base=0.001),
+        )
+        try:
+            return await client.top_articles(date(2015, 10, 10))
+        finally:
+            await client.close()
+
+    top_articles = asyncio.run(fetch())
+
+    assert top_articles.titles[0] == "Main_Page"
+    assert responses == []
@@ -0,0 +1,111 @@
+import os
+import subprocess
+import sys
+from datetime import date
+from unittest.mock import Mock
+
+from app import app
+from cache import DailyCache
+from pageviews import PageviewsService
+from upstream import TopArticles
+from warmup import months_between, previous_month, Warmer
+
+
+def top_articles(day, *args):
+    return TopArticles(["Main_Page", "Special:Search"], [100, 10])
+
+
+def make_warmer(client, **kwargs):
+    service = PageviewsService(client, DailyCache(), DailyCache())
+    return Warmer(service, **kwargs)
+
+
+def test_months_between():
+    assert months_between((2022, 11), (2023, 2)) == [
+        (2022, 11), (2022, 12), (2023, 1), (2023, 2)
+    ]
+
+
+def test_previous_month():
+    assert previous_month(date(2023, 1, 15)) == (2022, 12)
+
+
+def test_warm_month():
+    client = Mock()
+    client.top_articles.side_effect = top_articles
+    client.per_article.return_value = []
+    warmer = make_warmer(client, top_articles=1)
+
+    assert warmer.warm_month(2015, 10) is True
+    assert warmer.pageviews.month_aggregate(2015, 10) is not None
+    assert client.top_articles.call_count == 31
+    client.per_article.assert_called_once_with(
+        "Main_Page", date(2015, 10, 1), date(2015, 10, 31),
+        "en.wikipedia", "all-access", "all-agents",
+    )
+    assert warmer.status()["warmed_months"] == ["2015-10"]
+
+
+def test_warm_month_incomplete():
+    client = Mock()
+    client.top_articles.side_effect = lambda day, *args: (
+        None if day.day == 31 else top_articles(day)
+    )
+    client.per_article.return_value = []
+    warmer = make_warmer(client)
+
+    assert warmer.warm_month(2015, 10) is False
+    assert warmer.status()["warmed_months"] == []
+
+
+def test_run_once_warms_last_day_and_month():
+    client = Mock()
+    client.top_articles.side_effect = top_articles
+    client.per_article.return_value = []
+    warmer = make_warmer(client)
+
+    warmer.run_once(today=date(2015, 11, 1))
+    warmer.run_once(today=date(2015, 11, 2))
+
+    status = warmer.status()
+    assert status["warmed_months"] == ["2015-10"]
+    assert status["last_warmed_day"] == "2015-11-01"
+    assert status["last_error"] is None
+
+
+def test_run_once_records_errors():
+    client = Mock()
+    client.top_articles.side_effect = RuntimeError("Wikimedia is down")
+    warmer = make_warmer(client)
+
+    warmer.run_once(today=date(2015, 11, 1))
+
+    assert warmer.status()["last_error"] == "Wikimedia is down"
+    assert warmer.status()["last_run_finished"] is not None
+
+
+def test_warmup_status_endpoint():
+    resp = app.test_client().get("/api/v1/warmup")
+
+    assert resp.status_code == 200
+    assert resp.json["running"] is False
+    assert resp.json["project"] == "en.wikipedia"
+
+
+def test_warmup_project_and_access_configured():
+    env = {**os.environ, "FLASK_WARMUP_PROJECT": "de.wikipedia",
+           "FLASK_WARMUP_ACCESS": "desktop"}
+    result = subprocess.run(
+        [sys.executable, "-c",
+         "from app import warmer; print(warmer.project, warmer.access)"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+
+    assert result.stdout.split() == ["de.wikipedia", "desktop"]
+
+
+def test_backfill_command_bad_month():
+    result = app.test_cli_runner().invoke(args=["backfill", "2023/01"])
+
+    assert result.exit_code != 0
+    assert "YYYY-MM" in result.output
@@ -0,0 +1,619 @@
+import asyncio
+import codecs
+import contextvars
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.exceptions import GatewayTimeout
+
+import metrics
+
+
+LOGGER = logging.getLogger("pageviewsApi")
+USER_AGENT_HEADER = {'User-Agent': 'pageviewsAPI/0.0 (ka.cox@outlook.com)'}
+WIKIMEDIA_BASE_URL = "https://wikimedia.org/api/rest_v1"
+WIKIMEDIA_TOP_PATH = "/metrics/pageviews/top"
+WIKIMEDIA_PER_ARTICLE_PATH = "/metrics/pageviews/per-article"
+WIKIMEDIA_ACCESS_PARAM = "all-access"
+WIKIMEDIA_AGENT_PARAM = "all-agents"
+WIKIMEDIA_GRANULARITY_PARAM = "daily"
+WIKIMEDIA_PROJECT_PARAM = "en.wikipedia"
+WIKIMEDIA_TIME_FORMAT = "%Y%m%d"
+STREAM_CHUNK_SIZE = 64 * 1024
+ARTICLES_ARRAY_START = re.compile(r'"articles"\s*:\s*\[')
+
+# Statuses worth retrying a request for: rate limiting and server errors.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# What a failed call to Wikimedia raises, once retries are exhausted.
+UPSTREAM_ERRORS = (requests.RequestException, httpx.HTTPError, GatewayTimeout)
+
+# A day's top articles as two parallel columns.
+TopArticles = namedtuple("TopArticles", ["titles", "views"])
+
+# time.monotonic() value by which the API request being served must be
+# answered, or None when it has no deadline.
+request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+def has_no_data(resp):
+    """
+    Wikimedia answers with a 404 whose detail mentions the dates being
+    "valid" when it simply has no data loaded for the request.
+    """
+    return resp.status_code == 404 and "valid" in resp.json()["detail"]
+
+
+def endpoint_name(path):
+    """Name of the Wikimedia API a path belongs to, e.g. "top"."""
+    parts = path.split("/")
+    return parts[3] if path.startswith("/metrics/pageviews/") else "other"
+
+
+def deadline_after(seconds):
+    """The request_deadline value seconds from now (None for no limit)."""
+    return None if seconds is None else time.monotonic() + seconds
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Give calls to Wikimedia made within the block, including from tasks it
+    starts, seconds to complete (no limit when seconds is None).
+    """
+    token = request_deadline.set(deadline_after(seconds))
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
+
+
+def parse_retry_after(value):
+    """Seconds to wait according to a Retry-After header, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def top_articles_path(day, project, access):
+    return (f"{WIKIMEDIA_TOP_PATH}/{project}/{access}/"
+            + f"{day.strftime('%Y/%m/%d')}")
+
+
+def per_article_path(title, start_date, end_date, project, access, agent):
+    return (f"{WIKIMEDIA_PER_ARTICLE_PATH}/{project}/{access}/{agent}/"
+            + f"{title}/{WIKIMEDIA_GRANULARITY_PARAM}/"
+            + f"{start_date.strftime(WIKIMEDIA_TIME_FORMAT)}/"
+            + f"{end_date.strftime(WIKIMEDIA_TIME_FORMAT)}")
+
+
+class TopArticlesParser:
+    """
+    Incremental parser for a top-articles payload. Chunks of the body are
+    fed as they arrive and only the title and views of each entry of
+    items[0].articles are kept, so the whole document is never
+    materialized.
+
+    The entries completed by each chunk are decoded together in one call.
+    MediaWiki titles cannot contain brackets or braces, so the first "]"
+    after the array starts closes it and the last "}" before that ends the
+    last complete entry.
+    """
+
+    def __init__(self):
+        self.titles = []
+        self.views = []
+        self.done = False
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._in_articles = False
+
+    def feed(self, chunk):
+        if not self.done:
+            self._buffer += self._text.decode(chunk)
+            self._parse()
+
+    def close(self):
+        """Return the parsed TopArticles once the whole body was fed."""
+        if not self.done:
+            self._buffer += self._text.decode(b"", final=True)
+            self._parse()
+        if not self.done:
+            raise ValueError("Truncated or malformed top articles payload")
+        return TopArticles(self.titles, self.views)
+
+    def _parse(self):
+        buffer = self._buffer
+        pos = 0
+        if not self._in_articles:
+            match = ARTICLES_ARRAY_START.search(buffer)
+            if match is None:
+                # Keep enough of the tail for a key split across chunks.
+                self._buffer = buffer[-64:]
+                return
+            self._in_articles = True
+            pos = match.end()
+
+        array_end = buffer.find("]", pos)
+        last_entry_end = buffer.rfind(
+            "}", pos, len(buffer) if array_end == -1 else array_end
+        )
+        if last_entry_end != -1:
+            entries = buffer[pos:last_entry_end + 1].lstrip(" \t\r\n,")
+            articles = json.loads(f"[{entries}]")
+            self.titles += [article["article"] for article in articles]
+            self.views += [article["views"] for article in articles]
+            pos = last_entry_end + 1
+        if array_end != -1:
+            if buffer[pos:array_end].strip(" \t\r\n,"):
+                raise ValueError("Malformed top articles payload")
+            self.done = True
+        self._buffer = buffer[pos:]
+
+
+def parse_top_articles(resp, day):
+    if not resp.ok:
+        # Read the error body so the streamed connection is released.
+        resp.content
+    if has_no_data(resp):
+        LOGGER.warning(f"Missing data for {day.year}-{day.month}"
+                       + f"-{day.day}")
+        return None
+    resp.raise_for_status()
+
+    parser = TopArticlesParser()
+    try:
+        for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+            parser.feed(chunk)
+    finally:
+        # Hand the connection back even if the body was not fully read.
+        resp.close()
+    return parser.close()
+
+
+async def parse_top_articles_async(resp, day):
+    if resp.is_error:
+        await resp.aread()
+    if has_no_data(resp):
+        LOGGER.warning(f"Missing data for {day.year}-{day.month}"
+                       + f"-{day.day}")
+        return None
+    resp.raise_for_status()
+
+    parser = TopArticlesParser()
+    async for chunk in resp.aiter_bytes(STREAM_CHUNK_SIZE):
+        parser.feed(chunk)
+    return parser.close()
+
+
+def parse_per_article(resp, title, start_date, end_date):
+    if has_no_data(resp):
+        LOGGER.warning(f"No data for {title} between {start_date} "
+                       + f"and {end_date}")
+        return None
+    resp.raise_for_status()
+
+    return resp.json()["items"]
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls made with the same key into one: the first
+    caller runs the function and every caller that arrives while it is
+    still running waits for, and shares, its result or exception.
+    """
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = self.Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines running on a single event loop."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # A waiter being cancelled must not cancel the shared fetch.
+        return await asyncio.shield(task)
+
+
+class TokenBucket:
+    """
+    Rate limiter allowing rate calls per second on average, in bursts of
+    up to burst calls. A rate of None disables the limit. Every caller can
+    also be held back for a while with pause().
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """
+        Take a token and return the number of seconds to wait before using
+        it. Returns None, without taking a token, if that would be longer
+        than max_wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0, self._paused_until - now)
+            if self.rate:
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated) * self.rate,
+                )
+                self._updated = now
+                if self._tokens < 1:
+                    wait = max(wait, (1 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            if self.rate:
+                self._tokens -= 1
+            return wait
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(
+                self._paused_until, time.monotonic() + seconds
+            )
+
+
+class UpstreamScheduler:
+    """
+    Paces and retries the requests made to Wikimedia.
+
+    Requests are spaced out by a TokenBucket, which every request waits on
+    for as long as a 429 response's Retry-After asks. Requests failing with
+    a status in RETRY_STATUSES, a timeout or a connection error are retried
+    up to max_retries times after an exponential backoff with full jitter.
+    No wait is started that would end past the deadline of the API request
+    being served (see deadline()).
+    """
+
+    def __init__(self, rate=None, burst=1, max_retries=3, backoff_base=0.25,
+                 backoff_max=8):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without a deadline."""
+        deadline_at = request_deadline.get()
+        return None if deadline_at is None else deadline_at - time.monotonic()
+
+    def acquire(self, path):
+        """
+        Return the number of seconds to wait before requesting path. Raises
+        GatewayTimeout if the request could not start before the deadline.
+        """
+        wait = self.bucket.reserve(self.remaining())
+        if wait is None:
+            LOGGER.error(f"No time left in the budget to request {path}")
+            raise GatewayTimeout("Timed out waiting for Wikimedia")
+        return wait
+
+    def timeout(self, connect_timeout, read_timeout):
+        """Per-attempt timeouts, shortened to fit within the deadline."""
+        remaining = self.remaining()
+        if remaining is None:
+            return (connect_timeout, read_timeout)
+        remaining = max(remaining, 0.001)
+        return (min(connect_timeout, remaining), min(read_timeout, remaining))
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Return the number of seconds to wait before retrying after the
+        given (0-based) attempt failed, or None to give up.
+        """
+        if attempt >= self.max_retries:
+            return None
+        if retry_after is not None:
+            self.bucket.pause(retry_after)
+        wait = max(
+            random.uniform(
+                0, min(self.backoff_max, self.backoff_base * 2 ** attempt)
+            ),
+            retry_after or 0,
+        )
+        remaining = self.remaining()
+        if remaining is not None and wait >= remaining:
+            return None
+        return wait
+
+
+def retry_after(resp):
+    if resp.status_code not in (429, 503):
+        return None
+    return parse_retry_after(resp.headers.get("Retry-After"))
+
+
+class WikimediaClient:
+    """
+    HTTP client for the Wikimedia REST API.
+
+    A single instance is meant to be shared by every request handler: the
+    underlying session keeps connections to Wikimedia alive and pooled so
+    that consecutive calls skip the TCP and TLS handshakes. Identical
+    requests made concurrently are coalesced into a single upstream call,
+    and every call is paced and retried by an UpstreamScheduler.
+    """
+
+    def __init__(self, base_url=WIKIMEDIA_BASE_URL, pool_connections=10,
+                 pool_maxsize=10, connect_timeout=3.05, read_timeout=10,
+                 scheduler=None):
+        """
+        pool_connections is the number of per-host pools to keep around,
+        pool_maxsize the number of connections kept open to each host.
+        Callers wait for a free connection instead of opening extra ones
+        once a host's pool is exhausted.
+        """
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.scheduler = scheduler or UpstreamScheduler()
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(USER_AGENT_HEADER)
+        self.session.headers.update({"Connection": "keep-alive"})
+        self.single_flight = SingleFlight()
+
+    def get(self, path, **kwargs):
+        """
+        GET a path, retrying as the scheduler allows. The response of the
+        last attempt is returned whatever its status.
+        """
+        for attempt in itertools.count():
+            time.sleep(self.scheduler.acquire(path))
+            try:
+                resp = self._send(path, **kwargs)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                wait = self.scheduler.backoff(attempt)
+                if wait is None:
+                    if isinstance(e, requests.Timeout):
+                        LOGGER.error(f"Timed out requesting {path}")
+                        raise GatewayTimeout(
+                            "Timed out waiting for Wikimedia"
+                        )
+                    raise
+                LOGGER.warning(f"Retrying {path} in {wait:.2f}s: {e!r}")
+                time.sleep(wait)
+                continue
+
+            if resp.status_code not in RETRY_STATUSES:
+                return resp
+            wait = self.scheduler.backoff(attempt, retry_after(resp))
+            if wait is None:
+                return resp
+            # Read the error body so the connection is released.
+            resp.content
+            LOGGER.warning(f"Retrying {path} in {wait:.2f}s after a "
+                           + f"{resp.status_code}")
+            time.sleep(wait)
+
+    def _send(self, path, **kwargs):
+        with metrics.track_upstream(endpoint_name(path)) as call:
+            try:
+                resp = self.session.get(
+                    f"{self.base_url}{path}",
+                    timeout=self.scheduler.timeout(*self.timeout),
+                    **kwargs,
+                )
+            except requests.Timeout:
+                call.status = "timeout"
+                raise
+            call.status = resp.status_code
+            return resp
+
+    def top_articles(self, day, project=WIKIMEDIA_PROJECT_PARAM,
+                     access=WIKIMEDIA_ACCESS_PARAM):
+        """
+        Fetch the top articles for a single day as TopArticles, parsing the
+        body as it streams in. Returns None when Wikimedia has no data
+        loaded for that day.
+        """
+        path = top_articles_path(day, project, access)
+
+        def fetch():
+            resp = self.get(path, stream=True)
+            with metrics.PARSE_DURATION.time("top"):
+                return parse_top_articles(resp, day)
+
+        return self.single_flight.do(path, fetch)
+
+    def per_article(self, title, start_date, end_date,
+                    project=WIKIMEDIA_PROJECT_PARAM,
+                    access=WIKIMEDIA_ACCESS_PARAM,
+                    agent=WIKIMEDIA_AGENT_PARAM):
+        """
+        Fetch the daily views of an article between two dates (inclusive).
+        Returns None when Wikimedia has no data loaded for that range.
+        """
+        path = per_article_path(
+            title, start_date, end_date, project, access, agent
+        )
+
+        def fetch():
+            LOGGER.info(f"Requesting with start date: {start_date} and "
+                        + f"end date: {end_date}")
+            resp = self.get(path)
+            with metrics.PARSE_DURATION.time("per-article"):
+                return parse_per_article(resp, title, start_date, end_date)
+
+        return self.single_flight.do(path, fetch)
+
+
+class AsyncWikimediaClient:
+    """
+    Non-blocking counterpart of WikimediaClient for asyncio code, built on
+    httpx. It pools and keeps connections alive the same way, with at most
+    pool_maxsize connections open at once, coalesces identical in-flight
+    requests and paces and retries them with an UpstreamScheduler, which
+    can be shared with a WikimediaClient.
+    """
+
+    def __init__(self, base_url=WIKIMEDIA_BASE_URL, pool_maxsize=10,
+                 connect_timeout=3.05, read_timeout=10, transport=None,
+                 scheduler=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.scheduler = scheduler or UpstreamScheduler()
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=USER_AGENT_HEADER,
+            limits=httpx.Limits(
+                max_connections=pool_maxsize,
+                max_keepalive_connections=pool_maxsize,
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            transport=transport,
+        )
+        self.single_flight = AsyncSingleFlight()
+
+    async def get(self, path, stream=False):
+        """
+        GET a path, retrying as the scheduler allows. The response of the
+        last attempt is returned whatever its status. With stream=True its
+        body is left unread and the caller must close it.
+        """
+        for attempt in itertools.count():
+            await asyncio.sleep(self.scheduler.acquire(path))
+            try:
+                resp = await self._send(path, stream)
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                wait = self.scheduler.backoff(attempt)
+                if wait is None:
+                    if isinstance(e, httpx.TimeoutException):
+                        LOGGER.error(f"Timed out requesting {path}")
+                        raise GatewayTimeout(
+                            "Timed out waiting for Wikimedia"
+                        )
+                    raise
+                LOGGER.warning(f"Retrying {path} in {wait:.2f}s: {e!r}")
+                await asyncio.sleep(wait)
+                continue
+
+            if resp.status_code not in RETRY_STATUSES:
+                return resp
+            wait = self.scheduler.backoff(attempt, retry_after(resp))
+            if wait is None:
+                return resp
+            await resp.aclose()
+            LOGGER.warning(f"Retrying {path} in {wait:.2f}s after a "
+                           + f"{resp.status_code}")
+            await asyncio.sleep(wait)
+
+    async def _send(self, path, stream):
+        connect_timeout, read_timeout = self.scheduler.timeout(*self.timeout)
+        request = self.client.build_request(
+            "GET", path,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+        with metrics.track_upstream(endpoint_name(path)) as call:
+            try:
+                resp = await self.client.send(request, stream=stream)
+            except httpx.TimeoutException:
+                call.status = "timeout"
+                raise
+            call.status = resp.status_code
+            return resp
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def top_articles(self, day, project=WIKIMEDIA_PROJECT_PARAM,
+                           access=WIKIMEDIA_ACCESS_PARAM):
+        path = top_articles_path(day, project, access)
+
+        async def fetch():
+            resp = await self.get(path, stream=True)
+            try:
+                with metrics.PARSE_DURATION.time("top"):
+                    return await parse_top_articles_async(resp, day)
+            except httpx.TimeoutException:
+                LOGGER.error(f"Timed out reading {path}")
+                raise GatewayTimeout("Timed out waiting for Wikimedia")
+            finally:
+                await resp.aclose()
+
+        return await self.single_flight.do(path, fetch)
+
+    async def per_article(self, title, start_date, end_date,
+                          project=WIKIMEDIA_PROJECT_PARAM,
+                          access=WIKIMEDIA_ACCESS_PARAM,
+                          agent=WIKIMEDIA_AGENT_PARAM):
+        path = per_article_path(
+            title, start_date, end_date, project, access, agent
+        )
+
+        async def fetch():
+            LOGGER.info(f"Requesting with start date: {start_date} and "
+                        + f"end date: {end_date}")
+            resp = await self.get(path)
+            with metrics.PARSE_DURATION.time("per-article"):
+                return parse_per_article(resp, title, start_date, end_date)
+
+        return await self.single_flight.do(path, fetch)
@@ -0,0 +1,165 @@
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+from cache import utc_today
+from pageviews import last_day_of_month
+from store import rank
+from upstream import (
+    WIKIMEDIA_ACCESS_PARAM,
+    WIKIMEDIA_AGENT_PARAM,
+    WIKIMEDIA_PROJECT_PARAM,
+)
+
+
+LOGGER = logging.getLogger("pageviewsApi")
+
+
+def months_between(start_month, end_month):
+    """List the (year, month) pairs from one month to another, inclusive."""
+    months = []
+    year, month = start_month
+    while (year, month) <= end_month:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def previous_month(day):
+    last_day = day.replace(day=1) - timedelta(days=1)
+    return last_day.year, last_day.month
+
+
+class Warmer:
+    """
+    Precomputes the data behind queries for closed periods: each day's top
+    articles once the day is over and, once a month is over, its aggregate
+    of top articles plus the daily views of its top_articles most viewed
+    articles.
+
+    Everything is materialized through the pageviews service, so queries are
+    then answered from its caches and store. A background thread can run
+    the warm-up every interval seconds; backfill() warms past months.
+    """
+
+    def __init__(self, pageviews, project=WIKIMEDIA_PROJECT_PARAM,
+                 access=WIKIMEDIA_ACCESS_PARAM, agent=WIKIMEDIA_AGENT_PARAM,
+                 top_articles=100, interval=3600):
+        self.pageviews = pageviews
+        self.project = project
+        self.access = access
+        self.agent = agent
+        self.top_articles = top_articles
+        self.interval = interval
+        self.warmed_months = set()
+        self.last_warmed_day = None
+        self.last_run_started = None
+        self.last_run_finished = None
+        self.last_error = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def warm_day(self, day):
+        """Fetch a day's top articles. Returns whether data was available."""
+        snapshot = self.pageviews.top_articles(day, self.project, self.access)
+        if snapshot is None:
+            return False
+        self.last_warmed_day = max(day, self.last_warmed_day or day)
+        return True
+
+    def warm_month(self, year, month):
+        """
+        Materialize a month's aggregate of top articles and the daily views
+        of its most viewed articles. Returns whether the month's data was
+        complete.
+        """
+        start_date = date(year, month, 1)
+        end_date = last_day_of_month(year, month)
+        title_ids, totals = self.pageviews.top_articles_range(
+            start_date, end_date, self.project, self.access
+        )
+
+        titles = [
+            self.pageviews.titles.title(title_id)
+            for title_id in title_ids[rank(totals, self.top_articles)].tolist()
+        ]
+        self.pageviews.map_concurrently(
+            lambda title: self.pageviews.daily_views(
+                title, start_date, end_date,
+                self.project, self.access, self.agent,
+            ),
+            titles,
+        )
+
+        complete = self.pageviews.month_aggregate(
+            year, month, self.project, self.access
+        ) is not None
+        if complete:
+            self.warmed_months.add((year, month))
+        else:
+            LOGGER.warning(f"Data for {year}-{month:02} is incomplete")
+        return complete
+
+    def backfill(self, start_month, end_month):
+        """
+        Warm every month between two (year, month) pairs, inclusive. Returns
+        the months whose data was incomplete.
+        """
+        incomplete = []
+        for year, month in months_between(start_month, end_month):
+            LOGGER.info(f"Backfilling {year}-{month:02}")
+            if not self.warm_month(year, month):
+                incomplete.append((year, month))
+        return incomplete
+
+    def run_once(self, today=None):
+        """Warm the last closed day and, if not done yet, the last month."""
+        today = today or utc_today()
+        self.last_run_started = datetime.now(timezone.utc)
+        try:
+            self.warm_day(today - timedelta(days=1))
+            if previous_month(today) not in self.warmed_months:
+                self.warm_month(*previous_month(today))
+            self.last_error = None
+        except Exception as e:
+            LOGGER.exception("Warm-up failed")
+            self.last_error = str(e)
+        self.last_run_finished = datetime.now(timezone.utc)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="warmup", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.run_once()
+            self._stopping.wait(self.interval)
+
+    def status(self):
+        def isoformat(value):
+            return value.isoformat() if value else None
+
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "project": self.project,
+            "access": self.access,
+            "interval": self.interval,
+            "last_run_started": isoformat(self.last_run_started),
+            "last_run_finished": isoformat(self.last_run_finished),
+            "last_error": self.last_error,
+            "last_warmed_day": isoformat(self.last_warmed_day),
+            "warmed_months": [
+                f"{year}-{month:02}"
+                for year, month in sorted(self.warmed_months)
+            ],
+        }